@@ -0,0 +1,3 @@
+""" Offline benchmarks of the ELTP steps, run against in-process stand-ins of
+S3 and of the dataflow database. The stand-ins, with those of the SFTP and
+HTTP sources, are also used by the tests. """
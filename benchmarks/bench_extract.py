@@ -0,0 +1,395 @@
+""" Offline benchmark of the extract path.
+
+Runs :meth:`visitdata.models.operators.ExtractOperator.execute_step`,
+:meth:`visitdata.models.hooks.VDS3Hook.fetch_files` and
+:meth:`visitdata.models.hooks.VDDataflowHook.save_dataset` over a synthetic
+FTP folder, against the in-process S3 stand-in of
+:mod:`benchmarks.local_s3` and a SQLite or PostgreSQL database::
+
+    python -m benchmarks.bench_extract --keys 10,10000 --latency-ms 5
+
+The stand-ins are registered in :data:`visitdata.models.hooks.REGISTRY`,
+so the hooks run their real code paths without any network access. Every
+scenario runs in a forked process, with its own registry and its own peak
+RSS.
+
+Results are appended as JSON lines to ``bench_output.txt``: wall time, S3
+requests by operation, database round trips and peak RSS, tagged with the
+commit they were measured on so that runs can be compared between commits.
+
+The database given with ``--db`` is emptied before every scenario: only
+use a scratch database. By default, a temporary SQLite file is used.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, event
+
+from benchmarks.local_s3 import LocalS3Client, LocalS3Resource
+
+BUCKET = "visitdata-bench"
+FTP_PREFIX = "FileServer/Ftp"
+DATALAKE_PREFIX = "Datalake/Datahub"
+ORGANISATION_ID = 1
+DATASOURCE_ID = 1
+DATATASK_ID = 1
+PROTOCOL_ID = "1"
+
+SCENARIOS = {}
+
+
+def scenario(function):
+    """ Register a scenario, run with the environment and the options and
+    returning the number of items it processed. """
+    SCENARIOS[function.__name__] = function
+    return function
+
+
+class BenchEnvironment:
+    """ S3 stand-in and database of a scenario, registered in the hook
+    registry in place of the real ones.
+
+    Only the boto3 resource of the current thread is registered: resources
+    are used by :meth:`VDS3Hook.fetch_files`, which runs in the main thread,
+    while the extract workers only use the client.
+
+    Arguments:
+        keys {int} -- Number of files in the FTP folder.
+        object_size {int} -- Size of every file, in bytes.
+        latency {float} -- Seconds slept by every S3 request.
+        db_url {str} -- SQLAlchemy URL of the database.
+    """
+
+    def __init__(self, keys: int, object_size: int, latency: float,
+                 db_url: str):
+        os.environ.update({
+            "VD_S3_DEFAULT_BUCKET": BUCKET,
+            "VD_S3_FTP_PREFIX": FTP_PREFIX,
+            "VD_S3_DATALAKE_PREFIX": DATALAKE_PREFIX,
+        })
+        self.keys = keys
+        self.source_path = f"{FTP_PREFIX}/client-{ORGANISATION_ID}/data/"
+        self.s3 = LocalS3Client(latency=latency)
+        self.s3.populate(BUCKET, self.iter_keys(), object_size)
+        connect_args = ({"check_same_thread": False}
+                        if db_url.startswith("sqlite") else {})
+        self.engine = create_engine(db_url, connect_args=connect_args)
+        self.statements = 0
+        self.commits = 0
+        self.__create_tables()
+        event.listen(self.engine, "before_cursor_execute", self.__count)
+        event.listen(self.engine, "commit", self.__count_commit)
+        self.__register()
+
+    def iter_keys(self):
+        """ Keys of the files in the FTP folder. """
+        for index in range(self.keys):
+            yield f"{self.source_path}file-{index:07d}.csv"
+
+    def __count(self, *args):
+        self.statements += 1
+
+    def __count_commit(self, *args):
+        self.commits += 1
+
+    def __create_tables(self):
+        """ Create the dataflow tables, remove their rows and insert the
+        benchmarked DataTask, with a single protocol matching every file.
+        """
+        from visitdata.models.sources import (
+            Base, DataTask, Datasource, DatasourceProtocol, Organisation)
+        from sqlalchemy.orm import sessionmaker
+        Base.metadata.create_all(self.engine)
+        session = sessionmaker(bind=self.engine)()
+        try:
+            for table in reversed(Base.metadata.sorted_tables):
+                session.execute(table.delete())
+            session.add(Organisation(id=ORGANISATION_ID))
+            session.add(Datasource(
+                id=DATASOURCE_ID, enabled=True, name="bench",
+                organisation_id=ORGANISATION_ID))
+            session.add(DataTask(
+                id=DATATASK_ID, code="bench", name="bench",
+                datasource_id=DATASOURCE_ID))
+            session.add(DatasourceProtocol(
+                id=PROTOCOL_ID, name="bench", enabled=True,
+                data_path="data/", data_file="*.csv", source_type="s3",
+                datasource_id=DATASOURCE_ID,
+                organisation_id=ORGANISATION_ID))
+            session.commit()
+        finally:
+            session.close()
+
+    def __register(self):
+        from visitdata.models.hooks import REGISTRY
+        from visitdata.settings import get_connections
+        for connection in get_connections():
+            REGISTRY.connection(
+                connection.conn_id, lambda connection=connection: connection)
+        REGISTRY.client(("VD_S3", "s3", None), lambda: self.s3)
+        REGISTRY.resource(("VD_S3", "s3", None),
+                          lambda: LocalS3Resource(self.s3))
+        REGISTRY.engine("VD_RS", lambda: self.engine)
+
+    def reset_counters(self):
+        """ Forget the requests and round trips of the setup. """
+        self.s3.requests.clear()
+        self.statements = 0
+        self.commits = 0
+
+
+def _extract_operator_class():
+    from visitdata.models.operators import ExtractOperator
+
+    class BenchExtractOperator(ExtractOperator):
+        """ Extract operator accepting every file, with a small context. """
+
+        def check_format(self, file) -> bool:
+            return True
+
+        def create_context(self, file) -> dict:
+            return {"name": file.name, "size": file.size}
+
+    return BenchExtractOperator
+
+
+@scenario
+def extract(env: BenchEnvironment, options) -> int:
+    """ Run the whole extract step of the DataTask. """
+    from visitdata.models.hooks import VDS3Hook
+    operator = _extract_operator_class()(
+        task_id="bench_extract",
+        datahub_task_id=DATATASK_ID,
+        hook=VDS3Hook,
+        max_workers=options.workers,
+        dataset_batch_size=options.batch_size,
+        lazy_listing=options.lazy)
+    operator.datasource = \
+        operator._datasource_hook.retrieve_datasource_snapshot(DATATASK_ID)
+    env.reset_counters()
+    operator.execute_step()
+    return env.keys
+
+
+@scenario
+def fetch_files(env: BenchEnvironment, options) -> int:
+    """ List the folder and load every matching object. """
+    from visitdata.models.hooks import VDS3Hook, shared_hook
+    return len(shared_hook(VDS3Hook).fetch_files(
+        env.source_path, mask="*.csv"))
+
+
+@scenario
+def fetch_data(env: BenchEnvironment, options) -> int:
+    """ List the folder lazily, as the extract step does. """
+    from visitdata.models.hooks import VDS3Hook, shared_hook
+    return sum(1 for _ in shared_hook(VDS3Hook).fetch_data(
+        env.source_path, mask="*.csv", lazy=True))
+
+
+def _iter_datasets(env: BenchEnvironment, protocol):
+    from visitdata.models.datasets import S3VDDataset
+    for key in env.iter_keys():
+        yield S3VDDataset(BUCKET, key).to_datasource_dataset(protocol)
+
+
+@scenario
+def save_dataset(env: BenchEnvironment, options) -> int:
+    """ Insert a dataset per file, one commit each. """
+    from visitdata.models.hooks import VDDataflowHook
+    hook = VDDataflowHook()
+    protocol = hook.retrieve_datasource_snapshot(DATATASK_ID).protocols[0]
+    env.reset_counters()
+    for dataset in _iter_datasets(env, protocol):
+        hook.save_dataset(dataset)
+    return env.keys
+
+
+@scenario
+def dataset_batch(env: BenchEnvironment, options) -> int:
+    """ Insert a dataset per file with a batch, for comparison with
+    :func:`save_dataset`. """
+    from visitdata.models.hooks import VDDataflowHook
+    hook = VDDataflowHook()
+    protocol = hook.retrieve_datasource_snapshot(DATATASK_ID).protocols[0]
+    env.reset_counters()
+    with hook.dataset_batch(chunk_size=options.batch_size or None) as batch:
+        for dataset in _iter_datasets(env, protocol):
+            batch.add(dataset)
+    return env.keys
+
+
+def _peak_rss_kb() -> int:
+    """ Peak resident set size of the process, in kB. """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kB elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_scenario(name: str, keys: int, options) -> dict:
+    """ Set up the environment and run a scenario in the current process.
+
+    Returns:
+        dict -- The measures of the run.
+    """
+    directory = None
+    db_url = options.db
+    if db_url is None:
+        directory = tempfile.mkdtemp(prefix="visitdata-bench-")
+        db_url = f"sqlite:///{directory}/dataflow.db"
+    result = {"scenario": name, "keys": keys}
+    try:
+        env = BenchEnvironment(keys, options.object_size,
+                               options.latency_ms / 1000, db_url)
+        result["setup_rss_kb"] = _peak_rss_kb()
+        env.reset_counters()
+        start = time.perf_counter()
+        try:
+            result["items"] = SCENARIOS[name](env, options)
+        except Exception as error:  # pylint: disable=broad-except
+            result["error"] = repr(error)
+        result["wall_seconds"] = time.perf_counter() - start
+        result["peak_rss_kb"] = _peak_rss_kb()
+        result["requests"] = sum(env.s3.requests.values())
+        result["requests_by_operation"] = dict(env.s3.requests)
+        result["db_statements"] = env.statements
+        result["db_commits"] = env.commits
+        result["db_round_trips"] = env.statements + env.commits
+        env.engine.dispose()
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+def _run_in_child(queue, name, keys, options):
+    try:
+        queue.put(run_scenario(name, keys, options))
+    except Exception as error:  # pylint: disable=broad-except
+        queue.put({"scenario": name, "keys": keys, "error": repr(error)})
+
+
+def run_forked(name: str, keys: int, options) -> dict:
+    """ Run a scenario in a forked process, so that it starts from a clean
+    hook registry and its peak RSS is its own. """
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(
+        target=_run_in_child, args=(queue, name, keys, options))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def git_commit() -> str:
+    """ Commit of the working tree, or None outside of a git repository.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], check=True, capture_output=True,
+            text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _int_list(value: str) -> list:
+    return [int(item) for item in value.split(",") if item]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.bench_extract",
+        description="Benchmark the extract path against local stand-ins.")
+    parser.add_argument(
+        "--keys", type=_int_list, default=[10, 10000, 1000000],
+        help="Comma separated numbers of files in the FTP folder "
+             "(default: 10,10000,1000000).")
+    parser.add_argument(
+        "--object-size", type=int, default=1024,
+        help="Size of every file in bytes (default: 1024).")
+    parser.add_argument(
+        "--latency-ms", type=float, default=0.0,
+        help="Latency injected in every S3 request (default: 0).")
+    parser.add_argument(
+        "--db", default=None,
+        help="SQLAlchemy URL of a scratch database, emptied before every "
+             "scenario (default: a temporary SQLite file).")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Files extracted concurrently (default: 1).")
+    parser.add_argument(
+        "--batch-size", type=int, default=0,
+        help="Datasets persisted per batch, 0 to commit every dataset "
+             "(default: 0).")
+    parser.add_argument(
+        "--lazy", action="store_true",
+        help="List the FTP folder lazily during the extract step.")
+    parser.add_argument(
+        "--scenarios", type=lambda value: value.split(","),
+        default=list(SCENARIOS),
+        help=f"Comma separated scenarios among {', '.join(SCENARIOS)} "
+             "(default: all).")
+    parser.add_argument(
+        "--output", default="bench_output.txt",
+        help="File the JSON lines are appended to, - for the standard "
+             "output (default: bench_output.txt).")
+    parser.add_argument(
+        "--verbose", action="store_true",
+        help="Keep the INFO logs of the operators and hooks.")
+    options = parser.parse_args(argv)
+    unknown = set(options.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    if not options.verbose:
+        logging.disable(logging.INFO)
+    run = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "object_size": options.object_size,
+        "latency_ms": options.latency_ms,
+        "workers": options.workers,
+        "batch_size": options.batch_size,
+        "lazy": options.lazy,
+        "db": "sqlite" if options.db is None
+              else options.db.split(":", 1)[0],
+    }
+    output = (sys.stdout if options.output == "-"
+              else open(options.output, "a"))
+    try:
+        for keys in options.keys:
+            for name in options.scenarios:
+                result = dict(run, **run_forked(name, keys, options))
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+                print(f"{name} keys={keys}: "
+                      f"{result.get('wall_seconds', 0):.3f}s "
+                      f"requests={result.get('requests')} "
+                      f"db_round_trips={result.get('db_round_trips')} "
+                      f"peak_rss_kb={result.get('peak_rss_kb')}"
+                      + (f" error={result['error']}"
+                         if "error" in result else ""),
+                      file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+""" Local stand-in of a paginated HTTP/REST API exposing files, served by a
+thread of the current process, with request counting, injected latency and
+tracking of the concurrent requests.
+
+Files only store their size: their content is generated on download, and
+their ETag derived from their name. They are downloaded from ``/download/``
+URLs which do not end with their name, as with most APIs.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+CHUNK_SIZE = 64 * 1024
+
+
+class LocalHTTPHandler(BaseHTTPRequestHandler):
+    """ Handle the requests of :class:`LocalHTTPServer`:
+
+    - ``GET /files?page=<n>`` lists a page of files,
+    - ``GET /download/<index>`` downloads a file,
+    - ``DELETE /download/<index>`` removes it.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def __send_json(self, content, headers=None):
+        body = json.dumps(content).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __send_status(self, status: int):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def __list(self, query: dict):
+        page = int(query.get("page", ["0"])[0])
+        items, next_url = self.server.stand_in.page(page)
+        if not self.server.stand_in.link_header:
+            self.__send_json({"items": items, "next": next_url})
+        elif next_url:
+            self.__send_json(items, {"Link": f'<{next_url}>; rel="next"'})
+        else:
+            self.__send_json(items)
+
+    def __download(self, size: int):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        while size:
+            chunk = min(size, CHUNK_SIZE)
+            self.wfile.write(b"\0" * chunk)
+            size -= chunk
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        url = urlsplit(self.path)
+        stand_in = self.server.stand_in
+        if url.path == "/files":
+            with stand_in.request("List"):
+                self.__list(parse_qs(url.query))
+            return
+        with stand_in.request("Download"):
+            size = stand_in.size(url.path)
+            if size is None:
+                self.__send_status(404)
+            else:
+                self.__download(size)
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        stand_in = self.server.stand_in
+        with stand_in.request("Delete"):
+            self.__send_status(
+                200 if stand_in.remove(urlsplit(self.path).path) else 404)
+
+
+class LocalHTTPServer:
+    """ Stand-in of a HTTP/REST API exposing files, listening on a free
+    port of the loopback interface while it is used as a context manager.
+
+    Pages are lists of files, linked by the ``Link`` header, or objects
+    holding them in their ``items`` field, linked by their ``next`` field.
+
+    Arguments:
+        files {int} -- Number of files, named ``file-<index>.csv``.
+        size {int} -- Size of every file, in bytes.
+
+    Keyword Arguments:
+        page_size {int} -- Files listed per page. (default: {100})
+        latency {float} -- Seconds slept by every request. (default: {0})
+        link_header {bool} -- Whether pages are linked by the ``Link``
+            header rather than by their ``next`` field. (default: {True})
+    """
+
+    def __init__(self, files: int, size: int, page_size: int = 100,
+                 latency: float = 0.0, link_header: bool = True):
+        self.page_size = page_size
+        self.latency = latency
+        self.link_header = link_header
+        self.requests = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.modified = datetime.now(timezone.utc)
+        self._lock = threading.Lock()
+        self._files = {f"/download/{index}": (f"file-{index:07d}.csv", size)
+                       for index in range(files)}
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """ Base URL of the server. """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(
+            ("127.0.0.1", 0), LocalHTTPHandler)
+        self._server.daemon_threads = True
+        self._server.stand_in = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    @contextmanager
+    def request(self, operation: str):
+        """ Count a request, and track it while it is handled. """
+        with self._lock:
+            self.requests[operation] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def page(self, page: int) -> tuple:
+        """ Returns the files of a page, and the URL of the next page or
+        None. """
+        with self._lock:
+            files = sorted(self._files.items())
+        start = page * self.page_size
+        items = []
+        for url, (name, size) in files[start:start + self.page_size]:
+            items.append({
+                "name": name,
+                "url": url,
+                "size": size,
+                "etag": hashlib.md5(f"{name}/{size}".encode()).hexdigest(),
+                "modified": self.modified.isoformat(),
+            })
+        next_url = (f"/files?page={page + 1}"
+                    if start + self.page_size < len(files) else None)
+        return items, next_url
+
+    def size(self, path: str) -> int:
+        """ Returns the size of the file downloaded from ``path``, or None
+        if there is none. """
+        with self._lock:
+            file = self._files.get(path)
+        return file[1] if file else None
+
+    def remove(self, path: str) -> bool:
+        """ Remove the file downloaded from ``path``. """
+        with self._lock:
+            return self._files.pop(path, None) is not None
+
+    def names(self) -> list:
+        """ Names of the remaining files. """
+        with self._lock:
+            return sorted(name for name, _ in self._files.values())
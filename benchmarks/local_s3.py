@@ -0,0 +1,336 @@
+""" In-process stand-in of the S3 API, implementing the subset of the boto3
+client and resource used by the hooks, with request counting and injected
+latency.
+
+Objects only store their size and modification time: their content is
+generated on read and their ETag derived from their key, so that millions of
+keys fit in memory (about 200 MB per million keys). Clients created with
+``keep_content`` also store the content written to them, i.e. to run the
+transform and load steps over the extracted files.
+"""
+import bisect
+import hashlib
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from botocore.exceptions import ClientError
+
+
+class LocalBody:
+    """ Streamed body of an object, like
+    :class:`botocore.response.StreamingBody`, made of null bytes if its
+    content is not stored. """
+
+    def __init__(self, size: int, content: bytes = None):
+        self._remaining = size
+        self._content = content
+
+    def read(self, amount: int = None) -> bytes:
+        if amount is None or amount > self._remaining:
+            amount = self._remaining
+        if self._content is None:
+            self._remaining -= amount
+            return b"\0" * amount
+        offset = len(self._content) - self._remaining
+        self._remaining -= amount
+        return self._content[offset:offset + amount]
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self._remaining = 0
+
+
+class LocalPaginator:
+    """ Paginator of ``list_objects_v2``. """
+
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket, Prefix='', PaginationConfig=None, **kwargs):
+        page_size = (PaginationConfig or {}).get('PageSize') or 1000
+        token = None
+        while True:
+            params = {'Bucket': Bucket, 'Prefix': Prefix, 'MaxKeys': page_size}
+            if token:
+                params['ContinuationToken'] = token
+            page = self.client.list_objects_v2(**params)
+            yield page
+            if not page['IsTruncated']:
+                return
+            token = page['NextContinuationToken']
+
+
+class LocalS3Client:
+    """ Stand-in of a boto3 S3 client.
+
+    Keys are sharded by their first path segment, each shard being a sorted
+    list, so that writes in one folder (i.e. the datalake) do not slow down
+    the listing of another (i.e. the FTP folders).
+
+    Keyword Arguments:
+        latency {float} -- Seconds slept by every request. (default: {0})
+        keep_content {bool} -- Whether to store the content of the objects
+            written with requests. (default: {False})
+    """
+
+    def __init__(self, latency: float = 0.0, keep_content: bool = False):
+        self.latency = latency
+        self.keep_content = keep_content
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._shards = {}
+        self._uploads = {}
+
+    def __request(self, operation: str):
+        with self._lock:
+            self.requests[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def __shard(self, bucket: str, key: str) -> dict:
+        return self._shards.setdefault(bucket, {}).setdefault(
+            key.split('/', 1)[0], {"keys": [], "sorted": True})
+
+    def __store(self, bucket: str, key: str, size: int, modified=None,
+                content: bytes = None):
+        if not self.keep_content:
+            content = None
+        with self._lock:
+            objects = self._objects.setdefault(bucket, {})
+            if key not in objects:
+                shard = self.__shard(bucket, key)
+                if shard["keys"] and shard["keys"][-1] > key:
+                    shard["sorted"] = False
+                shard["keys"].append(key)
+            objects[key] = (
+                size, modified or datetime.now(timezone.utc), content)
+
+    def populate(self, bucket: str, keys, size: int, content: bytes = None,
+                 modified: datetime = None):
+        """ Create objects without counting requests, of ``size`` null
+        bytes or with ``content`` if it is stored, modified at ``modified``
+        or now. """
+        modified = modified or datetime.now(timezone.utc)
+        if content is not None:
+            size = len(content)
+        for key in keys:
+            self.__store(bucket, key, size, modified, content)
+
+    def __content(self, bucket: str, key: str) -> bytes:
+        """ Stored content of an object, or None. """
+        return self._objects[bucket][key][2]
+
+    @staticmethod
+    def __entry(key: str, stored: tuple) -> dict:
+        size, modified, _ = stored
+        etag = hashlib.md5(f"{key}/{size}".encode()).hexdigest()
+        return {'Key': key, 'Size': size, 'ETag': f'"{etag}"',
+                'LastModified': modified}
+
+    def __object(self, bucket: str, key: str) -> dict:
+        try:
+            return self.__entry(key, self._objects[bucket][key])
+        except KeyError:
+            raise ClientError(
+                {'Error': {'Code': '404', 'Message': 'Not Found'}},
+                'HeadObject')
+
+    def get_paginator(self, operation_name: str):
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(operation_name)
+        return LocalPaginator(self)
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000,
+                        ContinuationToken=None, StartAfter=None, **kwargs):
+        self.__request('ListObjectsV2')
+        objects = self._objects.get(Bucket, {})
+        head, separator, _ = Prefix.partition('/')
+        with self._lock:
+            shards = [shard for segment, shard
+                      in sorted(self._shards.get(Bucket, {}).items())
+                      if (segment == head if separator
+                          else segment.startswith(head))]
+            for shard in shards:
+                if not shard["sorted"]:
+                    shard["keys"] = sorted(
+                        key for key in shard["keys"] if key in objects)
+                    shard["sorted"] = True
+        start = ContinuationToken or StartAfter or Prefix
+        contents = []
+        for shard in shards:
+            keys = shard["keys"]
+            index = bisect.bisect_right(keys, start) \
+                if ContinuationToken or StartAfter \
+                else bisect.bisect_left(keys, start)
+            while index < len(keys) and len(contents) <= MaxKeys:
+                key = keys[index]
+                index += 1
+                if not key.startswith(Prefix):
+                    break
+                if key in objects:
+                    contents.append(self.__entry(key, objects[key]))
+        truncated = len(contents) > MaxKeys
+        contents = contents[:MaxKeys]
+        page = {'KeyCount': len(contents), 'IsTruncated': truncated}
+        if contents:
+            page['Contents'] = contents
+        if truncated:
+            page['NextContinuationToken'] = contents[-1]['Key']
+        return page
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.__request('HeadObject')
+        entry = self.__object(Bucket, Key)
+        return {'ContentLength': entry['Size'], 'ETag': entry['ETag'],
+                'LastModified': entry['LastModified']}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self.__request('GetObject')
+        size = self.__object(Bucket, Key)['Size']
+        content = self.__content(Bucket, Key)
+        if Range:
+            start, end = Range.split('=')[1].split('-')
+            size = min(int(end), size - 1) - int(start) + 1
+            if content is not None:
+                content = content[int(start):int(start) + size]
+        return {'Body': LocalBody(size, content), 'ContentLength': size}
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        self.__request('PutObject')
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        if isinstance(Body, str):
+            Body = Body.encode()
+        self.__store(Bucket, Key, len(Body), content=bytes(Body))
+        return {}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, **kwargs):
+        self.__request('PutObject')
+        size = 0
+        chunks = []
+        for chunk in iter(lambda: Fileobj.read(1024 * 1024), b''):
+            size += len(chunk)
+            if self.keep_content:
+                chunks.append(chunk)
+        self.__store(Bucket, Key, size, content=b''.join(chunks))
+
+    def copy_object(self, CopySource, Bucket, Key, **kwargs):
+        self.__request('CopyObject')
+        size = self.__object(CopySource['Bucket'], CopySource['Key'])['Size']
+        self.__store(Bucket, Key, size, content=self.__content(
+            CopySource['Bucket'], CopySource['Key']))
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.__request('CreateMultipartUpload')
+        upload_id = uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def __add_part(self, upload_id, part_number, size, content=None):
+        if not self.keep_content:
+            content = None
+        with self._lock:
+            self._uploads[upload_id][part_number] = (size, content)
+        return f'"{upload_id}-{part_number}"'
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self.__request('UploadPart')
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        return {'ETag': self.__add_part(
+            UploadId, PartNumber, len(Body), bytes(Body))}
+
+    def upload_part_copy(self, Bucket, Key, UploadId, PartNumber, CopySource,
+                         CopySourceRange=None, **kwargs):
+        self.__request('UploadPartCopy')
+        size = self.__object(CopySource['Bucket'], CopySource['Key'])['Size']
+        content = self.__content(CopySource['Bucket'], CopySource['Key'])
+        if CopySourceRange:
+            start, end = CopySourceRange.split('=')[1].split('-')
+            size = int(end) - int(start) + 1
+            if content is not None:
+                content = content[int(start):int(end) + 1]
+        return {'CopyPartResult': {
+            'ETag': self.__add_part(UploadId, PartNumber, size, content)}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self.__request('CompleteMultipartUpload')
+        with self._lock:
+            parts = [part for _, part
+                     in sorted(self._uploads.pop(UploadId).items())]
+        content = None
+        if all(part_content is not None for _, part_content in parts):
+            content = b''.join(part_content for _, part_content in parts)
+        self.__store(Bucket, Key, sum(size for size, _ in parts),
+                     content=content)
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self.__request('AbortMultipartUpload')
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.__request('DeleteObject')
+        with self._lock:
+            self._objects.get(Bucket, {}).pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self.__request('DeleteObjects')
+        with self._lock:
+            objects = self._objects.get(Bucket, {})
+            for item in Delete['Objects']:
+                objects.pop(item['Key'], None)
+        return {}
+
+
+class LocalS3Object:
+    """ Stand-in of a boto3 ``s3.Object`` resource. """
+
+    def __init__(self, client: LocalS3Client, bucket_name: str, key: str):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.content_length = None
+        self.e_tag = None
+        self.last_modified = None
+
+    def load(self):
+        response = self.client.head_object(
+            Bucket=self.bucket_name, Key=self.key)
+        self.content_length = response['ContentLength']
+        self.e_tag = response['ETag']
+        self.last_modified = response['LastModified']
+
+    def get(self, **kwargs):
+        return self.client.get_object(
+            Bucket=self.bucket_name, Key=self.key, **kwargs)
+
+    def delete(self):
+        return self.client.delete_object(
+            Bucket=self.bucket_name, Key=self.key)
+
+
+class LocalS3Resource:
+    """ Stand-in of a boto3 S3 resource. """
+
+    def __init__(self, client: LocalS3Client):
+        self.meta = type('Meta', (), {'client': client})()
+
+    # pylint: disable=invalid-name
+    def Object(self, bucket_name: str, key: str):
+        return LocalS3Object(self.meta.client, bucket_name, key)
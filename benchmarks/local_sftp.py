@@ -0,0 +1,234 @@
+""" Local stand-in of a SFTP server, serving the files of a temporary folder
+with paramiko in server mode from threads of the current process, with
+request counting, injected latency and tracking of the concurrent requests.
+
+Any login is accepted with the password given to the server. Paths are
+relative to the temporary folder, which is also the root of absolute paths.
+"""
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import paramiko
+
+
+class LocalSFTPHandle(paramiko.SFTPHandle):
+    """ Open file, counted as a request in flight until it is closed. """
+
+    def __init__(self, stand_in, readfile, flags=0):
+        super().__init__(flags)
+        self.readfile = readfile
+        self.stand_in = stand_in
+
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(
+            os.fstat(self.readfile.fileno()))
+
+    def read(self, offset, length):
+        data = super().read(offset, length)
+        if isinstance(data, bytes):
+            self.stand_in.count_read(len(data))
+        return data
+
+    def close(self):
+        super().close()
+        self.stand_in.release()
+
+
+class LocalSFTPInterface(paramiko.SFTPServerInterface):
+    """ Read-only SFTP subsystem over the folder of the server, also
+    allowing the removal of files. """
+
+    def __init__(self, server, stand_in, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.stand_in = stand_in
+
+    def __path(self, path: str) -> str:
+        path = os.path.normpath('/' + path).lstrip('/')
+        return os.path.join(self.stand_in.root, path)
+
+    def list_folder(self, path):
+        with self.stand_in.request("List"):
+            folder = self.__path(path)
+            try:
+                names = os.listdir(folder)
+            except OSError as error:
+                return paramiko.SFTPServer.convert_errno(error.errno)
+            files = []
+            for name in names:
+                attributes = paramiko.SFTPAttributes.from_stat(
+                    os.stat(os.path.join(folder, name)), name)
+                files.append(attributes)
+            return files
+
+    def stat(self, path):
+        with self.stand_in.request("Stat"):
+            try:
+                return paramiko.SFTPAttributes.from_stat(
+                    os.stat(self.__path(path)))
+            except OSError as error:
+                return paramiko.SFTPServer.convert_errno(error.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            return paramiko.SFTP_PERMISSION_DENIED
+        self.stand_in.acquire("Open")
+        try:
+            readfile = open(self.__path(path), 'rb')
+        except OSError as error:
+            self.stand_in.release()
+            return paramiko.SFTPServer.convert_errno(error.errno)
+        return LocalSFTPHandle(self.stand_in, readfile, flags)
+
+    def remove(self, path):
+        with self.stand_in.request("Remove"):
+            try:
+                os.remove(self.__path(path))
+            except OSError as error:
+                return paramiko.SFTPServer.convert_errno(error.errno)
+            return paramiko.SFTP_OK
+
+
+class LocalSSHInterface(paramiko.ServerInterface):
+    """ Authenticate any login with the password of the server, and only
+    open sessions. """
+
+    def __init__(self, password: str):
+        self.password = password
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if password == self.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class LocalSFTPServer:
+    """ Stand-in of a SFTP server, listening on a free port of the loopback
+    interface while it is used as a context manager.
+
+    Requests are counted by operation. Opened files are in flight until
+    they are closed, as downloads are. The bytes sent to the clients are
+    counted in ``bytes_read`` as they are read from the files.
+
+    Keyword Arguments:
+        password {str} -- Password of every login. (default: {"secret"})
+        latency {float} -- Seconds slept by every request. (default: {0})
+    """
+
+    def __init__(self, password: str = "secret", latency: float = 0.0):
+        self.password = password
+        self.latency = latency
+        self.requests = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.bytes_read = 0
+        self.root = None
+        self._lock = threading.Lock()
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._socket = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._transports = []
+
+    @property
+    def port(self) -> int:
+        """ Port the server listens on. """
+        return self._socket.getsockname()[1]
+
+    def __enter__(self):
+        self.root = tempfile.mkdtemp(prefix="visitdata-sftp-")
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(16)
+        self._socket.settimeout(0.1)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.__accept, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+        self._socket.close()
+        with self._lock:
+            transports, self._transports = self._transports, []
+        for transport in transports:
+            transport.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def __accept(self):
+        while not self._stopped.is_set():
+            try:
+                connection, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            connection.settimeout(None)
+            transport = paramiko.Transport(connection)
+            transport.add_server_key(self._host_key)
+            transport.set_subsystem_handler(
+                'sftp', paramiko.SFTPServer, LocalSFTPInterface, self)
+            with self._lock:
+                self._transports.append(transport)
+            try:
+                transport.start_server(
+                    server=LocalSSHInterface(self.password))
+            except (paramiko.SSHException, EOFError):
+                transport.close()
+
+    def populate(self, paths, size: int):
+        """ Create files of ``size`` bytes without counting requests. """
+        for path in paths:
+            local_path = os.path.join(self.root, path.lstrip('/'))
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(local_path, 'wb') as file:
+                file.truncate(size)
+
+    def files(self) -> list:
+        """ Paths of the remaining files, relative to the root. """
+        return sorted(
+            os.path.relpath(os.path.join(folder, name), self.root)
+            for folder, _, names in os.walk(self.root) for name in names)
+
+    def acquire(self, operation: str):
+        """ Count a request, in flight until :meth:`release` is called. """
+        with self._lock:
+            self.requests[operation] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def count_read(self, size: int):
+        """ Count ``size`` bytes sent to a client. """
+        with self._lock:
+            self.bytes_read += size
+
+    def release(self):
+        """ End a request started by :meth:`acquire`. """
+        with self._lock:
+            self.in_flight -= 1
+
+    @contextmanager
+    def request(self, operation: str):
+        """ Count a request, in flight while it is handled. """
+        self.acquire(operation)
+        try:
+            yield
+        finally:
+            self.release()
@@ -1,6 +1,7 @@
 from visitdata.operators.extractors.visit import VisitExtractOperator
 
-
+# The VD_S3 and VD_RS connections must have been registered once with:
+#     python -m visitdata.settings
 v = VisitExtractOperator(datahub_task_id=1, hook=None)
 v.execute(None)
 print(v)
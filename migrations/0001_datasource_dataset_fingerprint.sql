@@ -0,0 +1,22 @@
+-- Fingerprints of the extracted files, used by the ``deduplicate`` mode of
+-- the extract step (see visitdata.models.dedup.DedupIndex) to detect files
+-- uploaded again under another name. Mapped by
+-- visitdata.models.sources.DatasetFingerprint.
+--
+-- Run once on the dataflow database before enabling ``deduplicate``.
+CREATE TABLE IF NOT EXISTS datasource_dataset_fingerprint (
+    id VARCHAR(36) NOT NULL,
+    datasource_protocol_id VARCHAR(256)
+        REFERENCES datasource_protocol (id),
+    datasource_dataset_id VARCHAR(36)
+        REFERENCES datasource_dataset (id),
+    etag VARCHAR(256),
+    size BIGINT,
+    content_hash VARCHAR(64),
+    source_key VARCHAR(2048),
+    duplicate BOOLEAN,
+    created_timestamp TIMESTAMP,
+    PRIMARY KEY (id)
+)
+-- Fingerprints are looked up by protocol, then ETag or content hash
+COMPOUND SORTKEY (datasource_protocol_id, etag, content_hash);
@@ -0,0 +1,2 @@
+""" Tests of the visitdata package, run against the local stand-ins of
+:mod:`benchmarks` instead of the real services. """
@@ -0,0 +1,142 @@
+""" Fixtures of the tests, registering the stand-ins in
+:data:`visitdata.models.hooks.REGISTRY` in place of the real services. """
+import json
+
+import pytest
+
+
+@pytest.fixture
+def env(tmp_path):
+    """ S3 stand-in and SQLite dataflow database of the benchmarks, holding
+    a single DataTask with a single protocol. """
+    from benchmarks.bench_extract import BenchEnvironment
+    from visitdata.models.hooks import REGISTRY
+    from visitdata.settings import get_settings
+    # The connections are built from the settings of the environment
+    get_settings.cache_clear()
+    environment = BenchEnvironment(
+        0, 0, 0.0, f"sqlite:///{tmp_path}/dataflow.db")
+    yield environment
+    REGISTRY.dispose()
+
+
+@pytest.fixture
+def register_connection(env):
+    """ Returns a function registering an Airflow connection, taking its
+    ID, its attributes and its extras as a dict. """
+    from airflow.models import Connection
+    from visitdata.models.hooks import REGISTRY
+
+    def register(conn_id: str, extra: dict = None, **kwargs) -> Connection:
+        connection = Connection(
+            conn_id=conn_id, extra=json.dumps(extra or {}), **kwargs)
+        REGISTRY.connection(conn_id, lambda: connection)
+        return connection
+    return register
+
+
+@pytest.fixture
+def protocol_source(env):
+    """ Returns a function setting the source of the protocol of the
+    DataTask. """
+    from sqlalchemy.orm import sessionmaker
+    from benchmarks.bench_extract import PROTOCOL_ID
+    from visitdata.models.sources import DatasourceProtocol
+
+    def set_source(source_type: str, source_access: str, data_path: str):
+        session = sessionmaker(bind=env.engine)()
+        try:
+            protocol = session.query(DatasourceProtocol).get(PROTOCOL_ID)
+            protocol.source_type = source_type
+            protocol.source_access = source_access
+            protocol.data_path = data_path
+            session.commit()
+        finally:
+            session.close()
+    return set_source
+
+
+@pytest.fixture
+def run_extract(env):
+    """ Returns a function running the extract step of the DataTask with
+    the given operator arguments, and returning the saved datasets. """
+    from sqlalchemy.orm import sessionmaker
+    from benchmarks.bench_extract import DATATASK_ID
+    from visitdata.models.operators import ExtractOperator
+    from visitdata.models.sources import DatasourceDataset
+
+    class CSVExtractOperator(ExtractOperator):
+        """ Extract operator accepting every file. """
+
+        def check_format(self, file) -> bool:
+            return True
+
+        def create_context(self, file) -> dict:
+            return {"name": file.name, "size": file.size}
+
+    def run(**kwargs) -> list:
+        operator = CSVExtractOperator(
+            task_id="extract", datahub_task_id=DATATASK_ID, **kwargs)
+        operator.datasource = operator._datasource_hook \
+            .retrieve_datasource_snapshot(DATATASK_ID)
+        operator.execute_step()
+        session = sessionmaker(bind=env.engine)()
+        try:
+            return session.query(DatasourceDataset).all()
+        finally:
+            session.close()
+    return run
+
+
+@pytest.fixture
+def session(env):
+    """ Session of the dataflow database. """
+    from sqlalchemy.orm import sessionmaker
+    db_session = sessionmaker(bind=env.engine)()
+    yield db_session
+    db_session.close()
+
+
+@pytest.fixture
+def add_datasets(env):
+    """ Returns a function inserting datasets of the protocol of the
+    DataTask, taking their number and their column values, and returning
+    their IDs. """
+    from datetime import datetime, timezone
+    from sqlalchemy.orm import sessionmaker
+    from benchmarks.bench_extract import ORGANISATION_ID, PROTOCOL_ID
+    from visitdata.models.sources import DatasourceDataset
+
+    def add(count: int, **values) -> list:
+        values.setdefault("process_e_timestamp", datetime.now(timezone.utc))
+        values.setdefault("data_path_source", "Datalake/extract")
+        datasets = [DatasourceDataset(
+            organisation_id=ORGANISATION_ID,
+            datasource_protocol_id=PROTOCOL_ID, **values)
+            for _ in range(count)]
+        db_session = sessionmaker(bind=env.engine)()
+        try:
+            db_session.add_all(datasets)
+            db_session.commit()
+            return [dataset.id for dataset in datasets]
+        finally:
+            db_session.close()
+    return add
+
+
+@pytest.fixture
+def schedule_evaluators(monkeypatch):
+    """ Make the extract step evaluate the schedules on Monday 2020-01-06
+    at 10:00, every evaluator it creates being a minute later than the
+    previous one. Returns the created evaluators. """
+    from datetime import datetime, timedelta
+    from visitdata.models.operators import extract_operator
+    from visitdata.models.schedule import ScheduleEvaluator
+    created = []
+
+    def create() -> ScheduleEvaluator:
+        created.append(ScheduleEvaluator(
+            datetime(2020, 1, 6, 10) + timedelta(minutes=len(created))))
+        return created[-1]
+    monkeypatch.setattr(extract_operator, "ScheduleEvaluator", create)
+    return created
@@ -0,0 +1,74 @@
+""" Tests of :class:`visitdata.models.cache.DiskCache` against the S3
+stand-in of :mod:`benchmarks.local_s3`. """
+import os
+
+import pytest
+
+from benchmarks.local_s3 import LocalS3Client
+from visitdata.models.cache import DiskCache
+
+BUCKET = "visitdata-test"
+
+
+@pytest.fixture
+def s3():
+    client = LocalS3Client()
+    client.populate(BUCKET, [f"small-{index}" for index in range(12)], 100)
+    client.populate(BUCKET, ["large"], 2000)
+    return client
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    """ Paths scanned with :func:`os.scandir`. """
+    paths = []
+    scandir = os.scandir
+
+    def counting_scandir(path='.'):
+        paths.append(path)
+        return scandir(path)
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    return paths
+
+
+def read(cache: DiskCache, client, key: str, **kwargs) -> int:
+    file = cache.open(client, BUCKET, key, **kwargs)
+    try:
+        return len(file.read())
+    finally:
+        file.close()
+
+
+@pytest.mark.parametrize("known", ["nothing", "etag", "etag and size"])
+def test_objects_larger_than_the_budget_are_not_cached(tmp_path, s3, known):
+    cache = DiskCache(str(tmp_path), max_bytes=1000)
+    for index in range(5):
+        read(cache, s3, f"small-{index}")
+    head = s3.head_object(Bucket=BUCKET, Key="large")
+    kwargs = {
+        "nothing": {},
+        "etag": {"etag": head["ETag"]},
+        "etag and size": {"etag": head["ETag"],
+                          "size": head["ContentLength"]},
+    }[known]
+    assert read(cache, s3, "large", **kwargs) == 2000
+    stats = cache.stats()
+    assert stats["entries"] == 5
+    assert stats["evictions"] == 0
+    assert stats["downloaded_bytes"] == 500
+
+
+def test_entries_are_only_scanned_over_budget(tmp_path, s3, scans):
+    cache = DiskCache(str(tmp_path), max_bytes=1000)
+    for index in range(10):
+        read(cache, s3, f"small-{index}")
+    # The tracked size is initialized by the first download
+    assert scans.count(cache.directory) == 1
+    assert read(cache, s3, "small-0") == 100
+    assert read(cache, s3, "small-10") == 100
+    # Over budget: evicted down to the low water mark
+    assert scans.count(cache.directory) == 2
+    assert cache.counters["evictions"] == 2
+    read(cache, s3, "small-11")
+    assert scans.count(cache.directory) == 2
+    assert cache.stats()["entries"] == 10
@@ -0,0 +1,106 @@
+""" Tests of :class:`visitdata.models.dedup.DedupIndex` against the SQLite
+dataflow database of the benchmarks. """
+import hashlib
+
+import pytest
+
+from benchmarks.bench_extract import PROTOCOL_ID
+from visitdata.models.datasets import VDDataset
+from visitdata.models.dedup import DedupIndex, LRUCache
+from visitdata.models.hooks import VDDataflowHook
+
+
+class File(VDDataset):
+    """ Listed file, fingerprinted by its ETag and size or its content. """
+
+    def __init__(self, key: str, etag: str = None, content: bytes = b""):
+        super().__init__(key)
+        self.key = key
+        self.etag = etag
+        self.size = len(content)
+        self.content = content
+
+    def checksum(self) -> str:
+        return hashlib.sha256(self.content).hexdigest()
+
+
+@pytest.fixture
+def hook(env):
+    dataflow_hook = VDDataflowHook()
+    yield dataflow_hook
+    dataflow_hook.close()
+
+
+def claim(index: DedupIndex, file: File, dataset_id: str):
+    fingerprint = index.fingerprint(PROTOCOL_ID, file)
+    return fingerprint, index.claim(fingerprint, dataset_id)
+
+
+def test_the_first_file_of_a_fingerprint_is_extracted(hook):
+    index = DedupIndex(hook)
+    fingerprint, extraction = claim(index, File("a.csv", "etag"), "1")
+    assert extraction is None
+    assert fingerprint.datasource_dataset_id == "1"
+    assert not fingerprint.duplicate
+
+
+def test_duplicates_wait_for_the_original_file(hook):
+    index = DedupIndex(hook)
+    claim(index, File("a.csv", "etag"), "1")
+    fingerprint, extraction = claim(index, File("b.csv", "etag"), "2")
+    assert not extraction.done()
+    assert fingerprint.datasource_dataset_id == "1"
+    assert fingerprint.duplicate
+    index.confirm("1")
+    assert extraction.result() is True
+    # Later duplicates do not wait
+    _, extraction = claim(index, File("c.csv", "etag"), "3")
+    assert extraction.result() is True
+
+
+def test_released_fingerprints_are_claimed_again(hook):
+    index = DedupIndex(hook)
+    claim(index, File("a.csv", "etag"), "1")
+    _, extraction = claim(index, File("b.csv", "etag"), "2")
+    index.release("1")
+    assert extraction.result() is False
+    fingerprint, extraction = claim(index, File("b.csv", "etag"), "2")
+    assert extraction is None
+    assert not fingerprint.duplicate
+
+
+def test_fingerprints_are_looked_up_in_the_database(hook, session):
+    fingerprint, _ = claim(DedupIndex(hook), File("a.csv", "etag"), "1")
+    session.add(fingerprint)
+    session.commit()
+    fingerprint, extraction = claim(
+        DedupIndex(hook), File("b.csv", "etag"), "2")
+    assert extraction.result() is True
+    assert fingerprint.datasource_dataset_id == "1"
+
+
+def test_files_without_etag_are_not_deduplicated(hook):
+    index = DedupIndex(hook)
+    claim(index, File("a.csv"), "1")
+    assert claim(index, File("b.csv"), "2")[1] is None
+
+
+def test_content_hashes_ignore_etags(hook):
+    index = DedupIndex(hook, content_hash=True)
+    claim(index, File("a.csv", "etag-a", b"content"), "1")
+    assert claim(index, File("b.csv", "etag-b", b"other"), "2")[1] is None
+    fingerprint, extraction = claim(
+        index, File("c.csv", "etag-c", b"content"), "3")
+    assert fingerprint.datasource_dataset_id == "1"
+    assert not extraction.done()
+
+
+def test_lru_cache_evicts_the_least_recently_used_items():
+    cache = LRUCache(2)
+    cache.setdefault("a", 1)
+    cache.setdefault("b", 2)
+    assert cache.get("a") == 1
+    assert cache.setdefault("b", 3) == 2
+    cache.setdefault("c", 3)
+    assert cache.get("a") is None
+    assert (cache.get("b"), cache.get("c"), len(cache)) == (2, 3, 2)
@@ -0,0 +1,56 @@
+""" Tests of :class:`visitdata.models.executor.FileExecutor`. """
+import threading
+from collections import namedtuple
+
+import pytest
+
+from visitdata.models.executor import FileExecutor
+
+Protocol = namedtuple("Protocol", "id")
+File = namedtuple("File", "name")
+
+
+def files(count: int, listed: list = None):
+    """ Yields ``count`` (protocol, file) pairs, recording the listed
+    files in ``listed``. """
+    for index in range(count):
+        if listed is not None:
+            listed.append(index)
+        yield Protocol("1"), File(f"file-{index}.csv")
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_failing_files_do_not_stop_the_others(max_workers):
+    processed, failures = [], []
+
+    def process(protocol, file):
+        if file.name == "file-3.csv":
+            raise ValueError(file.name)
+        processed.append(file.name)
+
+    FileExecutor(process, lambda *failure: failures.append(failure),
+                 max_workers=max_workers).run(files(10))
+    assert len(processed) == 9
+    (protocol_id, file_name, error), = failures
+    assert (protocol_id, file_name) == ("1", "file-3.csv")
+    assert isinstance(error, ValueError)
+
+
+def test_queued_files_are_bounded():
+    listed, released = [], threading.Event()
+
+    def process(protocol, file):
+        released.wait(5)
+
+    executor = FileExecutor(process, None, max_workers=2)
+    thread = threading.Thread(target=executor.run, args=(files(20, listed),))
+    thread.start()
+    try:
+        thread.join(0.5)
+        # The listing waits for the workers once 2 * max_workers files are
+        # queued
+        assert len(listed) == 5
+    finally:
+        released.set()
+        thread.join()
+    assert len(listed) == 20
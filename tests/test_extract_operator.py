@@ -0,0 +1,76 @@
+""" Tests of :class:`visitdata.models.operators.ExtractOperator` against the
+S3 stand-in of :mod:`benchmarks.local_s3`. """
+from contextlib import asynccontextmanager
+
+import pytest
+
+from benchmarks.bench_extract import (
+    BUCKET, DATASOURCE_ID, FTP_PREFIX, ORGANISATION_ID, PROTOCOL_ID)
+from visitdata.models.hooks import VDS3AsyncHook
+from visitdata.models.sources import DatasourceProtocol
+from tests.test_vd_s3_async_hook import AsyncS3Client
+
+CLIENT_FOLDER = f"{FTP_PREFIX}/client-{ORGANISATION_ID}/"
+
+
+@pytest.fixture
+def listings(env, monkeypatch):
+    """ Prefixes listed in the S3 stand-in. """
+    prefixes = []
+    list_objects_v2 = env.s3.list_objects_v2
+
+    def list_prefix(**kwargs):
+        prefixes.append(kwargs.get("Prefix"))
+        return list_objects_v2(**kwargs)
+    monkeypatch.setattr(env.s3, "list_objects_v2", list_prefix)
+    return prefixes
+
+
+def extracted_keys(env, datasets) -> list:
+    return sorted(dataset.data_path_archive.replace(CLIENT_FOLDER, "")
+                  for dataset in datasets)
+
+
+def test_a_single_protocol_lists_its_own_path(
+        env, listings, protocol_source, run_extract):
+    env.s3.populate(BUCKET, [f"{CLIENT_FOLDER}{key}" for key in (
+        "incoming/file.csv", "archive/file.csv", "other.csv")], 10)
+    protocol_source("s3", None, "incoming")
+    datasets = run_extract()
+    assert set(listings) == {f"{CLIENT_FOLDER}incoming"}
+    assert extracted_keys(env, datasets) == ["incoming/file.csv"]
+
+
+def test_protocols_of_a_source_share_a_listing(
+        env, session, listings, run_extract):
+    session.query(DatasourceProtocol).get(PROTOCOL_ID).data_path = "data/a/"
+    session.add(DatasourceProtocol(
+        id="2", name="bench-b", enabled=True, data_path="data/b/",
+        data_file="*.csv", source_type="s3", datasource_id=DATASOURCE_ID,
+        organisation_id=ORGANISATION_ID))
+    session.commit()
+    env.s3.populate(BUCKET, [f"{CLIENT_FOLDER}{key}" for key in (
+        "data/a/file.csv", "data/b/file.csv", "data/c/file.csv",
+        "other.csv")], 10)
+    datasets = run_extract()
+    assert set(listings) == {f"{CLIENT_FOLDER}data/"}
+    assert extracted_keys(env, datasets) == [
+        "data/a/file.csv", "data/b/file.csv"]
+
+
+def test_files_are_extracted_from_the_event_loop(
+        env, monkeypatch, protocol_source, run_extract):
+    @asynccontextmanager
+    async def client(hook, max_pool_connections=None):
+        yield AsyncS3Client(env.s3)
+    monkeypatch.setattr(VDS3AsyncHook, "client", client)
+    env.s3.populate(BUCKET, [f"{CLIENT_FOLDER}incoming/file-{index}.csv"
+                             for index in range(5)], 10)
+    protocol_source("s3", None, "incoming")
+    datasets = run_extract(async_io=True, max_in_flight=2)
+    assert extracted_keys(env, datasets) == [
+        f"incoming/file-{index}.csv" for index in range(5)]
+    assert all(dataset.data_path_source for dataset in datasets)
+    # The sources are removed once extracted
+    assert env.s3.list_objects_v2(
+        Bucket=BUCKET, Prefix=f"{CLIENT_FOLDER}incoming")["KeyCount"] == 0
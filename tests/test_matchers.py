@@ -0,0 +1,25 @@
+""" Tests of :mod:`visitdata.models.hooks.matchers`. """
+import pytest
+
+from visitdata.models.hooks.matchers import PrefixIndex, common_folder
+
+
+@pytest.mark.parametrize("paths, folder", [
+    (["client-1/incoming"], "client-1/incoming"),
+    (["client-1/incoming", "client-1/incoming"], "client-1/incoming"),
+    (["client-1/data/a/", "client-1/data/b/"], "client-1/data/"),
+    (["client-1/incoming-a", "client-1/incoming-b"], "client-1/"),
+    (["client-1/data/", "client-2/data/"], ""),
+], ids=["single", "same", "shared-folder", "shared-prefix", "disjoint"])
+def test_common_folder(paths, folder):
+    assert common_folder(paths) == folder
+
+
+def test_keys_are_dispatched_to_the_matching_targets():
+    index = PrefixIndex()
+    index.add("a", "data/a", "*.csv")
+    index.add("all", "data/", None)
+    assert sorted(index.dispatch("data/a/file.csv")) == ["a", "all"]
+    assert sorted(index.dispatch("data/a-old/file.csv")) == ["a", "all"]
+    assert index.dispatch("data/a/file.txt") == ["all"]
+    assert index.dispatch("other/file.csv") == []
@@ -0,0 +1,118 @@
+""" Tests of :class:`visitdata.models.operators.PipelineOperator` built from
+the operators of :mod:`visitdata.operators`. """
+import csv
+import io
+
+import pytest
+
+from benchmarks.bench_extract import BUCKET, DATATASK_ID, PROTOCOL_ID
+from visitdata.models.operators import (
+    LoadOperator, PipelineOperator, TransformOperator)
+from visitdata.models.sources import DatasourceDataset, DatasourceProtocol
+from visitdata.operators.extractors.visit import VisitExtractOperator
+
+FILES = {f"visit-P{index}-2020.csv": f"poi,visitors\nP{index},{index}\n"
+         f"P{index},{index * 10}\n" for index in range(5)}
+
+
+class VisitTransformOperator(TransformOperator):
+
+    def transform(self, data, context=None):
+        return [dict(record, visitors=int(record["visitors"]) + 1)
+                for record in data]
+
+    def check_format(self, data):
+        return True
+
+
+class VisitLoadOperator(LoadOperator):
+
+    table = "visit"
+
+
+def visit_pipeline(**kwargs) -> PipelineOperator:
+    return PipelineOperator(
+        task_id="visit_pipeline",
+        datahub_task_id=DATATASK_ID,
+        extract_class=VisitExtractOperator,
+        transform_class=VisitTransformOperator,
+        load_class=VisitLoadOperator,
+        **kwargs)
+
+
+def test_visit_extract_operator_has_a_default_task_id():
+    operator = VisitExtractOperator(datahub_task_id=DATATASK_ID)
+    assert operator.task_id == "visit_extract"
+
+
+def test_pipeline_creates_the_visit_steps(env):
+    operator = visit_pipeline()
+    operator.fetch_datasource()
+    assert operator.execute_step()
+    assert {name: step.task_id for name, step in operator._steps.items()} \
+        == {"extract": "visit_pipeline.extract",
+            "transform": "visit_pipeline.transform",
+            "load": "visit_pipeline.load"}
+
+
+@pytest.fixture
+def visits(env, monkeypatch):
+    """ Visit files in the FTP folder, with the content of the objects
+    kept by the S3 stand-in, and the table they are loaded into. """
+    monkeypatch.setenv("VD_RS_LOAD_MODE", "local")
+    env.s3.keep_content = True
+    for name, content in FILES.items():
+        env.s3.populate(
+            BUCKET, [f"{env.source_path}{name}"], 0, content.encode())
+    env.engine.execute("CREATE TABLE visit (poi VARCHAR, visitors INTEGER, "
+                       "datasource_dataset_id VARCHAR)")
+
+
+def read(env, key: str) -> str:
+    return env.s3.get_object(Bucket=BUCKET, Key=key)["Body"].read().decode()
+
+
+def test_pipeline_runs_the_steps_over_each_dataset(env, session, visits):
+    operator = visit_pipeline(load_kwargs={"load_batch_size": 2})
+    operator.fetch_datasource()
+    assert operator.execute_step()
+    assert operator.failed_datasets == []
+    # Each extracted file and its context are read once by the transform,
+    # the load reads the spool files
+    assert env.s3.requests["GetObject"] == 2 * len(FILES)
+    datasets = session.query(DatasourceDataset).all()
+    assert len(datasets) == len(FILES)
+    rows = env.engine.execute(
+        "SELECT datasource_dataset_id, poi, visitors FROM visit").fetchall()
+    assert len(rows) == 2 * len(FILES)
+    for dataset in datasets:
+        assert dataset.process_e_timestamp <= dataset.process_t_timestamp \
+            <= dataset.process_l_timestamp
+        name = dataset.data_path_archive.rsplit("/", 1)[-1]
+        index = int(name.split("-")[1][1:])
+        # The extracted file and its context, then the transformed file
+        assert read(env, f"{dataset.data_path_source}/{name}") == FILES[name]
+        assert read(env, f"{dataset.data_path_source}/context.json")
+        transformed = read(env, dataset.data_path_source.replace(
+            "/extract", f"/transform/{name}"))
+        assert list(csv.DictReader(io.StringIO(transformed))) == [
+            {"poi": f"P{index}", "visitors": str(visitors),
+             "datasource_dataset_id": dataset.id}
+            for visitors in (index + 1, index * 10 + 1)]
+        assert sorted(row[1:] for row in rows if row[0] == dataset.id) \
+            == [(f"P{index}", index + 1), (f"P{index}", index * 10 + 1)]
+    # The sources are removed once extracted
+    assert env.s3.list_objects_v2(
+        Bucket=BUCKET, Prefix=env.source_path)["KeyCount"] == 0
+
+
+def test_pipeline_extracts_with_the_schedule_of_the_fetch(
+        env, session, visits, schedule_evaluators):
+    session.query(DatasourceProtocol).get(PROTOCOL_ID).protocol_period = \
+        "0 10 * * *"
+    session.commit()
+    operator = visit_pipeline()
+    operator.fetch_datasource()
+    assert operator.execute_step()
+    assert len(schedule_evaluators) == 1
+    assert session.query(DatasourceDataset).count() == len(FILES)
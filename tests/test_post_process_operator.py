@@ -0,0 +1,101 @@
+""" Tests of
+:class:`visitdata.models.operators.post_process_operator.PostProcessOperator`
+against the SQLite database of the benchmarks. """
+from datetime import datetime, timezone
+
+import pytest
+
+from benchmarks.bench_extract import DATATASK_ID
+from visitdata.models.operators.post_process_operator import (
+    PostProcessOperator)
+from visitdata.models.sources import DatasourceDataset
+
+
+class SQLPostProcessOperator(PostProcessOperator):
+
+    statements = [
+        "INSERT INTO visit_daily SELECT datasource_dataset_id, value * 2 "
+        "FROM visit WHERE datasource_dataset_id IN :dataset_ids",
+    ]
+
+
+class PythonPostProcessOperator(PostProcessOperator):
+
+    python_fallback = True
+
+    source_query = ("SELECT datasource_dataset_id, value FROM visit "
+                    "WHERE datasource_dataset_id IN :dataset_ids")
+
+    table = "visit_daily"
+
+    def post_process(self, data):
+        return [dict(record, value=record["value"] * 2) for record in data]
+
+
+class EmptyPostProcessOperator(PostProcessOperator):
+    pass
+
+
+@pytest.fixture
+def loaded(env, add_datasets):
+    """ IDs of the loaded datasets, with a visit each, and of a dataset
+    which is not loaded yet. """
+    with env.engine.begin() as connection:
+        for table in ("visit", "visit_daily"):
+            connection.execute(f"CREATE TABLE {table} ("
+                               "datasource_dataset_id VARCHAR, value INTEGER)")
+    now = datetime.now(timezone.utc)
+    dataset_ids = add_datasets(
+        3, process_t_timestamp=now, process_l_timestamp=now)
+    pending, = add_datasets(1, process_t_timestamp=now)
+    with env.engine.begin() as connection:
+        for value, dataset_id in enumerate(dataset_ids + [pending]):
+            connection.execute(
+                "INSERT INTO visit VALUES (?, ?)", (dataset_id, value))
+    return dataset_ids, pending
+
+
+def run(operator_class, **kwargs):
+    operator = operator_class(
+        task_id="post_process", datahub_task_id=DATATASK_ID, **kwargs)
+    operator.fetch_datasource()
+    return operator.execute_step()
+
+
+def post_processed(session) -> dict:
+    return dict(session.query(
+        DatasourceDataset.id, DatasourceDataset.process_p_timestamp))
+
+
+@pytest.mark.parametrize("operator_class", [
+    SQLPostProcessOperator, PythonPostProcessOperator])
+def test_post_process_marks_the_processed_datasets(
+        env, session, loaded, operator_class):
+    dataset_ids, pending = loaded
+    start = datetime.now(timezone.utc).replace(tzinfo=None)
+    assert run(operator_class, post_process_batch_size=2)
+    rows = env.engine.execute(
+        "SELECT datasource_dataset_id, value FROM visit_daily").fetchall()
+    assert sorted(rows) == sorted(
+        (dataset_id, value * 2) for value, dataset_id
+        in enumerate(dataset_ids))
+    timestamps = post_processed(session)
+    assert timestamps.pop(pending) is None
+    assert all(timestamp >= start for timestamp in timestamps.values())
+
+
+def test_post_process_fallback_replaces_previous_rows(env, loaded):
+    dataset_ids, _ = loaded
+    env.engine.execute(
+        "INSERT INTO visit_daily VALUES (?, ?)", (dataset_ids[0], 100))
+    run(PythonPostProcessOperator)
+    assert env.engine.execute(
+        "SELECT value FROM visit_daily WHERE datasource_dataset_id = ?",
+        (dataset_ids[0],)).fetchall() == [(0,)]
+
+
+def test_post_process_without_statements_marks_nothing(
+        env, session, loaded):
+    with pytest.raises(NotImplementedError):
+        run(EmptyPostProcessOperator)
+    assert set(post_processed(session).values()) == {None}
@@ -0,0 +1,58 @@
+""" Tests of :data:`visitdata.models.hooks.REGISTRY` in forked processes.
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from visitdata.models.hooks import REGISTRY
+
+
+def run_forked(function, timeout: float = 10.0) -> int:
+    """ Run ``function`` in a forked process, and returns its exit status,
+    or None if it did not exit in time. """
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            status = 0 if function() else 1
+        finally:
+            os._exit(status)  # pylint: disable=protected-access
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            return os.WEXITSTATUS(status)
+        time.sleep(0.01)
+    os.kill(pid, 9)
+    os.waitpid(pid, 0)
+    return None
+
+
+@pytest.fixture
+def registry():
+    yield REGISTRY
+    REGISTRY.dispose()
+
+
+@pytest.mark.skipif(not hasattr(os, "register_at_fork"),
+                    reason="requires os.register_at_fork")
+def test_fork_while_another_thread_holds_the_lock(registry):
+    parent_client = registry.client(("VD_S3", "s3", None), object)
+    locked, forked = threading.Event(), threading.Event()
+
+    def hold_lock():
+        with registry._lock:  # pylint: disable=protected-access
+            locked.set()
+            forked.wait(10)
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    locked.wait(10)
+    try:
+        status = run_forked(lambda: registry.client(
+            ("VD_S3", "s3", None), object) is not parent_client)
+    finally:
+        forked.set()
+        thread.join()
+    assert status == 0
@@ -0,0 +1,74 @@
+""" Tests of :class:`visitdata.models.schedule.ScheduleEvaluator`, and of the
+scheduling of the extract step. """
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmarks.bench_extract import (
+    DATASOURCE_ID, DATATASK_ID, ORGANISATION_ID, PROTOCOL_ID)
+from visitdata.models.operators import ExtractOperator
+from visitdata.models.schedule import ScheduleEvaluator, parse_period
+from visitdata.models.sources import DatasourceProtocol
+
+NOW = datetime(2020, 1, 6, 10, 0, 30)
+
+
+def test_periods_are_parsed_once():
+    assert parse_period("0 10 * * *") is parse_period("0 10 * * *")
+
+
+@pytest.mark.parametrize("period, due", [
+    (None, True),
+    ("", True),
+    ("* * * * *", True),
+    ("0 10 * * *", True),
+    ("0 11 * * *", False),
+    ("0 10 * * 1", True),
+    ("0 10 * * 2", False),
+    ("*/15 * * * *", True),
+    ("5 * * * *", False),
+])
+def test_periods_are_due_at_the_frozen_minute(period, due):
+    assert ScheduleEvaluator(NOW).is_due(period) is due
+
+
+@pytest.mark.parametrize("period, expected", [
+    (None, [NOW.replace(second=0), NOW.replace(minute=1, second=0)]),
+    ("0 10 * * *", [datetime(2020, 1, 6, 10), datetime(2020, 1, 7, 10)]),
+    ("30 9 * * *", [datetime(2020, 1, 7, 9, 30), datetime(2020, 1, 8, 9, 30)]),
+    ("0 0 1 * *", [datetime(2020, 2, 1), datetime(2020, 3, 1)]),
+    ("*/20 10 * * *",
+     [datetime(2020, 1, 6, 10), datetime(2020, 1, 6, 10, 20)]),
+])
+def test_next_fire_times(period, expected):
+    assert ScheduleEvaluator(NOW).next_fire_times(period, count=2) \
+        == expected
+
+
+def test_next_fire_times_stop_at_the_horizon():
+    assert ScheduleEvaluator(NOW).next_fire_times(
+        "0 0 1 * *", count=2, horizon=timedelta(days=20)) == []
+
+
+def test_due_datasources():
+    schedules = [(1, "0 11 * * *"), (1, "0 10 * * *"), (2, "0 12 * * *"),
+                 (3, "0 0 1 * *")]
+    evaluator = ScheduleEvaluator(NOW)
+    assert evaluator.due_datasources(schedules) == {1}
+    assert evaluator.due_datasources(
+        schedules, until=NOW + timedelta(hours=3)) == {1, 2}
+
+
+def test_disabled_protocols_are_not_scheduled(
+        env, session, schedule_evaluators):
+    protocol = session.query(DatasourceProtocol).get(PROTOCOL_ID)
+    protocol.protocol_period = "0 10 * * *"
+    protocol.enabled = False
+    session.add(DatasourceProtocol(
+        id="2", name="later", enabled=True, protocol_period="0 12 * * *",
+        data_path="data/", data_file="*.csv", source_type="s3",
+        datasource_id=DATASOURCE_ID, organisation_id=ORGANISATION_ID))
+    session.commit()
+    operator = ExtractOperator(task_id="extract", datahub_task_id=DATATASK_ID)
+    operator.fetch_datasource()
+    assert operator.datasource is None
@@ -0,0 +1,28 @@
+""" Tests of the lazy loading of :mod:`visitdata.settings`. """
+import dotenv
+
+from visitdata.models.operators import ELTPOperator
+from visitdata.settings import get_settings
+
+
+class NoopOperator(ELTPOperator):
+
+    def fetch_datasource(self):
+        self.datasource = None
+
+    def execute_step(self):
+        return True
+
+
+def test_settings_are_loaded_on_execute(monkeypatch):
+    loads = []
+    monkeypatch.setattr(dotenv, "load_dotenv", lambda: loads.append(True))
+    get_settings.cache_clear()
+    try:
+        operator = NoopOperator(task_id="noop", datahub_task_id=1)
+        assert loads == []
+        operator.execute(None)
+        operator.execute(None)
+        assert loads == [True]
+    finally:
+        get_settings.cache_clear()
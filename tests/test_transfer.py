@@ -0,0 +1,135 @@
+""" Tests of :class:`visitdata.models.transfer.TransferEngine` against the S3
+stand-in of :mod:`benchmarks.local_s3`. """
+import hashlib
+from collections import Counter
+
+import pytest
+from botocore.exceptions import ClientError
+
+from benchmarks.local_s3 import LocalS3Client
+from visitdata.models.transfer import (
+    MIN_PART_SIZE, TransferConfig, TransferEngine)
+
+SOURCE = "source-bucket"
+DEST = "dest-bucket"
+
+CONTENT = bytes(range(256)) * (MIN_PART_SIZE // 128 + 1)
+
+
+class FlakyS3Client(LocalS3Client):
+    """ S3 stand-in failing the first requests of some operations.
+
+    Arguments:
+        failures {dict} -- Number of failures by operation.
+
+    Keyword Arguments:
+        code {str} -- Error code of the failures. (default: {"SlowDown"})
+    """
+
+    def __init__(self, failures: dict = None, code: str = "SlowDown"):
+        super().__init__(keep_content=True)
+        self.failures = Counter(failures or {})
+        self.code = code
+
+    def __fail(self, operation: str):
+        if self.failures[operation] > 0:
+            self.failures[operation] -= 1
+            self.requests[operation] += 1
+            raise ClientError(
+                {"Error": {"Code": self.code, "Message": "Injected"}},
+                operation)
+
+    def copy_object(self, **kwargs):
+        self.__fail("CopyObject")
+        return super().copy_object(**kwargs)
+
+    def put_object(self, **kwargs):
+        self.__fail("PutObject")
+        return super().put_object(**kwargs)
+
+    def upload_part(self, **kwargs):
+        self.__fail("UploadPart")
+        return super().upload_part(**kwargs)
+
+    def upload_part_copy(self, **kwargs):
+        self.__fail("UploadPartCopy")
+        return super().upload_part_copy(**kwargs)
+
+
+def digest(content: bytes) -> str:
+    return hashlib.md5(content).hexdigest()
+
+
+def config() -> TransferConfig:
+    return TransferConfig(multipart_threshold=MIN_PART_SIZE,
+                          multipart_chunksize=MIN_PART_SIZE, backoff=0.001)
+
+
+def client(content: bytes = CONTENT, **kwargs) -> FlakyS3Client:
+    s3 = FlakyS3Client(**kwargs)
+    s3.populate(SOURCE, ["file.csv"], 0, content)
+    return s3
+
+
+def copied(s3) -> str:
+    """ Digest of the copied object. """
+    return digest(
+        s3.get_object(Bucket=DEST, Key="copy.csv")["Body"].read())
+
+
+def test_small_objects_are_copied_with_a_single_request():
+    s3 = client(b"small", failures={"CopyObject": 1})
+    stats = TransferEngine(s3, config()).copy(
+        SOURCE, "file.csv", DEST, "copy.csv")
+    assert copied(s3) == digest(b"small")
+    assert s3.requests["CopyObject"] == 2
+    assert stats.attempts == 2
+    assert len(stats.part_latencies) == 1
+
+
+def test_large_objects_are_copied_by_parts():
+    s3 = client()
+    stats = TransferEngine(s3, config()).copy(
+        SOURCE, "file.csv", DEST, "copy.csv", size=len(CONTENT))
+    assert copied(s3) == digest(CONTENT)
+    assert s3.requests["UploadPartCopy"] == 3
+    assert s3.requests["CompleteMultipartUpload"] == 1
+    assert len(stats.part_latencies) == 3
+    assert stats.bytes_per_second > 0
+
+
+def test_failed_parts_are_retried_alone():
+    s3 = client(failures={"UploadPartCopy": 1})
+    stats = TransferEngine(s3, config()).copy(
+        SOURCE, "file.csv", DEST, "copy.csv", size=len(CONTENT))
+    assert copied(s3) == digest(CONTENT)
+    assert s3.requests["UploadPartCopy"] == 4
+    # Creation, 4 parts and completion
+    assert stats.attempts == 6
+
+
+def test_fatal_errors_abort_the_upload():
+    s3 = client(failures={"UploadPartCopy": 1}, code="AccessDenied")
+    with pytest.raises(ClientError):
+        TransferEngine(s3, config()).copy(
+            SOURCE, "file.csv", DEST, "copy.csv", size=len(CONTENT))
+    assert s3.requests["AbortMultipartUpload"] == 1
+    assert s3.list_objects_v2(Bucket=DEST)["KeyCount"] == 0
+
+
+@pytest.mark.parametrize("content, operation, parts, reads", [
+    (b"small", "PutObject", 1, 1),
+    # The range of the failed part is read again
+    (CONTENT, "UploadPart", 3, 4),
+], ids=["small", "large"])
+def test_objects_of_other_accounts_are_streamed_with_retries(
+        content, operation, parts, reads):
+    source = client(content)
+    dest = FlakyS3Client(failures={operation: 1})
+    stats = TransferEngine(dest, config()).copy(
+        SOURCE, "file.csv", DEST, "copy.csv", source_client=source)
+    assert copied(dest) == digest(content)
+    assert dest.requests[operation] == parts + 1
+    assert source.requests["GetObject"] == reads
+    assert len(stats.part_latencies) == parts
+    assert stats.size == len(content)
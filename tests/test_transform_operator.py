@@ -0,0 +1,52 @@
+""" Tests of :class:`visitdata.models.operators.TransformOperator` over the
+files extracted to the datalake of the S3 stand-in. """
+import pytest
+
+from benchmarks.bench_extract import BUCKET, DATATASK_ID
+from visitdata.models.operators import TransformOperator
+from visitdata.models.sources import DatasourceDataset
+
+FILES = {f"visit-P{index}.csv": f"poi,visitors\nP{index},{index}\n"
+         for index in range(3)}
+
+
+class VisitTransformOperator(TransformOperator):
+    """ Transform failing on the visits of ``P1``. """
+
+    def transform(self, data, context=None):
+        if any(record["poi"] == "P1" for record in data):
+            raise ValueError("Unknown POI P1")
+        return data
+
+    def check_format(self, data):
+        return True
+
+
+@pytest.fixture
+def extracted(env, run_extract):
+    """ Extract the visit files, returning their datasets. """
+    env.s3.keep_content = True
+    for name, content in FILES.items():
+        env.s3.populate(
+            BUCKET, [f"{env.source_path}{name}"], 0, content.encode())
+    return run_extract()
+
+
+def test_failing_datasets_do_not_stop_the_others(env, session, extracted):
+    operator = VisitTransformOperator(
+        task_id="transform", datahub_task_id=DATATASK_ID)
+    operator.datasource = operator._datasource_hook \
+        .retrieve_datasource_snapshot(DATATASK_ID)
+    with pytest.raises(Exception, match="1 dataset"):
+        operator.execute_step()
+    names = {dataset.id: dataset.data_path_archive.rsplit("/", 1)[-1]
+             for dataset in extracted}
+    failed, = operator.failed_datasets
+    assert names[failed["dataset"]] == "visit-P1.csv"
+    assert "Unknown POI P1" in failed["error"]
+    transformed = {names[dataset.id]: dataset.process_t_timestamp
+                   for dataset in session.query(DatasourceDataset)}
+    assert transformed["visit-P1.csv"] is None
+    assert transformed["visit-P0.csv"] and transformed["visit-P2.csv"]
+    assert env.s3.list_objects_v2(
+        Bucket=BUCKET, Prefix="Datalake")["KeyCount"] == 3 * 2 + 2
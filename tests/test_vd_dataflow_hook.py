@@ -0,0 +1,111 @@
+""" Tests of :class:`visitdata.models.hooks.vd_dataflow_hook.DatasetBatch`
+against the SQLite dataflow database of the benchmarks. """
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from benchmarks.bench_extract import ORGANISATION_ID, PROTOCOL_ID
+from visitdata.models.hooks import VDDataflowHook
+from visitdata.models.sources import (
+    DatasetFingerprint, DatasourceDataset, DatasourceProtocol)
+
+
+@pytest.fixture
+def hook(env):
+    dataflow_hook = VDDataflowHook()
+    yield dataflow_hook
+    dataflow_hook.close()
+
+
+def dataset(path: str = "Datalake/extract") -> DatasourceDataset:
+    return DatasourceDataset(organisation_id=ORGANISATION_ID,
+                             datasource_protocol_id=PROTOCOL_ID,
+                             data_path_source=path)
+
+
+def paths(session) -> list:
+    session.expire_all()
+    return sorted(path for path, in session.query(
+        DatasourceDataset.data_path_source))
+
+
+def test_datasets_are_flushed_by_chunks(hook, session):
+    flushed = []
+    batch = hook.dataset_batch(chunk_size=3, on_flush=flushed.append)
+    datasets = [batch.add(dataset(f"path-{index}")) for index in range(2)]
+    # Identifiers are known before the flush
+    assert all(added.id for added in datasets)
+    assert paths(session) == []
+    batch.add(dataset("path-2"))
+    assert paths(session) == ["path-0", "path-1", "path-2"]
+    assert [len(datasets) for datasets in flushed] == [3]
+    assert len(batch) == 0
+
+
+def test_updates_of_pending_datasets_are_inserted(hook, session):
+    with hook.dataset_batch(chunk_size=10) as batch:
+        added = batch.add(dataset("before"))
+        added.data_path_source = "after"
+        batch.update(added)
+        assert len(batch) == 1
+    assert paths(session) == ["after"]
+
+
+def test_flushed_datasets_are_updated(hook, session):
+    batch = hook.dataset_batch(chunk_size=10)
+    added = batch.add(dataset("before"))
+    batch.flush()
+    added.data_path_source = "after"
+    batch.update(added)
+    assert paths(session) == ["before"]
+    assert batch.flush() == [added]
+    assert paths(session) == ["after"]
+    assert batch.flush() == []
+
+
+def test_fingerprints_and_watermarks_are_flushed_with_the_datasets(
+        hook, session):
+    batch = hook.dataset_batch(chunk_size=10)
+    added = batch.add(dataset())
+    batch.add_fingerprint(DatasetFingerprint(
+        datasource_protocol_id=PROTOCOL_ID, datasource_dataset_id=added.id,
+        etag="etag", size=10, duplicate=False))
+    batch.advance_watermark(PROTOCOL_ID, None, "watermark")
+    assert batch.flush()[0] is added
+    assert session.query(DatasetFingerprint).one() \
+        .datasource_dataset_id == added.id
+    assert session.query(DatasourceProtocol).get(PROTOCOL_ID) \
+        .source_sync_last == "watermark"
+
+
+def test_watermarks_moved_by_someone_else_are_kept(hook, session):
+    session.query(DatasourceProtocol).get(PROTOCOL_ID).source_sync_last = \
+        "other"
+    session.commit()
+    batch = hook.dataset_batch()
+    batch.advance_watermark(PROTOCOL_ID, None, "watermark")
+    batch.flush()
+    session.expire_all()
+    assert session.query(DatasourceProtocol).get(PROTOCOL_ID) \
+        .source_sync_last == "other"
+
+
+def test_failed_flushes_are_rolled_back(hook, session):
+    batch = hook.dataset_batch(chunk_size=10)
+    added = batch.add(dataset("first"))
+    batch.flush()
+    batch.add(dataset("second"))
+    batch.add(dataset("duplicate")).id = added.id
+    with pytest.raises(IntegrityError):
+        batch.flush()
+    assert paths(session) == ["first"]
+    # The session of the hook is still usable
+    hook.save_dataset(dataset("third"))
+    assert paths(session) == ["first", "third"]
+
+
+def test_batches_are_not_flushed_on_errors(hook, session):
+    with pytest.raises(ValueError):
+        with hook.dataset_batch() as batch:
+            batch.add(dataset())
+            raise ValueError()
+    assert paths(session) == []
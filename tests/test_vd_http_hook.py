@@ -0,0 +1,101 @@
+""" Tests of :class:`visitdata.models.hooks.VDHTTPHook` against the HTTP
+stand-in of :mod:`benchmarks.local_http`. """
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.bench_extract import BUCKET
+from benchmarks.local_http import LocalHTTPServer
+from visitdata.models.hooks import VDHTTPHook
+from visitdata.models.transfer import MIN_PART_SIZE, TransferConfig
+
+CONN_ID = "local_http"
+
+
+@pytest.fixture
+def http_hook(register_connection):
+    """ Returns a function creating a hook of a server, taking the
+    connection extras as keyword arguments. """
+    def create(server: LocalHTTPServer, **extra) -> VDHTTPHook:
+        register_connection(
+            CONN_ID, conn_type="http", host=server.url, extra=extra)
+        return VDHTTPHook(CONN_ID)
+    return create
+
+
+def names(files) -> list:
+    return sorted(file.name for file in files)
+
+
+@pytest.mark.parametrize("link_header", [True, False])
+def test_fetch_data_follows_pages(http_hook, link_header):
+    with LocalHTTPServer(25, 10, page_size=10,
+                         link_header=link_header) as server:
+        files = http_hook(server).fetch_data("files", mask="*.csv")
+    assert names(files) == server.names()
+    assert {file.size for file in files} == {10}
+    assert server.requests["List"] == 3
+
+
+def test_lazy_fetch_data_requests_pages_on_demand(http_hook):
+    with LocalHTTPServer(25, 10, page_size=10) as server:
+        files = http_hook(server).fetch_data("files", lazy=True)
+        assert server.requests["List"] == 0
+        next(files)
+        assert server.requests["List"] == 1
+        assert len(list(files)) == 24
+        assert server.requests["List"] == 3
+
+
+def test_fetch_data_multi_skips_endpoints_outside_prefix(http_hook):
+    with LocalHTTPServer(25, 10) as server:
+        pairs = http_hook(server).fetch_data_multi("files", [
+            ("first", "files", "file-000000?.csv"),
+            ("other", "other/files", "*"),
+        ])
+    assert {target for target, _ in pairs} == {"first"}
+    assert names(file for _, file in pairs) == server.names()[:10]
+    assert server.requests["List"] == 1
+
+
+def test_downloads_are_capped_by_max_concurrency(http_hook):
+    with LocalHTTPServer(8, 1024, latency=0.05) as server:
+        files = http_hook(server, max_concurrency=2).fetch_data("files")
+        with ThreadPoolExecutor(8) as pool:
+            checksums = set(pool.map(lambda file: file.checksum(), files))
+    assert len(checksums) == 1
+    assert server.requests["Download"] == 8
+    assert server.max_in_flight == 2
+
+
+def test_save_to_s3_streams_parts(env, http_hook):
+    size = 2 * MIN_PART_SIZE + 1
+    with LocalHTTPServer(1, size) as server:
+        file, = http_hook(server).fetch_data("files")
+        stats = file.save_to_s3(
+            key_dest="Datalake/file.csv", bucket_dest=BUCKET,
+            transfer_config=TransferConfig(multipart_chunksize=MIN_PART_SIZE))
+    assert stats.size == size
+    assert env.s3.head_object(
+        Bucket=BUCKET, Key="Datalake/file.csv")["ContentLength"] == size
+    assert env.s3.requests["UploadPart"] == 3
+    assert env.s3.requests["CompleteMultipartUpload"] == 1
+
+
+def test_extracted_files_are_found_from_their_dataset(
+        env, http_hook, protocol_source, run_extract):
+    with LocalHTTPServer(12, 100, page_size=5) as server:
+        http_hook(server, delete_sources=True)
+        protocol_source("http", CONN_ID, "files")
+        datasets = run_extract(max_workers=4)
+    assert len(datasets) == 12
+    assert server.names() == []
+    for dataset in datasets:
+        # As the transform step finds the extracted file
+        _, file_name = os.path.split(dataset.data_path_archive)
+        assert file_name.startswith("file-")
+        assert env.s3.head_object(
+            Bucket=BUCKET,
+            Key=f"{dataset.data_path_source}/{file_name}"
+        )["ContentLength"] == 100
@@ -0,0 +1,143 @@
+""" Tests of the loads of :class:`visitdata.models.hooks.VDRSHook`, with the
+datalake of the S3 stand-in and the SQLite dataflow database. """
+import json
+import re
+from collections import namedtuple
+
+import pytest
+from sqlalchemy import event
+
+from benchmarks.bench_extract import BUCKET
+from visitdata.models.hooks import VDRSHook, VDS3Hook
+
+Credentials = namedtuple("Credentials", "access_key secret_key token")
+
+FILES = {
+    "Datalake/1/visits.csv": "poi,visitors,datasource_dataset_id\n"
+                             "P1,10,1\nP2,,1\n",
+    "Datalake/2/visits.csv": "poi,visitors,datasource_dataset_id\n"
+                             "P3,30,2\n",
+}
+
+
+@pytest.fixture
+def visits(env):
+    """ Visit files in the datalake, and the table they are loaded into
+    with a row of dataset 3. """
+    env.s3.keep_content = True
+    for key, content in FILES.items():
+        env.s3.populate(BUCKET, [key], 0, content.encode())
+    env.engine.execute("CREATE TABLE visit (poi VARCHAR, visitors INTEGER, "
+                       "datasource_dataset_id VARCHAR)")
+    env.engine.execute("INSERT INTO visit VALUES ('P0', 0, '3')")
+    return VDRSHook()
+
+
+def rows(env) -> list:
+    return sorted(tuple(row) for row in env.engine.execute(
+        "SELECT datasource_dataset_id, poi, visitors FROM visit"))
+
+
+@pytest.fixture
+def copies(env, monkeypatch):
+    """ Run ``COPY`` in copy mode against SQLite, by replacing them with a
+    select of their parameters. Returns the (statement, parameters, manifest)
+    of every ``COPY``, the manifest being read before it is removed. """
+    monkeypatch.setenv("VD_RS_LOAD_MODE", "copy")
+    statements = []
+
+    def replace_copy(conn, cursor, statement, parameters, context,
+                     executemany):
+        if not statement.startswith("COPY "):
+            return statement, parameters
+        manifest = re.match(r"s3://([^/]+)/(.+)", parameters[0]).groups()
+        statements.append((statement, parameters, json.loads(
+            env.s3.get_object(Bucket=manifest[0], Key=manifest[1])
+            ["Body"].read())))
+        return f"SELECT {', '.join('?' * len(parameters))}", parameters
+    event.listen(env.engine, "before_cursor_execute", replace_copy,
+                 retval=True)
+    yield statements
+    event.remove(env.engine, "before_cursor_execute", replace_copy)
+
+
+def test_files_are_copied_with_a_manifest(env, visits, copies, monkeypatch):
+    monkeypatch.setenv("VD_RS_COPY_IAM_ROLE", "arn:aws:iam::1:role/copy")
+    visits.load("visit", list(FILES),
+                columns=["poi", "visitors", "datasource_dataset_id"])
+    (statement, parameters, manifest), = copies
+    assert statement == (
+        'COPY visit (poi, visitors, datasource_dataset_id) FROM ? '
+        'IAM_ROLE ? MANIFEST FORMAT AS CSV IGNOREHEADER 1 EMPTYASNULL '
+        "TIMEFORMAT 'auto'")
+    assert parameters == (f"s3://{BUCKET}/Datalake/1/visits.csv.manifest",
+                          "arn:aws:iam::1:role/copy")
+    assert manifest == {"entries": [
+        {"url": f"s3://{BUCKET}/{key}", "mandatory": True} for key in FILES]}
+    # The manifest is removed once loaded
+    assert env.s3.list_objects_v2(Bucket=BUCKET)["KeyCount"] == len(FILES)
+
+
+def test_columnar_manifests_hold_the_file_sizes(
+        env, visits, copies, monkeypatch):
+    monkeypatch.setattr(VDS3Hook, "get_credentials", lambda self: Credentials(
+        "key", "secret", "token"))
+    visits.load("visit", list(FILES), file_format="parquet",
+                manifest_key="Datalake/load.manifest")
+    (statement, parameters, manifest), = copies
+    assert statement == ("COPY visit FROM ? CREDENTIALS ? MANIFEST "
+                         "FORMAT AS PARQUET")
+    assert parameters == (
+        f"s3://{BUCKET}/Datalake/load.manifest",
+        "aws_access_key_id=key;aws_secret_access_key=secret;token=token")
+    assert [entry["meta"]["content_length"]
+            for entry in manifest["entries"]] \
+        == [len(content) for content in FILES.values()]
+
+
+def test_manifests_are_removed_when_the_load_fails(
+        env, visits, copies, monkeypatch):
+    monkeypatch.setenv("VD_RS_COPY_IAM_ROLE", "arn:aws:iam::1:role/copy")
+    with pytest.raises(Exception):
+        visits.load("visit", list(FILES), statements=["SELECT missing"])
+    assert len(copies) == 1
+    assert env.s3.list_objects_v2(Bucket=BUCKET)["KeyCount"] == len(FILES)
+
+
+@pytest.fixture
+def executed(env):
+    """ Statements executed against the database. """
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(env.engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(env.engine, "before_cursor_execute", record)
+
+
+def test_loads_replace_the_rows_of_the_datasets(
+        env, visits, executed, monkeypatch):
+    monkeypatch.setenv("VD_RS_LOAD_MODE", "local")
+    env.engine.execute("INSERT INTO visit VALUES ('P9', 9, '1')")
+    for _ in range(2):
+        # Reloads replace the rows loaded the first time
+        visits.load("visit", list(FILES), replace_ids=["1", "2"])
+        assert rows(env) == [("1", "P1", 10), ("1", "P2", None),
+                             ("2", "P3", 30), ("3", "P0", 0)]
+    # The rows are staged, then swapped, and the staging tables dropped
+    stages = [re.match(r"CREATE TEMP TABLE (\w+)", statement).group(1)
+              for statement in executed
+              if statement.startswith("CREATE TEMP TABLE")]
+    assert len(set(stages)) == 2
+    for stage in stages:
+        assert f"INSERT INTO visit SELECT * FROM {stage}" in executed
+        assert f"DROP TABLE {stage}" in executed
+
+
+def test_failed_loads_keep_the_previous_rows(env, visits, monkeypatch):
+    monkeypatch.setenv("VD_RS_LOAD_MODE", "local")
+    with pytest.raises(Exception):
+        visits.load("visit", list(FILES), replace_ids=["3"],
+                    statements=["SELECT missing"])
+    assert rows(env) == [("3", "P0", 0)]
@@ -0,0 +1,102 @@
+""" Tests of :class:`visitdata.models.hooks.VDS3AsyncHook` against an async
+facade of the S3 stand-in of :mod:`benchmarks.local_s3`. """
+import asyncio
+
+import pytest
+from botocore.exceptions import ClientError
+
+from benchmarks.local_s3 import LocalS3Client
+from visitdata.models.datasets import S3VDDataset
+from visitdata.models.hooks.vd_s3_async_hook import VDS3AsyncHook
+from visitdata.models.transfer import MIN_PART_SIZE, TransferConfig
+
+SOURCE = "source-bucket"
+DEST = "dest-bucket"
+
+
+class AsyncS3Client:
+    """ Async facade of a S3 stand-in, in place of the client opened by
+    :meth:`VDS3AsyncHook.client`. The first requests of the operations of
+    ``failures`` fail with the given error codes, before ``latency``
+    seconds are awaited by every request.
+    """
+
+    def __init__(self, s3: LocalS3Client, failures: dict = None,
+                 latency: float = 0.0):
+        self.s3 = s3
+        self.failures = failures or {}
+        self.latency = latency
+
+    def __getattr__(self, name):
+        method = getattr(self.s3, name)
+        operation = "".join(word.title() for word in name.split("_"))
+
+        async def call(**kwargs):
+            codes = self.failures.get(operation)
+            if codes:
+                self.s3.requests[operation] += 1
+                raise ClientError(
+                    {"Error": {"Code": codes.pop(0), "Message": "Injected"}},
+                    operation)
+            await asyncio.sleep(self.latency)
+            return method(**kwargs)
+        return call
+
+    def get_paginator(self, operation_name: str):
+        return AsyncPaginator(self.s3.get_paginator(operation_name))
+
+
+class AsyncPaginator:
+    """ Async facade of a paginator of the S3 stand-in. """
+
+    def __init__(self, paginator):
+        self.paginator = paginator
+
+    async def paginate(self, **kwargs):
+        for page in self.paginator.paginate(**kwargs):
+            yield page
+
+
+@pytest.fixture
+def hook(register_connection):
+    register_connection("VD_S3", conn_type="aws")
+    return VDS3AsyncHook()
+
+
+def copy(hook, client, size: int):
+    """ Copy a file of ``size`` bytes by parts of :data:`MIN_PART_SIZE`,
+    then let the loop run the requests left in flight. """
+    client.s3.populate(SOURCE, ["file.csv"], size)
+    file = S3VDDataset(SOURCE, "file.csv", size=size)
+    config = TransferConfig(multipart_threshold=MIN_PART_SIZE,
+                            multipart_chunksize=MIN_PART_SIZE, backoff=0.001)
+
+    async def run():
+        try:
+            return await hook.save_file_async(
+                client, file, "copy.csv", DEST, config)
+        finally:
+            await asyncio.sleep(10 * client.latency)
+    return asyncio.run(run())
+
+
+def test_parts_are_copied_concurrently(hook):
+    client = AsyncS3Client(LocalS3Client(), {"UploadPartCopy": ["SlowDown"]})
+    stats = copy(hook, client, 3 * MIN_PART_SIZE)
+    assert client.s3.requests["UploadPartCopy"] == 4
+    assert client.s3.requests["CompleteMultipartUpload"] == 1
+    assert len(stats.part_latencies) == 3
+    assert client.s3.head_object(
+        Bucket=DEST, Key="copy.csv")["ContentLength"] == 3 * MIN_PART_SIZE
+
+
+def test_parts_in_flight_are_cancelled_before_the_abort(hook):
+    client = AsyncS3Client(LocalS3Client(), {
+        "UploadPartCopy": ["AccessDenied"],
+        "AbortMultipartUpload": ["SlowDown"],
+    }, latency=0.01)
+    with pytest.raises(ClientError):
+        copy(hook, client, 3 * MIN_PART_SIZE)
+    assert client.s3.requests["UploadPartCopy"] == 1
+    assert client.s3.requests["AbortMultipartUpload"] == 2
+    assert client.s3.list_objects_v2(Bucket=DEST)["KeyCount"] == 0
@@ -0,0 +1,115 @@
+""" Tests of :class:`visitdata.models.hooks.VDSFTPHook` against the SFTP
+stand-in of :mod:`benchmarks.local_sftp`. """
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.bench_extract import BUCKET
+from benchmarks.local_sftp import LocalSFTPServer
+from visitdata.models.hooks import VDSFTPHook
+from visitdata.models.transfer import MIN_PART_SIZE, TransferConfig
+
+CONN_ID = "local_sftp"
+
+FILES = [f"data/{folder}/file-{index}.csv"
+         for folder in ("a", "b") for index in range(5)]
+
+
+@pytest.fixture
+def server():
+    """ SFTP stand-in, serving no file. """
+    with LocalSFTPServer() as sftp_server:
+        yield sftp_server
+
+
+@pytest.fixture
+def sftp_hook(server, register_connection):
+    """ Returns a function creating a hook of the server, taking the
+    connection extras as keyword arguments. The sessions of the hooks are
+    closed after the test, before the server. """
+    hooks = []
+
+    def create(**extra) -> VDSFTPHook:
+        register_connection(
+            CONN_ID, conn_type="ssh", host="127.0.0.1", port=server.port,
+            login="visitdata", password=server.password, extra=extra)
+        hook = VDSFTPHook(CONN_ID)
+        hooks.append(hook)
+        return hook
+    yield create
+    for hook in hooks:
+        hook.close()
+
+
+def test_fetch_data_walks_subfolders(server, sftp_hook):
+    server.populate(FILES + ["data/a/notes.txt", "other/file.csv"], 10)
+    files = sftp_hook().fetch_data("data/", mask="*.csv")
+    assert sorted(file.key for file in files) == FILES
+    assert {file.size for file in files} == {10}
+
+
+def test_fetch_data_multi_only_lists_target_folders(server, sftp_hook):
+    server.populate(FILES + ["data/c/file-0.csv"], 10)
+    pairs = sftp_hook().fetch_data_multi("data/", [
+        ("a", "data/a/", "*.csv"),
+        ("b", "data/b/", "file-1.*"),
+    ])
+    assert sorted((target, file.key) for target, file in pairs) == \
+        [("a", key) for key in FILES[:5]] + [("b", "data/b/file-1.csv")]
+    # data, data/a and data/b
+    assert server.requests["List"] == 3
+
+
+def test_downloads_are_capped_by_max_concurrency(server, sftp_hook):
+    server.populate(FILES[:8], 1024)
+    files = sftp_hook(max_concurrency=2).fetch_data("data/")
+    server.latency = 0.05
+    with ThreadPoolExecutor(8) as pool:
+        checksums = set(pool.map(lambda file: file.checksum(), files))
+    assert len(checksums) == 1
+    assert server.requests["Open"] == 8
+    assert server.max_in_flight == 2
+
+
+def test_downloads_only_buffer_a_chunk(server, sftp_hook):
+    chunk_size = 256 * 1024
+    server.populate(["data/file.csv"], 16 * chunk_size)
+    hook = sftp_hook()
+    file, = hook.fetch_data("data/")
+    chunks = hook.iter_content(file, chunk_size)
+    assert len(next(chunks)) == chunk_size
+    time.sleep(0.2)
+    assert server.bytes_read <= 2 * chunk_size
+    assert sum(map(len, chunks)) == 15 * chunk_size
+
+
+def test_save_to_s3_streams_parts(env, server, sftp_hook):
+    size = 2 * MIN_PART_SIZE + 1
+    server.populate(["data/file.csv"], size)
+    file, = sftp_hook().fetch_data("data/")
+    stats = file.save_to_s3(
+        key_dest="Datalake/file.csv", bucket_dest=BUCKET,
+        transfer_config=TransferConfig(multipart_chunksize=MIN_PART_SIZE))
+    assert stats.size == size
+    assert env.s3.head_object(
+        Bucket=BUCKET, Key="Datalake/file.csv")["ContentLength"] == size
+    assert env.s3.requests["UploadPart"] == 3
+    assert env.s3.requests["CompleteMultipartUpload"] == 1
+
+
+def test_extract_removes_extracted_files(
+        env, server, sftp_hook, protocol_source, run_extract):
+    server.populate(FILES + ["data/a/notes.txt"], 100)
+    protocol_source("sftp", CONN_ID, "data/")
+    sftp_hook()
+    datasets = run_extract(max_workers=4)
+    assert server.files() == ["data/a/notes.txt"]
+    assert len(datasets) == len(FILES)
+    for dataset in datasets:
+        _, file_name = os.path.split(dataset.data_path_archive)
+        assert env.s3.head_object(
+            Bucket=BUCKET,
+            Key=f"{dataset.data_path_source}/{file_name}"
+        )["ContentLength"] == 100
@@ -0,0 +1,97 @@
+""" Tests of the extraction watermarks of :mod:`visitdata.models.watermark`.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from benchmarks.bench_extract import BUCKET, PROTOCOL_ID
+from visitdata.models.sources import DatasourceProtocol
+from visitdata.models.watermark import Watermark, WatermarkTracker
+
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def watermark(minutes: int, key: str = "file.csv") -> Watermark:
+    return Watermark(START + timedelta(minutes=minutes), key)
+
+
+def test_watermarks_are_serialized():
+    value = watermark(1, "data/a|b.csv")
+    assert Watermark.parse(value.serialize()) == value
+    assert Watermark.parse(None) is None
+
+
+def test_files_are_ordered_by_modification_then_key():
+    tracker = WatermarkTracker(watermark(10, "b.csv"))
+    assert tracker.is_new(watermark(10, "c.csv"))
+    assert tracker.is_new(watermark(11, "a.csv"))
+    assert not tracker.is_new(watermark(10, "a.csv"))
+    assert not tracker.is_new(watermark(9, "c.csv"))
+    assert tracker.is_new(None)
+
+
+def test_files_within_the_overlap_are_new():
+    tracker = WatermarkTracker(watermark(10), overlap=timedelta(minutes=5))
+    assert tracker.is_new(watermark(6))
+    assert not tracker.is_new(watermark(5))
+
+
+def track(tracker: WatermarkTracker, succeeded=(), failed=(), pending=()):
+    for minutes in (*succeeded, *failed, *pending):
+        tracker.started(watermark(minutes))
+    for minutes in succeeded:
+        tracker.finished(watermark(minutes), success=True)
+    for minutes in failed:
+        tracker.finished(watermark(minutes), success=False)
+    tracker.listed = True
+    return tracker.advanced()
+
+
+@pytest.mark.parametrize("files, expected", [
+    ({"succeeded": [1, 2, 3]}, 3),
+    ({"succeeded": [1, 2, 4], "failed": [3]}, 2),
+    ({"succeeded": [1, 3, 4], "pending": [2]}, 1),
+    ({"succeeded": [2, 3], "pending": [4], "failed": [1]}, None),
+    ({"failed": [1]}, None),
+    ({}, None),
+], ids=["succeeded", "failed", "pending", "first-failed", "all-failed",
+        "empty"])
+def test_watermark_advances_up_to_the_first_failed_or_pending_file(
+        files, expected):
+    advanced = track(WatermarkTracker(), **files)
+    assert advanced == (None if expected is None else watermark(expected))
+
+
+def test_watermark_does_not_advance_before_the_listing_ends():
+    tracker = WatermarkTracker()
+    tracker.started(watermark(1))
+    tracker.finished(watermark(1), success=True)
+    assert tracker.advanced() is None
+    tracker.listed = True
+    assert tracker.advanced() == watermark(1)
+
+
+def test_watermark_never_moves_back():
+    tracker = WatermarkTracker(watermark(10), overlap=timedelta(minutes=5))
+    assert track(tracker, succeeded=[7, 8]) is None
+
+
+@pytest.mark.parametrize("overlap, extracted", [
+    (None, ["file-0.csv"]),
+    (3600, ["file-0.csv", "late.csv"]),
+], ids=["no-overlap", "overlap"])
+def test_late_files_are_extracted_within_the_overlap(
+        env, session, run_extract, overlap, extracted):
+    env.s3.populate(BUCKET, [f"{env.source_path}file-0.csv"], 10)
+    options = dict(incremental=True, keep_sources=True, deduplicate=True,
+                   watermark_overlap=overlap)
+    run_extract(**options)
+    assert session.query(DatasourceProtocol).get(PROTOCOL_ID) \
+        .source_sync_last.endswith("file-0.csv")
+    # Uploaded after the first run, but modified before it
+    env.s3.populate(BUCKET, [f"{env.source_path}late.csv"], 10,
+                    modified=datetime.now(timezone.utc) - timedelta(
+                        minutes=10))
+    datasets = run_extract(**options)
+    assert sorted(dataset.data_path_archive.rsplit("/", 1)[1]
+                  for dataset in datasets) == extracted
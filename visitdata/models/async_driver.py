@@ -0,0 +1,242 @@
+""" Driver running the extraction of listed files from an asyncio event loop,
+for the ``async_io`` mode of
+:class:`visitdata.models.operators.ExtractOperator`.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+
+from visitdata.models.hooks import VDS3AsyncHook, async_extractor, shared_hook
+from visitdata.models.hooks.mixins import ExtractMixin
+from visitdata.models.datasets import VDDataset
+from visitdata.models.sources import DatasourceProtocol, DatasourceDataset
+from visitdata.models.watermark import Watermark
+
+
+class AsyncExtractDriver:
+    """ Extract the files of an operator from the event loop. The listing,
+    copies, contexts and removals of the sources whose hook has an async
+    variant are sent concurrently, with at most ``max_in_flight`` files in
+    flight. Files of the other sources are extracted by ``max_workers``
+    threads, and database operations run in a dedicated thread.
+
+    Arguments:
+        operator {:class:`visitdata.models.operators.ExtractOperator`} --
+            The operator whose files are extracted, holding the state of
+            the step.
+    """
+
+    def __init__(self, operator):
+        self.operator = operator
+        self.metrics = operator.metrics
+        self._executor = None
+        self._db_executor = None
+
+    async def run(self):
+        """ Process the files of every protocol, then remove their sources.
+        Async clients are opened for the run, one per async hook.
+        """
+        operator = self.operator
+        sources = operator._sources()
+        async_hooks = [shared_hook(VDS3AsyncHook)] + [
+            async_extractor(hook) for hook, _, _ in sources]
+        self._executor = ThreadPoolExecutor(max_workers=operator.max_workers)
+        self._db_executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            async with AsyncExitStack() as stack:
+                clients = {}
+                for hook in async_hooks:
+                    if hook is not None and id(hook) not in clients:
+                        clients[id(hook)] = await stack.enter_async_context(
+                            hook.client(operator.max_in_flight))
+                try:
+                    await self.__extract_files(sources, clients)
+                finally:
+                    try:
+                        await self.__in_db_thread(operator._commit_pending)
+                    finally:
+                        await self.__remove_source_data(clients)
+        finally:
+            self._executor.shutdown()
+            self._db_executor.shutdown()
+
+    async def __in_db_thread(self, function, *args):
+        """ Run a database operation in the thread dedicated to them,
+        holding the lock, without blocking the event loop. """
+        def locked():
+            with self.operator._db_lock:
+                return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(
+            self._db_executor, locked)
+
+    async def __list_in_thread(self, hook: ExtractMixin, prefix: str,
+                               protocols: list):
+        """ List a source whose hook has no async variant from the event
+        loop, each page being fetched in a worker thread. """
+        loop = asyncio.get_running_loop()
+        files = await loop.run_in_executor(
+            None, self.operator._fetch_data, hook, prefix, protocols)
+        iterator = iter(files)
+        end = object()
+        while True:
+            pair = await loop.run_in_executor(None, next, iterator, end)
+            if pair is end:
+                return
+            yield pair
+
+    async def __aiter_files(self, sources: list, clients: dict):
+        """ List the sources with their async hook if they have one.
+
+        Arguments:
+            sources {list} -- (hook, listed prefix, protocols) tuples.
+            clients {dict} -- Async clients, by id of their hook.
+
+        Yields:
+            tuple -- (async hook or None, protocol, file) tuples.
+        """
+        operator = self.operator
+        for hook, prefix, protocols in sources:
+            async_hook = async_extractor(hook)
+            if async_hook is None:
+                files = self.__list_in_thread(hook, prefix, protocols)
+            else:
+                files = async_hook.fetch_data_multi_async(
+                    clients[id(async_hook)],
+                    prefix=prefix,
+                    targets=operator._targets(protocols))
+            async for protocol, file in self.metrics.timed_aiter(
+                    "list", files):
+                if operator._is_new(protocol, file):
+                    yield async_hook, protocol, file
+            operator._mark_listed(protocols)
+
+    async def __extract_files(self, sources: list, clients: dict):
+        """ Extract the listed files with at most ``max_in_flight`` files
+        in flight. A failing file does not stop the others, it is recorded
+        in ``failed_files``.
+        """
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.operator.max_in_flight)
+        in_flight = set()
+
+        def done(task):
+            in_flight.discard(task)
+            slots.release()
+
+        try:
+            async for async_hook, protocol, file in self.__aiter_files(
+                    sources, clients):
+                await slots.acquire()
+                task = loop.create_task(self.__extract_file(
+                    clients, async_hook, protocol, file))
+                in_flight.add(task)
+                task.add_done_callback(done)
+        finally:
+            if in_flight:
+                await asyncio.wait(in_flight)
+
+    async def __extract_file(self, clients: dict, async_hook,
+                             protocol: DatasourceProtocol, file: VDDataset):
+        """ Extract a file with the async hook of its source, or in a worker
+        thread if there is none, and record its result. """
+        operator = self.operator
+        try:
+            if async_hook is None:
+                await asyncio.get_running_loop().run_in_executor(
+                    self._executor, operator._extract_file, protocol, file)
+            elif not operator.incremental:
+                await self.__process_file(
+                    clients, async_hook, protocol, file)
+            else:
+                tracker = operator._watermark_tracker(protocol)
+                try:
+                    await self.__process_file(
+                        clients, async_hook, protocol, file)
+                except Exception:
+                    tracker.finished(Watermark.of(file), success=False)
+                    raise
+                tracker.finished(Watermark.of(file), success=True)
+        except Exception as error:  # pylint: disable=broad-except
+            operator._record_failure(protocol.id, file.name, error)
+
+    async def __process_file(self, clients: dict, async_hook,
+                             protocol: DatasourceProtocol, file: VDDataset):
+        """ Asynchronous counterpart of the extraction of a single file by
+        the operator, deduplicated if it has a dedup index. """
+        operator = self.operator
+        with self.metrics.timer("validate"):
+            is_valid = await operator.check_format_async(file)
+        if not is_valid:
+            raise Exception(f"File {file.name} invalid.")
+        dataset = file.to_datasource_dataset(protocol=protocol)
+        dedup_index = operator._dedup_index
+        if dedup_index is None:
+            await self.__extract_dataset(
+                clients, async_hook, protocol, file, dataset)
+            return
+        fingerprint = await asyncio.get_running_loop().run_in_executor(
+            None, dedup_index.fingerprint, protocol.id, file)
+        dataset_id = dataset.id
+        while True:
+            extraction = await self.__in_db_thread(
+                dedup_index.claim, fingerprint, dataset_id)
+            if extraction is None:
+                break
+            if await asyncio.wrap_future(extraction):
+                await self.__in_db_thread(
+                    operator._record_duplicate, protocol, file, fingerprint)
+                return
+        try:
+            await self.__extract_dataset(
+                clients, async_hook, protocol, file, dataset)
+            await self.__in_db_thread(operator._save_fingerprint, fingerprint)
+        except Exception:
+            dedup_index.release(dataset_id)
+            raise
+        dedup_index.confirm(dataset_id)
+
+    async def __extract_dataset(self, clients: dict, async_hook,
+                                protocol: DatasourceProtocol,
+                                file: VDDataset,
+                                dataset: DatasourceDataset):
+        """ Save the dataset of a file, copy the file and its context to the
+        datalake with the async hooks, then update the dataset. """
+        operator = self.operator
+        dataset, dataset_id = await self.__in_db_thread(
+            operator._insert_dataset, protocol, file, dataset)
+        dest_folder = protocol.generate_datalake_path(
+            dataset_id=dataset_id,
+            step="extract")
+        context = await operator.create_context_async(file)
+        with self.metrics.timer("copy"):
+            stats = await async_hook.save_file_async(
+                clients[id(async_hook)], file,
+                key_dest=f"{dest_folder}/{file.name}")
+        operator._record_copy(file, stats)
+        datalake_hook = shared_hook(VDS3AsyncHook)
+        with self.metrics.timer("context_write"):
+            await datalake_hook.write_context_async(
+                clients[id(datalake_hook)], context,
+                key=f"{dest_folder}/context.json")
+        await self.__in_db_thread(
+            operator._finish_dataset, protocol, file, dataset, dest_folder)
+
+    async def __remove_source_data(self, clients: dict):
+        """ Remove the sources of the extracted files in batches, with the
+        async hook of their source if they have one. """
+        operator = self.operator
+        sources = operator._pop_removable_sources()
+        if not sources:
+            return
+        loop = asyncio.get_running_loop()
+        failures = []
+        with self.metrics.timer("source_delete"):
+            for hook, files in operator._group_by_hook(sources):
+                async_hook = async_extractor(hook)
+                if async_hook is None:
+                    failures.extend(await loop.run_in_executor(
+                        self._executor, hook.remove_sources, files))
+                else:
+                    failures.extend(await async_hook.remove_sources_async(
+                        clients[id(async_hook)], files))
+        operator._record_removal(sources, failures)
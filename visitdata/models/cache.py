@@ -0,0 +1,316 @@
+""" Disk cache of datalake objects, shared by the processes of a worker, so
+that objects read again (retries, reloads, several transforms of the same
+extract) are not downloaded from S3 each time.
+
+The cache is enabled by the ``VD_S3_CACHE_DIR`` environment variable, the
+folder of the cached objects, and bounded by ``VD_S3_CACHE_MAX_BYTES``
+(default: 10 GiB).
+"""
+import hashlib
+import io
+import mmap
+import os
+import threading
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Temporary files older than this are left by dead processes
+STALE_SECONDS = 3600
+
+# Share of the budget an eviction brings the cache back to, so that the
+# entries are only scanned again once the rest of the budget is downloaded
+LOW_WATER_MARK = 0.9
+
+
+class MappedFile(io.RawIOBase):
+    """ Read-only file object over a memory-mapped cached object. The
+    object stays readable even if it is evicted while being read.
+
+    Arguments:
+        path {str} -- Path of the cached object.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        with open(path, 'rb') as file:
+            self.size = os.fstat(file.fileno()).st_size
+            # Empty files cannot be mapped
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) \
+                if self.size else b""
+        self._view = memoryview(self._map)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        end = min(self._position + len(buffer), self.size)
+        count = end - self._position
+        buffer[:count] = self._view[self._position:end]
+        self._position = end
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position,
+                io.SEEK_END: self.size}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def getbuffer(self) -> memoryview:
+        """ Returns the whole content without copying it. """
+        return self._view
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+            if isinstance(self._map, mmap.mmap):
+                self._map.close()
+        super().close()
+
+
+class DiskCache:
+    """ Content-addressed cache of S3 objects on a local disk.
+
+    Objects are identified by their bucket, key and ETag, so that a
+    modified object is never served from the cache. Entries are published
+    with an atomic rename, so several processes can fill and read the cache
+    at once; evictions are serialized between processes by a lock file.
+
+    Each process tracks the size of the cache from its last scan of the
+    entries and its own downloads. Once it exceeds ``max_bytes``, the
+    entries are scanned again and the least recently used ones evicted
+    until the cache holds less than ``LOW_WATER_MARK`` of its budget. The
+    cache may thus briefly exceed its budget by the downloads of the other
+    processes since their last scan. Objects larger than the budget are
+    never cached.
+
+    Keyword Arguments:
+        directory {str} -- Folder of the cache. Defaults to the
+            ``VD_S3_CACHE_DIR`` environment variable.
+        max_bytes {int} -- Size budget of the cache. Defaults to the
+            ``VD_S3_CACHE_MAX_BYTES`` environment variable, or 10 GiB.
+    """
+
+    def __init__(self, directory: str = None, max_bytes: int = None):
+        self.directory = directory or os.getenv('VD_S3_CACHE_DIR')
+        self.max_bytes = int(max_bytes or os.getenv('VD_S3_CACHE_MAX_BYTES')
+                             or 10 * 1024 ** 3)
+        self._tmp = os.path.join(self.directory, "tmp")
+        os.makedirs(self._tmp, exist_ok=True)
+        self._lock = threading.Lock()
+        # Tracked size of the cache, None until the entries are scanned
+        self._size = None
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0,
+                         "evicted_bytes": 0, "downloaded_bytes": 0}
+
+    def __count(self, metrics, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+        if metrics is not None:
+            metrics.increment(f"cache_{name}", value)
+
+    def path(self, bucket_name: str, key: str, etag: str) -> str:
+        """ Returns the path of the entry of an object version. """
+        digest = hashlib.sha256(
+            f"{bucket_name}\0{key}\0{etag}".encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def open(self, client, bucket_name: str, key: str, etag: str = None,
+             size: int = None, metrics=None):
+        """ Open an object from the cache, downloading it on a miss.
+
+        Arguments:
+            client {botocore.client.S3} -- S3 client.
+            bucket_name {str} -- Bucket of the object.
+            key {str} -- Key of the object.
+
+        Keyword Arguments:
+            etag {str} -- ETag of the object if known, saving a HEAD
+                request.
+            size {int} -- Size of the object if known, i.e. listed with its
+                ETag. Otherwise objects larger than the cache are detected
+                by their HEAD request, or by their GET request when
+                ``etag`` is given.
+            metrics {:class:`visitdata.models.metrics.Metrics`} -- Metrics
+                the ``cache_*`` counters are also added to.
+
+        Returns:
+            file -- A :class:`MappedFile`, or the streamed body of objects
+                larger than the cache.
+        """
+        if etag is None:
+            head = client.head_object(Bucket=bucket_name, Key=key)
+            etag = head['ETag']
+            size = head['ContentLength']
+        if size is not None and size > self.max_bytes:
+            self.__count(metrics, "misses")
+            return client.get_object(
+                Bucket=bucket_name, Key=key, IfMatch=etag)['Body']
+        path = self.path(bucket_name, key, etag)
+        try:
+            file = MappedFile(path)
+        except FileNotFoundError:
+            self.__count(metrics, "misses")
+        else:
+            self.__touch(path)
+            self.__count(metrics, "hits")
+            return file
+        response = client.get_object(
+            Bucket=bucket_name, Key=key, IfMatch=etag)
+        if response['ContentLength'] > self.max_bytes:
+            return response['Body']
+        size = self.__download(response['Body'], path)
+        self.__count(metrics, "downloaded_bytes", size)
+        file = MappedFile(path)
+        if self.__track(size):
+            self.__evict(metrics, keep=path)
+        return file
+
+    @staticmethod
+    def __touch(path: str):
+        """ Mark an entry as recently used: the modification time orders
+        the entries for eviction. """
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def __download(self, body, path: str) -> int:
+        """ Download the body of an object version to its entry. """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(self._tmp, str(uuid4()))
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as file:
+                for chunk in iter(lambda: body.read(1024 * 1024), b""):
+                    file.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            body.close()
+        return size
+
+    def __track(self, size: int) -> bool:
+        """ Add a new entry to the tracked size of the cache.
+
+        Returns:
+            bool -- Whether the entries must be scanned, i.e. the tracked
+                size exceeds the budget or is not known yet.
+        """
+        with self._lock:
+            if self._size is None:
+                return True
+            self._size += size
+            return self._size > self.max_bytes
+
+    @contextmanager
+    def __locked(self):
+        """ Hold the lock shared by the processes using the cache. """
+        with open(os.path.join(self.directory, ".lock"), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __entries(self) -> list:
+        """ Returns the (modification time, path, size) of the entries. """
+        entries = []
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir() or shard.path == self._tmp:
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def __evict(self, metrics=None, keep: str = None):
+        """ Scan the entries to update the tracked size of the cache. If it
+        exceeds its budget, remove the least recently used entries down to
+        the low water mark. Also remove the temporary files of dead
+        processes. Entries being read stay readable until they are closed.
+        """
+        with self.__locked():
+            entries = self.__entries()
+            total = sum(size for _, _, size in entries)
+            target = (self.max_bytes * LOW_WATER_MARK
+                      if total > self.max_bytes else total)
+            for _, path, size in sorted(entries):
+                if total <= target:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                self.__count(metrics, "evictions")
+                self.__count(metrics, "evicted_bytes", size)
+            with self._lock:
+                self._size = total
+            stale = time.time() - STALE_SECONDS
+            for entry in os.scandir(self._tmp):
+                try:
+                    if entry.stat().st_mtime < stale:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+
+    def stats(self) -> dict:
+        """ Returns the counters of the process, and the number and size of
+        the entries of the cache, to size it. """
+        entries = self.__entries()
+        with self._lock:
+            stats = dict(self.counters)
+        stats["entries"] = len(entries)
+        stats["size_bytes"] = sum(size for _, _, size in entries)
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+_CACHE_LOCK = threading.Lock()
+_CACHE = {}
+
+
+def get_cache() -> DiskCache:
+    """ Returns the disk cache of the process, or None if
+    ``VD_S3_CACHE_DIR`` is not set. """
+    directory = os.getenv('VD_S3_CACHE_DIR')
+    if not directory:
+        return None
+    with _CACHE_LOCK:
+        if directory not in _CACHE:
+            _CACHE[directory] = DiskCache(directory)
+        return _CACHE[directory]
+
+
+def _reset_after_fork():
+    global _CACHE_LOCK, _CACHE
+    _CACHE_LOCK = threading.Lock()
+    _CACHE = {}
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
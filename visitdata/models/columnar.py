@@ -0,0 +1,115 @@
+""" Columnar batches of records, backed by Arrow, used by vectorized
+transformations. Requires ``pyarrow``, imported lazily.
+"""
+
+
+def to_record_batches(data) -> list:
+    """ Returns a :class:`pyarrow.Table` or :class:`pyarrow.RecordBatch`
+    as a list of record batches, without copying the data. """
+    import pyarrow as pa
+    if isinstance(data, pa.Table):
+        return data.to_batches()
+    return [data]
+
+
+def broadcast_context(batch, context: dict):
+    """ Append the scalar values of a context as constant columns of a
+    batch.
+
+    Each value is stored once, as the dictionary of a dictionary encoded
+    column, instead of being copied on every row.
+
+    Arguments:
+        batch {:class:`pyarrow.RecordBatch`} -- The batch.
+        context {dict} -- The context, i.e. ``{"poi_code": "P1"}``. Values
+            which are not scalars, and columns already in the batch, are
+            skipped.
+
+    Returns:
+        :class:`pyarrow.RecordBatch` -- The batch with the context columns.
+    """
+    import pyarrow as pa
+    names = list(batch.schema.names)
+    arrays = list(batch.columns)
+    indices = None
+    for name, value in (context or {}).items():
+        if name in names or isinstance(value, (dict, list, tuple)):
+            continue
+        if indices is None:
+            # Every row points to the single value of the dictionary
+            indices = pa.Array.from_buffers(
+                pa.int8(), batch.num_rows,
+                [None, pa.py_buffer(bytes(batch.num_rows))])
+        names.append(name)
+        arrays.append(pa.DictionaryArray.from_arrays(
+            indices, pa.array([value])))
+    return pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+class BatchSchema:
+    """ Expected schema of columnar batches, checked with vectorized
+    operations on each batch.
+
+    Arguments:
+        fields {dict} -- Expected :class:`pyarrow.DataType` by column name.
+            Columns not listed are not checked.
+
+    Keyword Arguments:
+        not_null {list} -- Columns which must not contain nulls.
+        ranges {dict} -- Inclusive ``(min, max)`` bounds by column name,
+            either bound can be None.
+        strict {bool} -- Whether columns not listed in ``fields`` are
+            forbidden. (default: {False})
+    """
+
+    def __init__(self, fields: dict, not_null=(), ranges=None, strict=False):
+        self.fields = fields
+        self.not_null = list(not_null)
+        self.ranges = ranges or {}
+        self.strict = strict
+
+    def validate(self, data) -> list:
+        """ Validate a batch.
+
+        Arguments:
+            data {:class:`pyarrow.RecordBatch`} -- The batch, or a
+                :class:`pyarrow.Table`.
+
+        Returns:
+            list -- The errors found, as strings. Empty if the batch is
+                valid.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        errors = []
+        schema = data.schema
+        for name, data_type in self.fields.items():
+            index = schema.get_field_index(name)
+            if index < 0:
+                errors.append(f"Missing column {name}.")
+                continue
+            actual_type = schema.field(index).type
+            if pa.types.is_dictionary(actual_type):
+                actual_type = actual_type.value_type
+            if not actual_type.equals(data_type):
+                errors.append(f"Column {name} is {actual_type}, "
+                              f"expected {data_type}.")
+        if self.strict:
+            errors.extend(f"Unexpected column {name}."
+                          for name in schema.names if name not in self.fields)
+        if errors:
+            return errors
+        for name in self.not_null:
+            nulls = data.column(name).null_count
+            if nulls:
+                errors.append(f"Column {name} has {nulls} null values.")
+        for name, (minimum, maximum) in self.ranges.items():
+            column = data.column(name)
+            if len(column) == column.null_count:
+                continue
+            bounds = pc.min_max(column).as_py()
+            if minimum is not None and bounds['min'] < minimum:
+                errors.append(f"Column {name} has values below {minimum}.")
+            if maximum is not None and bounds['max'] > maximum:
+                errors.append(f"Column {name} has values above {maximum}.")
+        return errors
@@ -1,8 +1,11 @@
 """ Classes to provide a common API for different data objects (files, bytes)
 across multiple protocols (S3, API, FTP, etc.)."""
+import hashlib
 import os
 from abc import abstractmethod
 from datetime import datetime, timezone
+from contextlib import closing
+from uuid import uuid4
 
 from visitdata.models.sources import DatasourceProtocol, DatasourceDataset
 
@@ -14,6 +17,8 @@ class VDDataset():
         name (str): File name or source name of the dataset.
     """
 
+    __slots__ = ('name',)
+
     def __init__(self, name):
         # NOTE: name should be optionnal (for example: API)?
         self.name = name
@@ -36,21 +41,81 @@ class VDDataset():
         """
         raise NotImplementedError
 
+    def checksum(self) -> str:
+        """ Compute a hash of the content of the dataset. """
+        raise NotImplementedError()
+
 
 class S3VDDataset(VDDataset):
-    """ VDDataset for S3 protocol """
+    """ VDDataset for S3 protocol. A compact record of an S3 object: the
+    boto3 resource is only created when an operation needs it.
+
+    Args:
+        bucket_name (str): Bucket of the object.
+        key (str): Key of the object.
+        size (int): Size of the object in bytes, if known.
+        etag (str): ETag of the object, if known.
+        last_modified (datetime): Last modification of the object, if known.
+    """
+
+    __slots__ = ('bucket_name', 'key', 'size', 'etag', 'last_modified')
+
+    def __init__(self, bucket_name: str, key: str, size: int = None,
+                 etag: str = None, last_modified: datetime = None):
+        _, name = os.path.split(key)
+        super().__init__(name)
+        self.bucket_name = bucket_name
+        self.key = key
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def __repr__(self):
+        return (f"S3VDDataset(bucket_name={self.bucket_name!r}, "
+                f"key={self.key!r})")
 
     @staticmethod
     def init_from_s3_object(s3_object):
-        """ Init S3VDDataset from a s3 object classes
-        because s3 Object is a type created on the fly.
+        """ Init S3VDDataset from a boto3 s3 Object.
+
+        Arguments:
+            s3_object {boto3.resources.factory.s3.Object} -- A loaded object.
+
+        Returns:
+            :class:`S3VDDataset` -- The dataset.
         """
-        # TODO: document
+        return S3VDDataset(
+            bucket_name=s3_object.bucket_name,
+            key=s3_object.key,
+            size=s3_object.content_length,
+            etag=s3_object.e_tag,
+            last_modified=s3_object.last_modified)
 
-        s3_object.__class__ = type(
-            "VDS3Object", (S3VDDataset, type(s3_object)), {})
-        _, s3_object.name = os.path.split(s3_object.key)
-        return s3_object
+    @staticmethod
+    def init_from_listing(bucket_name: str, entry: dict):
+        """ Init S3VDDataset from an entry of a ListObjectsV2 response,
+        without requesting the object metadata again.
+
+        Arguments:
+            bucket_name {str} -- Name of the listed bucket.
+            entry {dict} -- An item of the ``Contents`` of the response.
+
+        Returns:
+            :class:`S3VDDataset` -- The dataset.
+        """
+        return S3VDDataset(
+            bucket_name=bucket_name,
+            key=entry['Key'],
+            size=entry.get('Size'),
+            etag=entry.get('ETag'),
+            last_modified=entry.get('LastModified'))
+
+    def resource(self):
+        """ Returns the boto3 s3 Object of the dataset. Its metadata is not
+        loaded. """
+        from visitdata.models.hooks import VDS3Hook, shared_hook
+        return shared_hook(VDS3Hook).get_resource_type('s3').Object(
+            self.bucket_name, self.key)
 
     def save_to_s3(self, *args, **kwargs):
         """ Copy S3 Object from one bucket to another
@@ -63,35 +128,154 @@ class S3VDDataset(VDDataset):
                 destination buckets are located in the same AWS
                 account.
                 (default: {True})
+            source_conn_id {str} -- Airflow connection of the source
+                account, required if ``from_same_account`` is False.
+            transfer_config {:class:`visitdata.models.transfer.TransferConfig`}
+                -- Settings of the copy. (default: read from environment)
+
+        Returns:
+            :class:`visitdata.models.transfer.TransferStats` -- Metrics
+                of the copy.
         """
-        from visitdata.models.hooks import VDS3Hook
-        bucket_source = getattr(self, 'bucket_name')
-        key_source = getattr(self, 'key')
+        from airflow.hooks.S3_hook import S3Hook
+        from visitdata.models.hooks import REGISTRY, VDS3Hook, shared_hook
+        from visitdata.models.transfer import TransferEngine
         bucket_dest = kwargs.get(
             'bucket_dest', os.getenv('VD_S3_DEFAULT_BUCKET'))
         key_dest = kwargs.get('key_dest')
-        from_same_account = kwargs.get('key_dest', True)
+        from_same_account = kwargs.get('from_same_account', True)
 
+        source_client = None
         if not from_same_account:
-            raise NotImplementedError()
-        copy_source = {
-            'Bucket': bucket_source,
-            'Key': key_source
-        }
-        # pylint: disable=no-member
-        bucket = VDS3Hook().get_bucket(bucket_dest)
-        bucket.copy(copy_source, key_dest)
+            source_conn_id = kwargs['source_conn_id']
+            source_client = REGISTRY.client(
+                (source_conn_id, 's3', None),
+                lambda: S3Hook(aws_conn_id=source_conn_id).get_conn())
+        engine = TransferEngine(
+            shared_hook(VDS3Hook).get_conn(),
+            config=kwargs.get('transfer_config'))
+        return engine.copy(
+            self.bucket_name, self.key, bucket_dest, key_dest,
+            size=self.size,
+            source_client=source_client)
 
     def remove_source(self):
-        getattr(self, 'delete')()
+        self.resource().delete()
+
+    def checksum(self, chunk_size=1024 * 1024) -> str:
+        """ Compute the SHA-256 hash of the object, streaming its content.
+
+        Keyword Arguments:
+            chunk_size {int} -- Number of bytes read at once.
+                (default: {1MB})
+        """
+        digest = hashlib.sha256()
+        body = self.resource().get()['Body']
+        for chunk in body.iter_chunks(chunk_size=chunk_size):
+            digest.update(chunk)
+        return digest.hexdigest()
 
     def to_datasource_dataset(
             self, protocol: DatasourceProtocol) -> DatasourceDataset:
         return DatasourceDataset(
+            id=str(uuid4()),
             organisation_id=protocol.organisation_id,
             datasource_protocol_id=protocol.id,
             # data_path_source=protocol.generate_datalake_path(
             #    suffix=self.name),
-            data_path_archive=getattr(self, 'key'),
+            data_path_archive=self.key,
+            process_e_timestamp=datetime.now(timezone.utc)
+        )
+
+
+class StreamedVDDataset(VDDataset):
+    """ VDDataset of a file downloaded through the hook of its source (i.e.
+    SFTP or HTTP), streamed to the datalake with a multipart upload instead
+    of going through the FTP S3 mirror.
+
+    Args:
+        hook (:class:`visitdata.models.hooks.mixins.ExtractMixin`): Hook of
+            the source, implementing ``iter_content`` and ``remove_file``.
+        key (str): Path or URL of the file in its source.
+        name (str): File name, defaults to the last part of ``key``.
+        size (int): Size of the file in bytes, if known.
+        etag (str): ETag of the file, if known.
+        last_modified (datetime): Last modification of the file, if known.
+    """
+
+    __slots__ = ('hook', 'key', 'size', 'etag', 'last_modified')
+
+    def __init__(self, hook, key: str, name: str = None, size: int = None,
+                 etag: str = None, last_modified: datetime = None):
+        super().__init__(name or key.rstrip('/').split('/')[-1])
+        self.hook = hook
+        self.key = key
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def __repr__(self):
+        return (f"StreamedVDDataset(hook={type(self.hook).__name__}, "
+                f"key={self.key!r})")
+
+    def save_to_s3(self, *args, **kwargs):
+        """ Stream the file to the datalake S3.
+
+        Keyword Arguments:
+            key_dest {type} -- Key the object in the new destination.
+            bucket_dest {str} -- Name of the bucket to copy the object to.
+                (default: Default S3 bucket defined during configuration)
+            transfer_config {:class:`visitdata.models.transfer.TransferConfig`}
+                -- Part size and retry settings of the upload.
+                (default: read from environment)
+
+        Returns:
+            :class:`visitdata.models.transfer.TransferStats` -- Metrics
+                of the upload.
+        """
+        from visitdata.models.hooks import VDS3Hook, shared_hook
+        writer = shared_hook(VDS3Hook).upload_writer(
+            kwargs.get('key_dest'),
+            bucket_name=kwargs.get('bucket_dest'),
+            config=kwargs.get('transfer_config'))
+        with writer, closing(self.hook.iter_content(
+                self, chunk_size=writer.config.multipart_chunksize)) as chunks:
+            for chunk in chunks:
+                writer.write(chunk)
+        return writer.stats
+
+    def remove_source(self):
+        self.hook.remove_file(self)
+
+    def checksum(self, chunk_size=1024 * 1024) -> str:
+        """ Compute the SHA-256 hash of the file, streaming its content.
+
+        Keyword Arguments:
+            chunk_size {int} -- Number of bytes read at once.
+                (default: {1MB})
+        """
+        digest = hashlib.sha256()
+        with closing(self.hook.iter_content(
+                self, chunk_size=chunk_size)) as chunks:
+            for chunk in chunks:
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def to_datasource_dataset(
+            self, protocol: DatasourceProtocol) -> DatasourceDataset:
+        """ Convert to a
+            :class:`visitdata.models.sources.DatasourceDataset`, whose
+            ``data_path_archive`` is the key of the copy of the file in the
+            datalake: the key of the file in its source may not end with
+            its name (i.e. a download URL), which the transform step uses to
+            find the extracted file.
+        """
+        dataset_id = str(uuid4())
+        return DatasourceDataset(
+            id=dataset_id,
+            organisation_id=protocol.organisation_id,
+            datasource_protocol_id=protocol.id,
+            data_path_archive=protocol.generate_datalake_path(
+                dataset_id=dataset_id, step="extract", suffix=self.name),
             process_e_timestamp=datetime.now(timezone.utc)
         )
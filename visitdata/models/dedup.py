@@ -0,0 +1,194 @@
+""" Deduplication of extracted files, based on the content fingerprint of
+the files, to avoid extracting a file uploaded again under another name.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from visitdata.models.datasets import VDDataset
+from visitdata.models.sources import DatasetFingerprint
+
+
+class LRUCache:
+    """ Thread-safe mapping keeping at most ``capacity`` items, evicting
+    the least recently used ones first.
+
+    Arguments:
+        capacity {int} -- Maximum number of items.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """ Returns the value of ``key`` and mark it as recently used. """
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def setdefault(self, key, value):
+        """ Set ``key`` to ``value`` unless it is already set, and returns
+        its value. """
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+            self._items[key] = value
+            if len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+            return value
+
+    def pop(self, key, default=None):
+        """ Remove ``key`` and returns its value. """
+        with self._lock:
+            return self._items.pop(key, default)
+
+
+class DedupIndex:
+    """ Index of the fingerprints of the files extracted for each protocol.
+
+    A file fingerprint is its ETag and size, or a SHA-256 hash of its
+    content if ``content_hash`` is set (slower, as the whole file is read,
+    but independent from how the file has been uploaded). Fingerprints are
+    stored in the ``datasource_dataset_fingerprint`` table (see
+    ``migrations/0001_datasource_dataset_fingerprint.sql``); an in-process
+    LRU cache sits in front of it.
+
+    A file is only recorded as a duplicate once its original file has been
+    extracted: duplicates of a file still being extracted wait for it, and
+    one of them is extracted instead if the original file fails.
+
+    Arguments:
+        hook {:class:`visitdata.models.hooks.VDDataflowHook`} -- Hook used
+            to look fingerprints up.
+
+    Keyword Arguments:
+        content_hash {bool} -- Whether to fingerprint files by their
+            content. (default: {False})
+        capacity {int} -- Number of fingerprints kept in cache. Defaults to
+            the ``VD_EXTRACT_DEDUP_CACHE_SIZE`` environment variable, or
+            10000.
+    """
+
+    def __init__(self, hook, content_hash=False, capacity=None):
+        self.hook = hook
+        self.content_hash = content_hash
+        self._cache = LRUCache(int(
+            capacity or os.getenv('VD_EXTRACT_DEDUP_CACHE_SIZE') or 10000))
+        # (cache key, extraction) of the claimed fingerprints, by dataset
+        self._extractions = {}
+        self._lock = threading.Lock()
+
+    def fingerprint(self, protocol_id, file: VDDataset) -> DatasetFingerprint:
+        """ Compute the fingerprint of a file.
+
+        Arguments:
+            protocol_id {str} -- ID of the protocol of the file.
+            file {:class:`visitdata.models.datasets.VDDataset`} -- The file.
+
+        Returns:
+            :class:`visitdata.models.sources.DatasetFingerprint` -- The
+                fingerprint, not linked to any dataset yet.
+        """
+        return DatasetFingerprint(
+            id=str(uuid4()),
+            datasource_protocol_id=protocol_id,
+            etag=getattr(file, 'etag', None),
+            size=getattr(file, 'size', None),
+            content_hash=file.checksum() if self.content_hash else None,
+            source_key=getattr(file, 'key', file.name),
+            created_timestamp=datetime.now(timezone.utc))
+
+    def __key(self, fingerprint: DatasetFingerprint) -> tuple:
+        if self.content_hash:
+            return (fingerprint.datasource_protocol_id,
+                    fingerprint.content_hash)
+        return (fingerprint.datasource_protocol_id,
+                fingerprint.etag, fingerprint.size)
+
+    def claim(self, fingerprint: DatasetFingerprint,
+              dataset_id: str) -> Future:
+        """ Claim a fingerprint for a dataset about to be extracted.
+
+        Arguments:
+            fingerprint {:class:`visitdata.models.sources.DatasetFingerprint`}
+                -- Fingerprint of the file.
+            dataset_id {str} -- ID of the dataset to create for the file.
+
+        Returns:
+            :class:`concurrent.futures.Future` -- None if the fingerprint
+                is claimed for the dataset: the file must be extracted, then
+                :meth:`confirm` or :meth:`release` called. Otherwise the
+                file is a duplicate, and the fingerprint is linked to the
+                dataset of the original file. The future then resolves to
+                whether the original file has been extracted, once it is
+                done.
+        """
+        if not self.content_hash and not fingerprint.etag:
+            # Without fingerprint the file cannot be deduplicated
+            fingerprint.datasource_dataset_id = dataset_id
+            fingerprint.duplicate = False
+            return None
+        key = self.__key(fingerprint)
+        with self._lock:
+            original_id = self._cache.get(key)
+            if original_id is None:
+                original_id = self.hook.find_fingerprint(
+                    fingerprint, content_hash=self.content_hash)
+            if original_id is None:
+                # Concurrent files with the same content: the first one wins
+                original_id = self._cache.setdefault(key, dataset_id)
+            else:
+                self._cache.setdefault(key, original_id)
+            fingerprint.datasource_dataset_id = original_id
+            fingerprint.duplicate = original_id != dataset_id
+            if not fingerprint.duplicate:
+                self._extractions[dataset_id] = (key, Future())
+                return None
+            _, extraction = self._extractions.get(original_id, (None, None))
+        if extraction is None:
+            # The original file has already been extracted
+            extraction = Future()
+            extraction.set_result(True)
+        return extraction
+
+    def confirm(self, dataset_id: str):
+        """ Record that the file of a dataset has been extracted and the
+        fingerprint it claimed saved, so that its duplicates are skipped.
+
+        Arguments:
+            dataset_id {str} -- ID of the dataset passed to :meth:`claim`.
+        """
+        self.__settle(dataset_id, extracted=True)
+
+    def release(self, dataset_id: str):
+        """ Forget the fingerprint claimed by the file of a dataset whose
+        extraction failed, so that it can be extracted again by another
+        file.
+
+        Arguments:
+            dataset_id {str} -- ID of the dataset passed to :meth:`claim`.
+        """
+        self.__settle(dataset_id, extracted=False)
+
+    def __settle(self, dataset_id: str, extracted: bool):
+        """ Resolve the extraction of a claimed fingerprint, waking up the
+        duplicates waiting for it. Saved fingerprints are expired by their
+        commit, so they are not read again. """
+        with self._lock:
+            key, extraction = self._extractions.pop(dataset_id, (None, None))
+            if extraction is None:
+                return
+            if not extracted and self._cache.get(key) == dataset_id:
+                self._cache.pop(key)
+        extraction.set_result(extracted)
@@ -0,0 +1,65 @@
+""" Executor running the extraction of listed files, serially or with a pool
+of threads, without pulling the whole listing in memory.
+"""
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class FileExecutor:
+    """ Run a function over (protocol, file) pairs. A failing file does not
+    stop the others, it is handed to ``on_failure``.
+
+    Arguments:
+        function {callable} -- Called with the protocol and the file to
+            process.
+        on_failure {callable} -- Called with the protocol ID, the file name
+            and the error of every file whose processing failed.
+
+    Keyword Arguments:
+        max_workers {int} -- Number of files processed concurrently, files
+            are processed serially if it is 1. (default: {1})
+    """
+
+    def __init__(self, function, on_failure, max_workers: int = 1):
+        self.function = function
+        self.on_failure = on_failure
+        self.max_workers = max_workers
+
+    def run(self, files):
+        """ Process files, serially or concurrently depending on
+        ``max_workers``.
+
+        Arguments:
+            files {iterable} -- (protocol, file) pairs to process.
+        """
+        if self.max_workers <= 1:
+            for protocol, file in files:
+                try:
+                    self.function(protocol, file)
+                except Exception as error:  # pylint: disable=broad-except
+                    self.on_failure(protocol.id, file.name, error)
+        else:
+            self.__run_concurrently(files)
+
+    def __run_concurrently(self, files):
+        """ Process files with a pool of ``max_workers`` threads. """
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for protocol, file in files:
+                # Bound the number of queued files so that lazily fetched
+                # files are not all pulled in memory at once.
+                if len(in_flight) >= self.max_workers * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self.__collect(done, in_flight)
+                future = executor.submit(self.function, protocol, file)
+                in_flight[future] = (protocol.id, file.name)
+            done, _ = wait(in_flight)
+            self.__collect(done, in_flight)
+
+    def __collect(self, done, in_flight: dict):
+        """ Pop finished files from the in-flight ones and hand failures to
+        ``on_failure``. """
+        for future in done:
+            protocol_id, file_name = in_flight.pop(future)
+            error = future.exception()
+            if error is not None:
+                self.on_failure(protocol_id, file_name, error)
@@ -0,0 +1,179 @@
+""" Streaming readers and writers of record batches, used to transform
+files of any size with a bounded memory footprint.
+"""
+import codecs
+import csv
+import io
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def iter_csv_batches(stream, batch_size: int = DEFAULT_BATCH_SIZE,
+                     encoding: str = 'utf-8', **csv_options):
+    """ Read a CSV file with a header line by batches of records.
+
+    Arguments:
+        stream {file} -- Binary stream of the file, i.e. the body of an S3
+            object.
+
+    Keyword Arguments:
+        batch_size {int} -- Maximum number of records per batch.
+            (default: {10000})
+        encoding {str} -- Encoding of the file. (default: {'utf-8'})
+        csv_options -- Options of :class:`csv.DictReader`, i.e. delimiter.
+
+    Yields:
+        list -- Batches of records, as dicts by column name.
+    """
+    reader = csv.DictReader(codecs.getreader(encoding)(stream), **csv_options)
+    batch = []
+    for record in reader:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_arrow_batches(stream, batch_size: int = DEFAULT_BATCH_SIZE,
+                       encoding: str = 'utf-8', block_size: int = None,
+                       **csv_options):
+    """ Read a CSV file with a header line by columnar batches, with the
+    streaming CSV reader of ``pyarrow``.
+
+    Arguments:
+        stream {file} -- Binary stream of the file, i.e. the body of an S3
+            object.
+
+    Keyword Arguments:
+        batch_size {int} -- Maximum number of rows per batch.
+            (default: {10000})
+        encoding {str} -- Encoding of the file. (default: {'utf-8'})
+        block_size {int} -- Number of bytes parsed at once. Defaults to the
+            ``pyarrow`` default.
+        csv_options -- Options of :class:`pyarrow.csv.ParseOptions`, i.e.
+            delimiter.
+
+    Yields:
+        :class:`pyarrow.RecordBatch` -- Batches of rows.
+    """
+    from pyarrow import csv as pa_csv
+    read_options = pa_csv.ReadOptions(encoding=encoding)
+    if block_size:
+        read_options.block_size = block_size
+    reader = pa_csv.open_csv(
+        stream,
+        read_options=read_options,
+        parse_options=pa_csv.ParseOptions(**csv_options))
+    for batch in reader:
+        # Slicing a record batch does not copy it
+        for offset in range(0, batch.num_rows, batch_size):
+            yield batch.slice(offset, batch_size)
+
+
+class CSVBatchWriter:
+    """ Write batches of records to a CSV file with a header line.
+
+    Arguments:
+        fileobj {file} -- Binary file object to write to.
+
+    Keyword Arguments:
+        encoding {str} -- Encoding of the file. (default: {'utf-8'})
+        csv_options -- Options of :class:`csv.DictWriter`.
+    """
+
+    extension = "csv"
+
+    def __init__(self, fileobj, encoding: str = 'utf-8', **csv_options):
+        self._stream = io.TextIOWrapper(
+            io.BufferedWriter(fileobj), encoding=encoding, newline='')
+        self._csv_options = csv_options
+        self._writer = None
+
+    def write_batch(self, records):
+        """ Write a batch of records, as dicts by column name or as a
+        :class:`pyarrow.RecordBatch`. """
+        if hasattr(records, 'to_pydict'):
+            columns = records.to_pydict()
+            records = [dict(zip(columns, row))
+                       for row in zip(*columns.values())]
+        if not records:
+            return
+        if self._writer is None:
+            self._writer = csv.DictWriter(
+                self._stream, fieldnames=list(records[0]),
+                **self._csv_options)
+            self._writer.writeheader()
+        self._writer.writerows(records)
+
+    def close(self):
+        """ Flush the written records and close the file. """
+        self._stream.close()
+
+
+class ParquetBatchWriter:
+    """ Write batches of records to a Parquet file, each batch as a row
+    group. The schema is inferred from the first batch. Requires
+    ``pyarrow``.
+
+    Arguments:
+        fileobj {file} -- Binary file object to write to.
+
+    Keyword Arguments:
+        compression {str} -- Compression codec. (default: {'snappy'})
+    """
+
+    extension = "parquet"
+
+    def __init__(self, fileobj, compression: str = 'snappy'):
+        self._fileobj = fileobj
+        self._compression = compression
+        self._writer = None
+
+    def write_batch(self, records):
+        """ Write a batch of records, as dicts by column name or as a
+        :class:`pyarrow.Table`. """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if isinstance(records, (pa.Table, pa.RecordBatch)):
+            table = records if isinstance(records, pa.Table) \
+                else pa.Table.from_batches([records])
+        elif records:
+            table = pa.Table.from_pydict({
+                column: [record.get(column) for record in records]
+                for column in records[0]})
+        else:
+            return
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(
+                self._fileobj, table.schema, compression=self._compression)
+        elif table.schema != self._writer.schema:
+            table = table.cast(self._writer.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        """ Write the file footer and close the file. """
+        if self._writer is not None:
+            self._writer.close()
+        self._fileobj.close()
+
+
+WRITERS = {
+    CSVBatchWriter.extension: CSVBatchWriter,
+    ParquetBatchWriter.extension: ParquetBatchWriter,
+}
+
+
+def batch_writer(output_format: str, fileobj, **options):
+    """ Returns a batch writer for an output format.
+
+    Arguments:
+        output_format {str} -- ``csv`` or ``parquet``.
+        fileobj {file} -- Binary file object to write to.
+    """
+    try:
+        writer_class = WRITERS[output_format]
+    except KeyError:
+        raise ValueError(f"Unknown output format {output_format}.")
+    return writer_class(fileobj, **options)
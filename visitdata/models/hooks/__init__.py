@@ -1,6 +1,11 @@
 
 """ Base hooks classes to use with operators. """
 
+from .registry import *
 from .vd_s3_hook import *
+from .vd_s3_async_hook import *
 from .vd_rs_hook import *
 from .vd_dataflow_hook import *
+from .vd_sftp_hook import *
+from .vd_http_hook import *
+from .extractors import *
@@ -0,0 +1,88 @@
+""" Registry of the hooks extracting files, selected by the ``source_type``
+of the protocols.
+"""
+from visitdata.models.hooks.mixins import AsyncExtractMixin
+from visitdata.models.hooks.registry import shared_hook
+from visitdata.models.hooks.vd_s3_hook import VDS3Hook
+from visitdata.models.hooks.vd_s3_async_hook import VDS3AsyncHook
+from visitdata.models.hooks.vd_sftp_hook import VDSFTPHook
+from visitdata.models.hooks.vd_http_hook import VDHTTPHook
+
+# Source type of the protocols without one
+DEFAULT_SOURCE_TYPE = "s3"
+
+# Hook classes by source type. Hooks of mirrored sources are instantiated
+# without argument, the others with the ``source_access`` of the protocol,
+# the Airflow connection of the source.
+EXTRACTORS = {
+    "s3": VDS3Hook,
+    # Files uploaded to our FTP server are mirrored to S3
+    "ftp": VDS3Hook,
+    "sftp": VDSFTPHook,
+    "http": VDHTTPHook,
+    "https": VDHTTPHook,
+}
+
+MIRRORED_EXTRACTORS = (VDS3Hook,)
+
+# Async variants of the hooks, by hook class
+ASYNC_EXTRACTORS = {
+    VDS3Hook: VDS3AsyncHook,
+}
+
+
+def register_extractor(source_type: str, hook_class):
+    """ Register the hook extracting the files of a source type.
+
+    Arguments:
+        source_type {str} -- The ``source_type`` of the protocols.
+        hook_class {type} -- Class of the hook, implementing
+            :class:`visitdata.models.hooks.mixins.ExtractMixin`. It is
+            instantiated with the ``source_access`` of the protocols.
+    """
+    EXTRACTORS[source_type.lower()] = hook_class
+
+
+def extractor_for(protocol):
+    """ Returns the hook extracting the files of a protocol, shared by the
+    process with the protocols of the same source.
+
+    Arguments:
+        protocol {:class:`visitdata.models.sources.DatasourceProtocol`}
+            -- The protocol.
+
+    Returns:
+        :class:`visitdata.models.hooks.mixins.ExtractMixin` -- The hook.
+    """
+    source_type = (protocol.source_type or DEFAULT_SOURCE_TYPE).lower()
+    try:
+        hook_class = EXTRACTORS[source_type]
+    except KeyError:
+        raise ValueError(f"Protocol {protocol.id}: unknown source type "
+                         f"{protocol.source_type}.")
+    if hook_class in MIRRORED_EXTRACTORS:
+        return shared_hook(hook_class)
+    if not protocol.source_access:
+        raise ValueError(f"Protocol {protocol.id}: no connection set in "
+                         f"source_access for source type {source_type}.")
+    return shared_hook(hook_class, protocol.source_access)
+
+
+def async_extractor(hook) -> AsyncExtractMixin:
+    """ Returns the async variant of an extraction hook, shared by the
+    process.
+
+    Arguments:
+        hook {:class:`visitdata.models.hooks.mixins.ExtractMixin`} -- The
+            hook.
+
+    Returns:
+        :class:`visitdata.models.hooks.mixins.AsyncExtractMixin` -- The
+            async hook, or None if the hook has no async variant.
+    """
+    if isinstance(hook, AsyncExtractMixin):
+        return hook
+    hook_class = ASYNC_EXTRACTORS.get(type(hook))
+    if hook_class is None:
+        return None
+    return shared_hook(hook_class)
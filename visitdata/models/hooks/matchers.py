@@ -0,0 +1,80 @@
+""" Match listed keys against the paths and file masks of several
+extraction targets at once.
+"""
+import os
+import re
+from fnmatch import translate
+from functools import lru_cache
+
+
+def common_folder(paths) -> str:
+    """ Returns the deepest folder holding every path, i.e. the prefix to
+    list once for several targets.
+
+    Arguments:
+        paths {iterable} -- Paths of the targets.
+
+    Returns:
+        str -- The longest common prefix of the paths, trimmed after its
+            last ``/``, or the path itself if there is a single one, so
+            that a path which is not a folder does not list its parent.
+    """
+    paths = set(paths)
+    prefix = os.path.commonprefix(list(paths))
+    if len(paths) == 1:
+        return prefix
+    return prefix[:prefix.rfind('/') + 1]
+
+
+@lru_cache(maxsize=None)
+def compile_mask(mask: str = None):
+    """ Compile a unix file mask once, with the same semantics as
+    :func:`fnmatch.fnmatch`.
+
+    Arguments:
+        mask {str} -- A unix file mask. If empty, every name matches.
+
+    Returns:
+        callable -- A function returning whether a file name matches the mask.
+    """
+    if not mask:
+        return lambda name: True
+    match = re.compile(translate(os.path.normcase(mask))).match
+    return lambda name: match(os.path.normcase(name)) is not None
+
+
+class PrefixIndex:
+    """ Dispatch keys listed once under a common prefix to every target
+    whose path and mask match, so that targets sharing a prefix do not
+    require a listing each.
+    """
+
+    def __init__(self):
+        self._targets = []
+
+    def __len__(self):
+        return len(self._targets)
+
+    def add(self, target, path: str, mask: str = None):
+        """ Register a target.
+
+        Arguments:
+            target -- The object returned for matching keys.
+            path {str} -- Prefix the keys of the target start with.
+            mask {str} -- Unix file mask the file name of the keys must
+                match. (default: {None})
+        """
+        self._targets.append((target, path, compile_mask(mask)))
+
+    def dispatch(self, key: str) -> list:
+        """ Returns the targets a key belongs to.
+
+        Arguments:
+            key {str} -- A listed key.
+
+        Returns:
+            list -- The targets whose path and mask match the key.
+        """
+        name = key.split('/')[-1]
+        return [target for target, path, match in self._targets
+                if key.startswith(path) and match(name)]
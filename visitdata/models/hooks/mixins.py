@@ -7,26 +7,143 @@ class ExtractMixin:
     def fetch_data(self, *args, **kwargs) -> list:
         """ Describe how to connect to an external
         source and extract the data.
+        Hooks able to fetch data lazily should accept a ``lazy`` keyword
+        argument and return an iterator when it is set.
         Returns:
             (list) A list of :class:`visitdata.models.datasets.VDDataset`.
         """
         raise NotImplementedError()
 
+    def fetch_data_multi(self, prefix, targets, **kwargs) -> list:
+        """ Fetch data of several targets sharing a common prefix.
+        Hooks able to fetch all of them at once should override it, by
+        default :meth:`fetch_data` is called for each target.
+
+        Arguments:
+            prefix {str} -- Common prefix of the targets paths.
+            targets {list} -- (target, path, mask) tuples.
+
+        Returns:
+            (list) (target, :class:`visitdata.models.datasets.VDDataset`)
+                pairs.
+        """
+        return [(target, file)
+                for target, path, mask in targets
+                for file in self.fetch_data(path=path, mask=mask, **kwargs)]
+
+    def remove_sources(self, files: list) -> list:
+        """ Remove the sources of extracted files. Hooks able to remove
+        several files at once should override it, by default the files are
+        removed one by one.
+
+        Arguments:
+            files {list} -- :class:`visitdata.models.datasets.VDDataset`
+                to remove.
+
+        Returns:
+            (list) (file, error) pairs of the files which could not be
+                removed.
+        """
+        failures = []
+        for file in files:
+            try:
+                file.remove_source()
+            except Exception as error:  # pylint: disable=broad-except
+                failures.append((file, error))
+        return failures
+
+    def iter_content(self, file, chunk_size: int = 1024 * 1024):
+        """ Describe how to download a file of the source, for files
+        streamed to the datalake (see
+        :class:`visitdata.models.datasets.StreamedVDDataset`).
+
+        Arguments:
+            file {:class:`visitdata.models.datasets.StreamedVDDataset`}
+                -- The file to download.
+
+        Keyword Arguments:
+            chunk_size {int} -- Maximum number of bytes per chunk.
+                (default: {1MB})
+
+        Returns:
+            iterator -- The content of the file, as chunks of bytes.
+        """
+        raise NotImplementedError()
+
+    def remove_file(self, file):
+        """ Describe how to remove a file from the source.
+        """
+        raise NotImplementedError()
+
+
+class AsyncExtractMixin:
+    """ Expose coroutines to fetch data during an asyncio extract process
+    (see ``async_io`` of
+    :class:`visitdata.models.operators.ExtractOperator`).
+
+    Async clients are bound to the event loop they are opened in, so they
+    are opened by every run with :meth:`client` and passed to the other
+    methods, while the hook itself is shared by the process.
+    """
+
+    def client(self, max_pool_connections: int = None):
+        """ Describe how to open an async client of the source.
+
+        Keyword Arguments:
+            max_pool_connections {int} -- Maximum number of connections
+                opened at once. (default: {None})
+
+        Returns:
+            An async context manager, yielding the client.
+        """
+        raise NotImplementedError()
+
+    def fetch_data_multi_async(self, client, prefix, targets, **kwargs):
+        """ Describe how to fetch data of several targets sharing a common
+        prefix, as :meth:`ExtractMixin.fetch_data_multi`.
+
+        Returns:
+            async iterator -- (target,
+                :class:`visitdata.models.datasets.VDDataset`) pairs.
+        """
+        raise NotImplementedError()
+
+    async def save_file_async(self, client, file, key_dest: str, **kwargs):
+        """ Describe how to copy a file to the datalake.
+
+        Returns:
+            :class:`visitdata.models.transfer.TransferStats` -- Metrics
+                of the copy.
+        """
+        raise NotImplementedError()
+
+    async def remove_sources_async(self, client, files: list) -> list:
+        """ Describe how to remove the sources of extracted files, as
+        :meth:`ExtractMixin.remove_sources`.
+
+        Returns:
+            (list) (file, error) pairs of the files which could not be
+                removed.
+        """
+        raise NotImplementedError()
+
 
 class VDDBMixin:
     """ Expose methods to load, unload and retrieve data in a Database """
 
-    def load(self):
-        """ Describe how to load data into a database.
+    def load(self, table, keys, **kwargs):
+        """ Describe how to load files of the datalake into a table of a
+        database.
         """
         raise NotImplementedError()
 
-    def unload(self):
-        """ Describe how to unload data out of a database.
+    def unload(self, table, dataset_ids, **kwargs):
+        """ Describe how to unload the data of some datasets out of a
+        database.
         """
         raise NotImplementedError()
 
-    def retrieve(self):
+    def retrieve(self, query, **kwargs):
         """ Describe how to retrieve data in a database.
         """
         raise NotImplementedError()
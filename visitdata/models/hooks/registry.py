@@ -0,0 +1,180 @@
+""" Process-wide registry sharing connections, clients and engines between
+hook instances, so that they are created once per process instead of once
+per hook.
+"""
+import os
+import threading
+
+from sqlalchemy import event, exc
+
+
+class HookRegistry:
+    """ Cache Airflow connections, boto3 clients and resources, SQLAlchemy
+    engines and hook instances for the current process.
+
+    boto3 clients and SQLAlchemy engines are thread-safe and shared by all
+    threads, boto3 resources are not and are cached per thread.
+
+    Sockets must not be shared between processes: :meth:`reset` is called
+    in child processes after a fork, and engines refuse connections opened
+    by another process.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+        self._connections = {}
+        self._clients = {}
+        self._engines = {}
+        self._hooks = {}
+        self._local = threading.local()
+        # Engines inherited from a parent process. They are kept referenced
+        # so that garbage collection does not close the parent sockets.
+        self._orphan_engines = []
+
+    def __check_pid(self):
+        """ Reset the registry if the process has been forked without
+        the fork hooks being called.
+        """
+        if self._pid != os.getpid():
+            self.reset()
+
+    def __get_or_create(self, cache: dict, key, factory):
+        self.__check_pid()
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        with self._lock:
+            if key not in cache:
+                cache[key] = factory()
+            return cache[key]
+
+    def connection(self, conn_id: str, factory):
+        """ Returns the Airflow connection ``conn_id``.
+
+        Arguments:
+            conn_id {str} -- ID of the connection.
+            factory {callable} -- Called to retrieve the connection
+                if it is not cached yet.
+        """
+        return self.__get_or_create(self._connections, conn_id, factory)
+
+    def client(self, key: tuple, factory):
+        """ Returns the boto3 client identified by ``key``.
+
+        Arguments:
+            key {tuple} -- Connection ID, client type and region of the
+                client.
+            factory {callable} -- Called to create the client if it is not
+                cached yet.
+        """
+        return self.__get_or_create(self._clients, key, factory)
+
+    def resource(self, key: tuple, factory):
+        """ Returns the boto3 resource identified by ``key`` for the
+        current thread.
+
+        Arguments:
+            key {tuple} -- Connection ID, resource type and region of the
+                resource.
+            factory {callable} -- Called to create the resource if it is not
+                cached yet for the current thread.
+        """
+        self.__check_pid()
+        resources = getattr(self._local, 'resources', None)
+        if resources is None:
+            resources = self._local.resources = {}
+        if key not in resources:
+            resources[key] = factory()
+        return resources[key]
+
+    def engine(self, conn_id: str, factory):
+        """ Returns the SQLAlchemy engine of connection ``conn_id``.
+
+        Arguments:
+            conn_id {str} -- ID of the connection.
+            factory {callable} -- Called to create the engine if it is not
+                cached yet.
+        """
+        def create_engine():
+            engine = factory()
+            self.__protect_engine(engine)
+            return engine
+        return self.__get_or_create(self._engines, conn_id, create_engine)
+
+    def hook(self, hook_class, *args):
+        """ Returns an instance of ``hook_class`` shared by the process.
+
+        Arguments:
+            hook_class {type} -- Class of the hook, instantiated with
+                ``args``.
+            args -- Arguments of the hook, i.e. its connection ID. Each
+                set of arguments has its own instance.
+        """
+        key = (hook_class,) + args if args else hook_class
+        return self.__get_or_create(
+            self._hooks, key, lambda: hook_class(*args))
+
+    @staticmethod
+    def __protect_engine(engine):
+        """ Invalidate pooled connections opened by another process, as
+        advised by SQLAlchemy for multiprocessing.
+        """
+        @event.listens_for(engine, "connect")
+        def connect(dbapi_connection, connection_record):
+            connection_record.info['pid'] = os.getpid()
+
+        @event.listens_for(engine, "checkout")
+        def checkout(dbapi_connection, connection_record, connection_proxy):
+            pid = os.getpid()
+            if connection_record.info['pid'] != pid:
+                connection_record.connection = None
+                connection_proxy.connection = None
+                raise exc.DisconnectionError(
+                    "Connection record belongs to pid "
+                    f"{connection_record.info['pid']}, "
+                    f"attempting to check out in pid {pid}")
+
+    def reset(self):
+        """ Forget everything inherited from the parent process, without
+        closing it. To call in a child process after a fork.
+
+        The child only runs the forking thread: the lock is replaced rather
+        than acquired, as another thread of the parent may have held it.
+        """
+        self._lock = threading.RLock()
+        self._orphan_engines.extend(self._engines.values())
+        self._pid = os.getpid()
+        self._connections = {}
+        self._clients = {}
+        self._engines = {}
+        self._hooks = {}
+        self._local = threading.local()
+
+    def dispose(self):
+        """ Close the engines pools and clear the registry. """
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._connections = {}
+            self._clients = {}
+            self._engines = {}
+            self._hooks = {}
+            self._local = threading.local()
+
+
+REGISTRY = HookRegistry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY.reset)
+
+
+def shared_hook(hook_class, *args):
+    """ Returns the instance of ``hook_class`` shared by the process.
+
+    Arguments:
+        hook_class {type} -- Class of the hook.
+        args -- Arguments of the hook, i.e. its connection ID.
+    """
+    return REGISTRY.hook(hook_class, *args)
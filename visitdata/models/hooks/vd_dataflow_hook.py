@@ -1,11 +1,205 @@
 """ Classes used to retrieve tasks and data sources information necessary
 to run Airflow and the ELTP processes.
 """
-from visitdata.models.sources import DataTask, DatasourceDataset
+import os
+from uuid import uuid4
+
+from sqlalchemy import and_, inspect, update
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.orm.attributes import set_committed_value
+
+from visitdata.models.sources import (
+    Datasource, DataTask, DatasetFingerprint, DatasourceDataset,
+    DatasourceProtocol)
 
 from visitdata.models.hooks import VDRSHook
 
 
+def watermark_statement(protocol_id, previous: str, watermark: str):
+    """ Build the statement moving the watermark of a protocol, only if it
+    has not been moved by someone else in the meantime.
+
+    Arguments:
+        protocol_id {str} -- ID of the protocol.
+        previous {str} -- Serialized watermark read before the run.
+        watermark {str} -- Serialized new watermark.
+    """
+    if previous is None:
+        unchanged = DatasourceProtocol.source_sync_last.is_(None)
+    else:
+        unchanged = DatasourceProtocol.source_sync_last == previous
+    return update(DatasourceProtocol.__table__).where(
+        and_(DatasourceProtocol.id == protocol_id, unchanged)
+    ).values(source_sync_last=watermark)
+
+
+# Timestamp set on a dataset at the end of each ELTP step, in order
+STEP_TIMESTAMPS = {
+    "extract": DatasourceDataset.process_e_timestamp,
+    "transform": DatasourceDataset.process_t_timestamp,
+    "load": DatasourceDataset.process_l_timestamp,
+    "post_process": DatasourceDataset.process_p_timestamp,
+}
+
+
+def step_statement(dataset_ids: list, step: str, timestamp):
+    """ Build the statement recording the end of an ELTP step for some
+    datasets, i.e. to execute it in the transaction loading them.
+
+    Arguments:
+        dataset_ids {list} -- IDs of the datasets.
+        step {str} -- ``extract``, ``transform``, ``load`` or
+            ``post_process``.
+        timestamp {datetime} -- End of the step.
+    """
+    column = STEP_TIMESTAMPS[step]
+    return update(DatasourceDataset.__table__).where(
+        DatasourceDataset.id.in_(list(dataset_ids))
+    ).values({column.key: timestamp})
+
+
+class DatasetBatch:
+    """ Unit of work collecting new datasets and their updates to persist
+    them with a few bulk statements instead of one commit per row.
+
+    Datasets ids are generated client-side when they are added, so they can
+    be used (i.e. to generate datalake paths) before the batch is flushed.
+    The batch is flushed automatically once ``chunk_size`` datasets are
+    pending, and when leaving the ``with`` block.
+
+    Arguments:
+        session {:class:`sqlalchemy.orm.Session`} -- Session to flush with.
+
+    Keyword Arguments:
+        chunk_size {int} -- Maximum number of rows per statement.
+            (default: {500})
+        on_flush {callable} -- Called with the list of flushed datasets
+            and fingerprints once they are committed. (default: {None})
+    """
+
+    def __init__(self, session, chunk_size=500, on_flush=None):
+        self._session = session
+        self.chunk_size = chunk_size
+        self.on_flush = on_flush
+        self._new = {}
+        self._dirty = {}
+        self._watermarks = {}
+        self._fingerprints = []
+        self._columns = {
+            model: [column.key for column in inspect(model).column_attrs]
+            for model in (DatasourceDataset, DatasetFingerprint)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def __len__(self):
+        return len(self._new) + len(self._dirty) + len(self._fingerprints)
+
+    def add(self, dataset: DatasourceDataset) -> DatasourceDataset:
+        """ Register a new dataset to insert.
+
+        Arguments:
+            dataset {:class:`visitdata.models.sources.DatasourceDataset`}
+                -- The dataset to insert.
+
+        Returns:
+            :class:`visitdata.models.sources.DatasourceDataset` -- The
+                dataset, with its id set.
+        """
+        if dataset.id is None:
+            dataset.id = str(uuid4())
+        self._new[dataset.id] = dataset
+        self.__flush_if_full()
+        return dataset
+
+    def update(self, dataset: DatasourceDataset):
+        """ Register a dataset to update. Datasets which have not been
+        inserted yet are simply inserted with their new values.
+
+        Arguments:
+            dataset {:class:`visitdata.models.sources.DatasourceDataset`}
+                -- The dataset to update.
+        """
+        if dataset.id not in self._new:
+            self._dirty[dataset.id] = dataset
+        self.__flush_if_full()
+
+    def add_fingerprint(self, fingerprint: DatasetFingerprint):
+        """ Register a new fingerprint to insert.
+
+        Arguments:
+            fingerprint {:class:`visitdata.models.sources.DatasetFingerprint`}
+                -- The fingerprint to insert.
+        """
+        self._fingerprints.append(fingerprint)
+        self.__flush_if_full()
+
+    def advance_watermark(self, protocol_id, previous: str, watermark: str):
+        """ Register a protocol watermark to move in the same transaction as
+        the next flush.
+
+        Arguments:
+            protocol_id {str} -- ID of the protocol.
+            previous {str} -- Serialized watermark read before the run.
+            watermark {str} -- Serialized new watermark.
+        """
+        self._watermarks[protocol_id] = watermark_statement(
+            protocol_id, previous, watermark)
+
+    def __flush_if_full(self):
+        if len(self) >= self.chunk_size:
+            self.flush()
+
+    def __chunks(self, model, rows: list):
+        columns = self._columns[model]
+        for index in range(0, len(rows), self.chunk_size):
+            yield [{key: getattr(row, key) for key in columns}
+                   for row in rows[index:index + self.chunk_size]]
+
+    def flush(self) -> list:
+        """ Insert and update pending datasets in a single transaction.
+
+        Returns:
+            list -- The flushed
+                :class:`visitdata.models.sources.DatasourceDataset` and
+                :class:`visitdata.models.sources.DatasetFingerprint`.
+        """
+        new, dirty = list(self._new.values()), list(self._dirty.values())
+        fingerprints = self._fingerprints
+        if not new and not dirty and not fingerprints \
+                and not self._watermarks:
+            return []
+        try:
+            for mappings in self.__chunks(DatasourceDataset, new):
+                self._session.bulk_insert_mappings(
+                    DatasourceDataset, mappings)
+            for mappings in self.__chunks(DatasourceDataset, dirty):
+                self._session.bulk_update_mappings(
+                    DatasourceDataset, mappings)
+            # Fingerprints reference datasets, insert them afterwards
+            for mappings in self.__chunks(DatasetFingerprint, fingerprints):
+                self._session.bulk_insert_mappings(
+                    DatasetFingerprint, mappings)
+            for statement in self._watermarks.values():
+                self._session.execute(statement)
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+        self._new.clear()
+        self._dirty.clear()
+        self._watermarks.clear()
+        self._fingerprints = []
+        flushed = new + dirty + fingerprints
+        if self.on_flush:
+            self.on_flush(flushed)
+        return flushed
+
+
 class VDDataflowHook(VDRSHook):
     """ Hook used to make a connection to the database holding the information
     about Airflow tasks, VisitData data sources, and ETLP processes.
@@ -21,6 +215,115 @@ class VDDataflowHook(VDRSHook):
             DataTask.id == datatask_id).first()
         return task.datasource
 
+    def retrieve_datasource_snapshot(self, datatask_id) -> Datasource:
+        """ Retrieve the datasource of a task with its enabled protocols,
+        in a single query.
+
+        The returned objects are detached from the session: they never
+        trigger lazy loads nor get expired by commits, and can be shared
+        between threads. They are meant to be read only, changes on them
+        are not saved. Relationships other than ``Datasource.protocols``
+        and ``DatasourceProtocol.datasource`` are not available.
+
+        Arguments:
+            datatask_id {int} -- ID of the DataTask.
+
+        Returns:
+            :class:`visitdata.models.sources.Datasource` -- The datasource,
+                or None if the task does not exist.
+        """
+        return self.retrieve_datasource_snapshots(
+            [datatask_id]).get(datatask_id)
+
+    def retrieve_datasource_snapshots(self, datatask_ids=None,
+                                      criterion=None) -> dict:
+        """ Retrieve the datasources of many tasks with their enabled
+        protocols, in a single query, as detached snapshots like
+        :meth:`retrieve_datasource_snapshot`.
+
+        Keyword Arguments:
+            datatask_ids {list} -- IDs of the DataTasks. (default: {None})
+            criterion -- SQLAlchemy criterion selecting the DataTasks, i.e.
+                ``DataTask.code.like("visit-%")``. (default: {None})
+
+        Returns:
+            dict -- The :class:`visitdata.models.sources.Datasource` by
+                DataTask ID. Tasks which do not exist are missing.
+        """
+        query = self._session.query(Datasource, DataTask.id).join(
+            DataTask, DataTask.datasource_id == Datasource.id
+        ).outerjoin(
+            DatasourceProtocol, and_(
+                DatasourceProtocol.datasource_id == Datasource.id,
+                DatasourceProtocol.enabled.is_(True))
+        ).options(
+            contains_eager(Datasource.protocols)
+        )
+        if datatask_ids is not None:
+            query = query.filter(DataTask.id.in_(list(datatask_ids)))
+        if criterion is not None:
+            query = query.filter(criterion)
+        snapshots = {}
+        datasources = {}
+        for datasource, datatask_id in query.populate_existing():
+            snapshots[datatask_id] = datasource
+            datasources[datasource.id] = datasource
+        for datasource in datasources.values():
+            for protocol in datasource.protocols:
+                set_committed_value(protocol, 'datasource', datasource)
+                self._session.expunge(protocol)
+            self._session.expunge(datasource)
+        return snapshots
+
+    def retrieve_protocol_schedules(self, datatask_ids: list) -> list:
+        """ Retrieve the schedules of the enabled protocols of the
+        datasources of some tasks, without loading the protocols themselves.
+
+        Arguments:
+            datatask_ids {list} -- IDs of the DataTasks.
+
+        Returns:
+            list -- (datasource_id, protocol_period) tuples.
+        """
+        return self._session.query(
+            DatasourceProtocol.datasource_id,
+            DatasourceProtocol.protocol_period
+        ).join(
+            DataTask,
+            DataTask.datasource_id == DatasourceProtocol.datasource_id
+        ).filter(
+            DataTask.id.in_(datatask_ids),
+            DatasourceProtocol.enabled.is_(True)
+        ).distinct().all()
+
+    def retrieve_pending_datasets(self, protocol_ids: list,
+                                  step: str) -> list:
+        """ Retrieve the datasets of some protocols which went through the
+        previous step but not through ``step`` yet.
+
+        The datasets are detached from the session, changes on them are
+        saved with :meth:`update_dataset`.
+
+        Arguments:
+            protocol_ids {list} -- IDs of the protocols.
+            step {str} -- ``transform``, ``load`` or ``post_process``.
+
+        Returns:
+            list -- The :class:`visitdata.models.sources.DatasourceDataset`,
+                oldest first.
+        """
+        steps = list(STEP_TIMESTAMPS)
+        previous_step = steps[steps.index(step) - 1]
+        datasets = self._session.query(DatasourceDataset).filter(
+            DatasourceDataset.datasource_protocol_id.in_(protocol_ids),
+            STEP_TIMESTAMPS[previous_step].isnot(None),
+            STEP_TIMESTAMPS[step].is_(None),
+            DatasourceDataset.data_path_source.isnot(None)
+        ).order_by(STEP_TIMESTAMPS[previous_step]).all()
+        for dataset in datasets:
+            self._session.expunge(dataset)
+        return datasets
+
     def save_dataset(self, dataset: DatasourceDataset) -> DatasourceDataset:
         """ Insert a datasource_dataset to the DB.
 
@@ -38,5 +341,112 @@ class VDDataflowHook(VDRSHook):
         return dataset
 
     def update_dataset(self, dataset: DatasourceDataset):
-        self._session.add(dataset)
+        try:
+            self._session.add(dataset)
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+
+    def close(self):
+        """ Close the session of the hook, releasing its connection. """
+        self._session.close()
+
+    def execute_statement(self, statement):
+        """ Execute and commit a statement, i.e. built with
+        :func:`step_statement`. """
+        self._session.execute(statement)
         self._session.commit()
+
+    def execute_statements(self, statements):
+        """ Execute statements and commit them in a single transaction. """
+        try:
+            for statement in statements:
+                self._session.execute(statement)
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+
+    def find_fingerprint(self, fingerprint: DatasetFingerprint,
+                         content_hash: bool = False) -> str:
+        """ Look for a file with the same fingerprint already extracted
+        with the same protocol.
+
+        Arguments:
+            fingerprint {:class:`visitdata.models.sources.DatasetFingerprint`}
+                -- The fingerprint to look for.
+
+        Keyword Arguments:
+            content_hash {bool} -- Whether to compare content hashes instead
+                of ETags and sizes. (default: {False})
+
+        Returns:
+            str -- The ID of the dataset of the original file, or None.
+        """
+        query = self._session.query(
+            DatasetFingerprint.datasource_dataset_id
+        ).filter(
+            DatasetFingerprint.datasource_protocol_id
+            == fingerprint.datasource_protocol_id,
+            DatasetFingerprint.duplicate.is_(False))
+        if content_hash:
+            query = query.filter(
+                DatasetFingerprint.content_hash == fingerprint.content_hash)
+        else:
+            query = query.filter(
+                DatasetFingerprint.etag == fingerprint.etag,
+                DatasetFingerprint.size == fingerprint.size)
+        row = query.first()
+        return row[0] if row else None
+
+    def save_fingerprint(self, fingerprint: DatasetFingerprint):
+        """ Insert a datasource_dataset_fingerprint to the DB.
+
+        Arguments:
+            fingerprint {:class:`visitdata.models.sources.DatasetFingerprint`}
+                -- The fingerprint to save.
+        """
+        self._session.add(fingerprint)
+        self._session.commit()
+
+    def advance_watermark(self, protocol_id, previous: str,
+                          watermark: str) -> bool:
+        """ Move the extraction watermark of a protocol, stored in
+        ``source_sync_last``.
+
+        Arguments:
+            protocol_id {str} -- ID of the protocol.
+            previous {str} -- Serialized watermark read before the run.
+            watermark {str} -- Serialized new watermark.
+
+        Returns:
+            bool -- False if the watermark has been moved by someone else
+                since it has been read, in which case it is left unchanged.
+        """
+        try:
+            result = self._session.execute(
+                watermark_statement(protocol_id, previous, watermark))
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+        return result.rowcount == 1
+
+    def dataset_batch(self, chunk_size=None, on_flush=None) -> DatasetBatch:
+        """ Start a batch of datasets insertions and updates.
+
+        Keyword Arguments:
+            chunk_size {int} -- Maximum number of rows per statement.
+                Defaults to the ``VD_RS_DATASET_BATCH_SIZE`` environment
+                variable, or 500. (default: {None})
+            on_flush {callable} -- Called with the flushed datasets
+                after each flush. (default: {None})
+
+        Returns:
+            :class:`DatasetBatch` -- The batch, bound to the hook session.
+        """
+        chunk_size = int(
+            chunk_size or os.getenv("VD_RS_DATASET_BATCH_SIZE") or 500)
+        return DatasetBatch(
+            self._session, chunk_size=chunk_size, on_flush=on_flush)
@@ -0,0 +1,230 @@
+""" Classes used to extract files exposed by HTTP APIs """
+import os
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urljoin
+
+import requests
+from airflow.hooks.base_hook import BaseHook
+from visitdata.models.hooks.matchers import compile_mask
+from visitdata.models.hooks.mixins import ExtractMixin
+from visitdata.models.hooks.registry import REGISTRY
+from visitdata.models.datasets import StreamedVDDataset
+
+# Fields of the listing pages, overridden by the ``<name>_field`` extras
+# of the connection
+DEFAULT_FIELDS = {
+    "items": "items",
+    "next": "next",
+    "name": "name",
+    "url": "url",
+    "size": "size",
+    "etag": "etag",
+    "modified": "modified",
+}
+
+
+class VDHTTPHook(BaseHook, ExtractMixin):
+    """ Extract files exposed by a HTTP/REST API, streaming them to the
+    datalake instead of going through the FTP S3 mirror.
+
+    The ``source_path`` of a protocol is a listing endpoint, relative to
+    the host of the connection, returning JSON pages of files. A page is
+    either a list of files or an object holding them in its ``items``
+    field. The next page is given by the ``next`` link of the ``Link``
+    header, or by the ``next`` field of the page. A file is an object with
+    a ``url`` to download it from, and optionally a ``name``, a ``size``,
+    an ``etag`` and a ``modified`` time (ISO 8601 or UNIX timestamp).
+
+    The connection extras may hold ``headers`` sent with every request,
+    the names of the fields if they differ (i.e. ``"url_field":
+    "download_url"``), ``timeout`` in seconds (default: 60), and
+    ``delete_sources`` to remove extracted files with a DELETE request on
+    their URL. Otherwise sources are left in place, and the protocols
+    should be extracted incrementally.
+
+    Arguments:
+        http_conn_id {str} -- Airflow connection of the API, named by the
+            ``source_access`` of the protocols.
+
+    Keyword Arguments:
+        max_concurrency {int} -- Maximum number of concurrent requests.
+            Defaults to the ``max_concurrency`` extra of the connection, the
+            ``VD_HTTP_MAX_CONCURRENCY`` environment variable, or 4.
+    """
+
+    def __init__(self, http_conn_id, max_concurrency=None):
+        super().__init__(source=None)
+        self.http_conn_id = http_conn_id
+        connection = self.get_connection(http_conn_id)
+        extra = connection.extra_dejson
+        self.base_url = self.__base_url(connection)
+        self.auth = ((connection.login, connection.password)
+                     if connection.login else None)
+        self.headers = extra.get('headers') or {}
+        self.fields = {name: extra.get(f"{name}_field", default)
+                       for name, default in DEFAULT_FIELDS.items()}
+        self.timeout = float(extra.get('timeout') or 60)
+        self.delete_sources = bool(extra.get('delete_sources'))
+        self.max_concurrency = int(
+            max_concurrency or extra.get('max_concurrency')
+            or os.getenv('VD_HTTP_MAX_CONCURRENCY') or 4)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._local = threading.local()
+
+    @classmethod
+    def get_connection(cls, conn_id):
+        """ Returns the connection ``conn_id``, retrieved once per process.
+        """
+        return REGISTRY.connection(
+            conn_id, lambda: super(VDHTTPHook, cls).get_connection(conn_id))
+
+    @staticmethod
+    def __base_url(connection) -> str:
+        host = connection.host or ''
+        if '://' not in host:
+            host = f"{connection.schema or 'https'}://{host}"
+            if connection.port:
+                host += f":{connection.port}"
+        return host.rstrip('/') + '/'
+
+    def get_conn(self) -> requests.Session:
+        """ Returns the HTTP session of the current thread, created on
+        first use. """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.auth = self.auth
+            session.headers.update(self.headers)
+        return session
+
+    def close(self):
+        self._local = threading.local()
+
+    @staticmethod
+    def __parse_time(value):
+        if value is None or value == '':
+            return None
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value, timezone.utc)
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+
+    def __dataset(self, page_url: str, item: dict) -> StreamedVDDataset:
+        fields = self.fields
+        name = item.get(fields['name'])
+        size = item.get(fields['size'])
+        return StreamedVDDataset(
+            self,
+            urljoin(page_url, str(item.get(fields['url']) or name)),
+            name=name,
+            size=int(size) if size is not None else None,
+            etag=item.get(fields['etag']),
+            last_modified=self.__parse_time(item.get(fields['modified'])))
+
+    def __iter_pages(self, path: str):
+        """ List an endpoint, one page at a time.
+
+        Yields:
+            list -- The :class:`visitdata.models.datasets.StreamedVDDataset`
+                of the page.
+        """
+        url = urljoin(self.base_url, path)
+        seen = set()
+        while url and url not in seen:
+            seen.add(url)
+            with self._slots:
+                response = self.get_conn().get(url, timeout=self.timeout)
+            response.raise_for_status()
+            page = response.json()
+            next_url = response.links.get('next', {}).get('url')
+            if isinstance(page, dict):
+                items = page.get(self.fields['items']) or []
+                next_url = next_url or page.get(self.fields['next'])
+            else:
+                items = page
+            yield [self.__dataset(url, item) for item in items]
+            url = urljoin(url, next_url) if next_url else None
+
+    def fetch_data(self, path, mask=None, lazy=False):
+        """Fetch the files listed by an endpoint, page by page, applying a
+        mask to filter them by name.
+
+        Arguments:
+            path {str} -- The listing endpoint.
+
+        Keyword Arguments:
+            mask {str} -- A unix file mask used to filter out files.
+                (default: {None})
+            lazy {bool} -- Whether to return a generator requesting the
+                pages one by one instead of a list. (default: {False})
+
+        Returns:
+            list -- The :class:`visitdata.models.datasets.StreamedVDDataset`
+        """
+        pairs = self.fetch_data_multi(path, [(None, path, mask)], lazy=True)
+        files = (file for _, file in pairs)
+        if lazy:
+            return files
+        return list(files)
+
+    def fetch_data_multi(self, prefix, targets, lazy=False):
+        """Fetch files of several targets, listing each endpoint once
+        for all the targets sharing it. Endpoints are listed separately:
+        as with the other hooks, the prefix only restricts the targets
+        listed.
+
+        Arguments:
+            prefix {str} -- Common prefix of the targets endpoints. Targets
+                whose endpoint does not start with it get no files.
+            targets {list} -- (target, path, mask) tuples.
+
+        Keyword Arguments:
+            lazy {bool} -- Whether to return a generator instead of a list.
+                (default: {False})
+
+        Returns:
+            list -- (target,
+                :class:`visitdata.models.datasets.StreamedVDDataset`) pairs.
+        """
+        targets_by_path = {}
+        for target, path, mask in targets:
+            if not path.startswith(prefix):
+                self.log.warning("Endpoint %s is not under prefix %s, "
+                                 "skipping it.", path, prefix)
+                continue
+            targets_by_path.setdefault(path, []).append(
+                (target, compile_mask(mask)))
+        pairs = self.__iter_data_multi(targets_by_path)
+        if lazy:
+            return pairs
+        return list(pairs)
+
+    def __iter_data_multi(self, targets_by_path):
+        for path, targets in targets_by_path.items():
+            for files in self.__iter_pages(path):
+                for file in files:
+                    for target, match in targets:
+                        if match(file.name):
+                            yield target, file
+
+    def iter_content(self, file, chunk_size: int = 1024 * 1024):
+        """ Download a file, holding one of the ``max_concurrency`` slots
+        of the API until it is fully read. """
+        with self._slots:
+            with self.get_conn().get(file.key, stream=True,
+                                     timeout=self.timeout) as response:
+                response.raise_for_status()
+                yield from response.iter_content(chunk_size)
+
+    def remove_sources(self, files: list) -> list:
+        """ Remove extracted files if ``delete_sources`` is set in the
+        connection extras, else leave them in place. """
+        if not self.delete_sources:
+            return []
+        return super().remove_sources(files)
+
+    def remove_file(self, file):
+        with self._slots:
+            response = self.get_conn().delete(
+                file.key, timeout=self.timeout)
+        response.raise_for_status()
@@ -1,7 +1,23 @@
 """ Classes used to retrieve and write data with S3 """
+import io
+import json
+import os
+from contextlib import closing
+from uuid import uuid4
+
 from airflow.hooks.postgres_hook import PostgresHook
+from sqlalchemy import bindparam, text
 from sqlalchemy.orm import sessionmaker
+from visitdata.models.formats import iter_csv_batches
 from visitdata.models.hooks.mixins import VDDBMixin
+from visitdata.models.hooks.registry import REGISTRY, shared_hook
+from visitdata.models.hooks.vd_s3_hook import VDS3Hook
+
+# COPY options by format of the loaded files
+COPY_FORMATS = {
+    "csv": "FORMAT AS CSV IGNOREHEADER 1 EMPTYASNULL TIMEFORMAT 'auto'",
+    "parquet": "FORMAT AS PARQUET",
+}
 
 
 class VDRSHook(PostgresHook, VDDBMixin):
@@ -12,18 +28,342 @@ class VDRSHook(PostgresHook, VDDBMixin):
         super().__init__(*args, **kwargs)
         self.postgres_conn_id = "VD_RS"
 
+    @classmethod
+    def get_connection(cls, conn_id):
+        """ Returns the connection ``conn_id``, retrieved once per process.
+        """
+        return REGISTRY.connection(
+            conn_id, lambda: super(VDRSHook, cls).get_connection(conn_id))
+
+    def get_sqlalchemy_engine(self, engine_kwargs=None):
+        """ Returns the SQLAlchemy engine shared by the process. Its pool
+        size is set by the ``VD_RS_POOL_SIZE`` environment variable
+        (default: 5).
+        """
+        if engine_kwargs is None:
+            engine_kwargs = {}
+        engine_kwargs.setdefault(
+            'pool_size', int(os.getenv('VD_RS_POOL_SIZE') or 5))
+        engine_kwargs.setdefault('pool_pre_ping', True)
+        return REGISTRY.engine(
+            self.postgres_conn_id,
+            lambda: super(VDRSHook, self).get_sqlalchemy_engine(
+                engine_kwargs))
+
     def create_session(self):
         engine = self.get_sqlalchemy_engine()
         return sessionmaker(bind=engine)()
 
-    def load(self):
-        """Load data into DB."""
-        raise NotImplementedError()
+    def __quote(self, engine, name: str) -> str:
+        """ Quote a table name, optionally prefixed by its schema, or a
+        column name. """
+        return ".".join(engine.dialect.identifier_preparer.quote(part)
+                        for part in name.split("."))
+
+    def load(self, table: str, keys: list, columns: list = None,
+             file_format: str = "csv", bucket_name: str = None,
+             manifest_key: str = None, statements=(), replace_ids=None,
+             replace_column: str = "datasource_dataset_id",
+             local_paths: dict = None):
+        """Load files of the datalake into a table, in a single transaction.
+
+        All the files are loaded at once by a ``COPY`` reading an S3
+        manifest listing them. If the ``VD_RS_LOAD_MODE`` environment
+        variable is ``local``, the files are streamed from S3 instead, with
+        ``COPY FROM STDIN`` on PostgreSQL or bulk inserts on any other
+        database, so that loads can run against a local database.
+
+        If ``replace_ids`` is set, the files are loaded into a temporary
+        staging table first, then the rows of these datasets are replaced
+        by the staged rows with a single delete and insert. Reloads are then
+        as cheap as first loads, and safe to retry.
+
+        Arguments:
+            table {str} -- Name of the table, optionally prefixed by its
+                schema.
+            keys {list} -- Keys of the files to load.
+
+        Keyword Arguments:
+            columns {list} -- Columns of the table in the order of the CSV
+                files. By default, the columns of the table.
+            file_format {str} -- ``csv`` or ``parquet``. CSV files must have
+                a header line. (default: {"csv"})
+            bucket_name {str} -- Bucket of the files. Defaults to the
+                default bucket of the S3 hook.
+            manifest_key {str} -- Key of the manifest written for the
+                ``COPY``, removed once loaded. Defaults to ``keys[0]``
+                followed by ``.manifest``.
+            statements {list} -- Other statements to execute in the same
+                transaction, i.e. to mark the datasets as loaded.
+            replace_ids {list} -- IDs of the datasets whose rows are
+                replaced by the loaded ones. (default: {None})
+            replace_column {str} -- Column holding the dataset ID of the
+                rows. (default: {"datasource_dataset_id"})
+            local_paths {dict} -- Local copies of some files by key, read
+                instead of S3 in ``local`` mode. ``COPY`` always reads S3.
+                (default: {None})
+        """
+        if file_format not in COPY_FORMATS:
+            raise ValueError(f"Unknown file format {file_format}.")
+        s3_hook = shared_hook(VDS3Hook)
+        bucket_name = bucket_name or s3_hook.default_bucket
+        engine = self.get_sqlalchemy_engine()
+        local = (os.getenv('VD_RS_LOAD_MODE') or 'copy') == 'local'
+        if not local:
+            manifest_key = manifest_key or f"{keys[0]}.manifest"
+            self.__write_manifest(s3_hook, keys, file_format, bucket_name,
+                                  manifest_key)
+        try:
+            with engine.begin() as connection:
+                target = table
+                if replace_ids is not None:
+                    target = self.__create_stage(connection, table)
+                if local:
+                    self.__load_local(connection, target, keys, columns,
+                                      file_format, bucket_name,
+                                      local_paths or {})
+                else:
+                    connection.execute(*self.__copy_statement(
+                        engine, target, columns, file_format,
+                        f"s3://{bucket_name}/{manifest_key}"))
+                if replace_ids is not None:
+                    self.__swap_stage(connection, table, target,
+                                      replace_ids, replace_column)
+                for statement in statements:
+                    connection.execute(statement)
+        finally:
+            if not local:
+                s3_hook.get_conn().delete_object(
+                    Bucket=bucket_name, Key=manifest_key)
+        self.log.info("%s files loaded into %s.", len(keys), table)
+
+    def __create_stage(self, connection, table: str) -> str:
+        """ Create an empty temporary table with the columns of ``table``.
+
+        Returns:
+            str -- The name of the staging table.
+        """
+        engine = connection.engine
+        stage = f"{table.split('.')[-1]}_stage_{uuid4().hex[:12]}"
+        if connection.dialect.name == "sqlite":
+            statement = "CREATE TEMP TABLE {} AS SELECT * FROM {} WHERE 1 = 0"
+        else:
+            statement = "CREATE TEMP TABLE {} (LIKE {})"
+        connection.execute(statement.format(
+            self.__quote(engine, stage), self.__quote(engine, table)))
+        return stage
+
+    def __swap_stage(self, connection, table: str, stage: str,
+                     replace_ids: list, replace_column: str):
+        """ Replace the rows of some datasets by the staged rows, and drop
+        the staging table. """
+        engine = connection.engine
+        if replace_ids:
+            connection.execute(*self.__delete_statement(
+                engine, table, replace_ids, replace_column))
+        connection.execute("INSERT INTO {} SELECT * FROM {}".format(
+            self.__quote(engine, table), self.__quote(engine, stage)))
+        # Pooled connections outlive the session temporary tables
+        connection.execute(f"DROP TABLE {self.__quote(engine, stage)}")
+
+    def __delete_statement(self, engine, table: str, dataset_ids: list,
+                           column: str):
+        """ Build the statement deleting the rows of some datasets and its
+        parameters. """
+        statement = text("DELETE FROM {} WHERE {} IN :ids".format(
+            self.__quote(engine, table), self.__quote(engine, column)))
+        return (statement.bindparams(bindparam("ids", expanding=True)),
+                {"ids": list(dataset_ids)})
+
+    def __write_manifest(self, s3_hook, keys, file_format, bucket_name,
+                         manifest_key):
+        """ Write the manifest listing the files to COPY. Columnar formats
+        need the size of each file. """
+        entries = []
+        for key in keys:
+            entry = {"url": f"s3://{bucket_name}/{key}", "mandatory": True}
+            if file_format != "csv":
+                size = s3_hook.get_conn().head_object(
+                    Bucket=bucket_name, Key=key)['ContentLength']
+                entry["meta"] = {"content_length": size}
+            entries.append(entry)
+        s3_hook.load_string(
+            string_data=json.dumps({"entries": entries}),
+            key=manifest_key,
+            bucket_name=bucket_name,
+            replace=True)
+
+    def __copy_statement(self, engine, table, columns, file_format,
+                         manifest_url):
+        """ Build the COPY statement of a manifest and its parameters. """
+        params = {"manifest": manifest_url}
+        iam_role = os.getenv('VD_RS_COPY_IAM_ROLE')
+        if iam_role:
+            params["iam_role"] = iam_role
+            authorization = "IAM_ROLE :iam_role"
+        else:
+            credentials = shared_hook(VDS3Hook).get_credentials()
+            params["credentials"] = (
+                f"aws_access_key_id={credentials.access_key};"
+                f"aws_secret_access_key={credentials.secret_key}")
+            if credentials.token:
+                params["credentials"] += f";token={credentials.token}"
+            authorization = "CREDENTIALS :credentials"
+        column_list = ""
+        # Columns are matched by position in CSV files, by name otherwise
+        if columns and file_format == "csv":
+            column_list = " ({})".format(", ".join(
+                self.__quote(engine, column) for column in columns))
+        statement = (f"COPY {self.__quote(engine, table)}{column_list} "
+                     f"FROM :manifest {authorization} MANIFEST "
+                     f"{COPY_FORMATS[file_format]}")
+        return text(statement), params
+
+    @staticmethod
+    def __open(s3_hook, key, bucket_name, local_paths):
+        """ Open a file to load, from its local copy if it has one, else
+        through the disk cache so that reloads do not download it again. """
+        if key in local_paths:
+            return open(local_paths[key], 'rb')
+        return s3_hook.open_cached(key, bucket_name)
 
-    def unload(self):
-        """Unload data into DB."""
-        raise NotImplementedError()
+    def __iter_local_batches(self, stream, file_format):
+        if file_format == "csv":
+            yield from iter_csv_batches(stream)
+            return
+        import pyarrow.parquet as pq
+        table = pq.read_table(io.BytesIO(stream.read()))
+        for batch in table.to_batches():
+            columns = batch.to_pydict()
+            yield [dict(zip(columns, row)) for row in zip(*columns.values())]
 
-    def retrieve(self):
-        """ Retrieve data from DB"""
-        raise NotImplementedError()
+    def __load_local(self, connection, table, keys, columns, file_format,
+                     bucket_name, local_paths):
+        """ Load files by streaming them from S3, or from their local
+        copies. """
+        s3_hook = shared_hook(VDS3Hook)
+        engine = connection.engine
+        quoted_table = self.__quote(engine, table)
+        if connection.dialect.name == "postgresql" and file_format == "csv":
+            column_list = ""
+            if columns:
+                column_list = " ({})".format(", ".join(
+                    self.__quote(engine, column) for column in columns))
+            cursor = connection.connection.cursor()
+            try:
+                for key in keys:
+                    with closing(self.__open(s3_hook, key, bucket_name,
+                                             local_paths)) as stream:
+                        cursor.copy_expert(
+                            f"COPY {quoted_table}{column_list} FROM STDIN "
+                            "WITH CSV HEADER", stream)
+            finally:
+                cursor.close()
+            return
+        for key in keys:
+            with closing(self.__open(s3_hook, key, bucket_name,
+                                     local_paths)) as stream:
+                for batch in self.__iter_local_batches(stream, file_format):
+                    self.__insert_batch(connection, table, columns, batch)
+
+    def __insert_batch(self, connection, table, columns, batch):
+        """ Insert a batch of records, as dicts by column name, with a
+        single bulk statement. Empty strings are inserted as nulls. """
+        if not batch:
+            return
+        engine = connection.engine
+        names = list(batch[0])
+        statement = text("INSERT INTO {} ({}) VALUES ({})".format(
+            self.__quote(engine, table),
+            ", ".join(self.__quote(engine, column)
+                      for column in (columns or names)),
+            ", ".join(f":c{index}" for index in range(len(names)))))
+        connection.execute(statement, [
+            {f"c{index}": None if record[name] == "" else record[name]
+             for index, name in enumerate(names)}
+            for record in batch])
+
+    def insert(self, table: str, batches, replace_ids=None,
+               replace_column: str = "datasource_dataset_id",
+               statements=()):
+        """Insert batches of records into a table, in a single transaction.
+
+        Arguments:
+            table {str} -- Name of the table, optionally prefixed by its
+                schema.
+            batches {iterable} -- Batches of records, as dicts by column
+                name.
+
+        Keyword Arguments:
+            replace_ids {list} -- IDs of the datasets whose rows are
+                deleted before the insert. (default: {None})
+            replace_column {str} -- Column holding the dataset ID of the
+                rows. (default: {"datasource_dataset_id"})
+            statements {list} -- Other statements to execute in the same
+                transaction, after the insert.
+        """
+        engine = self.get_sqlalchemy_engine()
+        with engine.begin() as connection:
+            if replace_ids:
+                connection.execute(*self.__delete_statement(
+                    engine, table, replace_ids, replace_column))
+            for batch in batches:
+                self.__insert_batch(connection, table, None, batch)
+            for statement in statements:
+                connection.execute(statement)
+
+    def execute_transaction(self, statements):
+        """Execute statements in a single transaction, i.e. set-based
+        post-processing.
+
+        Arguments:
+            statements {list} -- SQLAlchemy statements, with their
+                parameters bound.
+        """
+        engine = self.get_sqlalchemy_engine()
+        with engine.begin() as connection:
+            for statement in statements:
+                result = connection.execute(statement)
+                if result.rowcount >= 0:
+                    self.log.info("%s rows affected.", result.rowcount)
+
+    def unload(self, table: str, dataset_ids: list,
+               column: str = "datasource_dataset_id"):
+        """Delete the rows of some datasets from a table.
+
+        Arguments:
+            table {str} -- Name of the table, optionally prefixed by its
+                schema.
+            dataset_ids {list} -- IDs of the datasets.
+
+        Keyword Arguments:
+            column {str} -- Column holding the dataset ID of the rows.
+                (default: {"datasource_dataset_id"})
+        """
+        engine = self.get_sqlalchemy_engine()
+        with engine.begin() as connection:
+            connection.execute(*self.__delete_statement(
+                engine, table, dataset_ids, column))
+
+    def retrieve(self, query, batch_size: int = 10000):
+        """ Retrieve data from DB, streamed with a server-side cursor.
+
+        Arguments:
+            query -- SQLAlchemy statement, with its parameters bound.
+
+        Keyword Arguments:
+            batch_size {int} -- Maximum number of records per batch.
+                (default: {10000})
+
+        Yields:
+            list -- Batches of records, as dicts by column name.
+        """
+        engine = self.get_sqlalchemy_engine()
+        with engine.connect() as connection:
+            result = connection.execution_options(
+                stream_results=True).execute(query)
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [dict(row) for row in rows]
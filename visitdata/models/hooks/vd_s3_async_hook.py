@@ -0,0 +1,235 @@
+""" Classes used to retrieve and write data with S3 from an event loop """
+import asyncio
+import json
+import os
+import time
+
+from visitdata.models.hooks.matchers import PrefixIndex
+from visitdata.models.hooks.mixins import AsyncExtractMixin
+from visitdata.models.hooks.vd_s3_hook import VDS3Hook
+from visitdata.models.datasets import S3VDDataset
+from visitdata.models.transfer import (
+    TransferConfig, TransferStats, async_call_with_retry, part_ranges)
+
+
+class VDS3AsyncHook(VDS3Hook, AsyncExtractMixin):
+    """ Interact with Visit Data AWS S3 with an async client, so that
+    thousands of requests can be in flight from a single thread.
+
+    The client is built by ``aiobotocore`` with the credentials of the
+    ``VD_S3`` connection. ``aiobotocore`` is only imported when a client is
+    opened. Each of its releases supports a single ``botocore`` release:
+    they are pinned together, with ``boto3``, in ``requirements.txt``.
+    """
+
+    def client(self, max_pool_connections: int = None):
+        """ Open an async S3 client, to use in the running event loop::
+
+            async with hook.client() as client:
+                ...
+
+        Keyword Arguments:
+            max_pool_connections {int} -- Maximum number of HTTP
+                connections of the client. Defaults to the
+                ``VD_EXTRACT_MAX_IN_FLIGHT`` environment variable, or 1000.
+
+        Returns:
+            An async context manager, yielding the
+                ``aiobotocore.client.AioBaseClient``.
+        """
+        try:
+            from aiobotocore.config import AioConfig
+            from aiobotocore.session import get_session
+        except ImportError:
+            raise ImportError(
+                "aiobotocore is required to extract files asynchronously, "
+                "install the version pinned in requirements.txt.")
+        session, endpoint_url = self._get_credentials(region_name=None)
+        credentials = session.get_credentials().get_frozen_credentials()
+        return get_session().create_client(
+            's3',
+            region_name=session.region_name,
+            endpoint_url=endpoint_url,
+            aws_access_key_id=credentials.access_key,
+            aws_secret_access_key=credentials.secret_key,
+            aws_session_token=credentials.token,
+            config=AioConfig(max_pool_connections=int(
+                max_pool_connections
+                or os.getenv('VD_EXTRACT_MAX_IN_FLIGHT') or 1000)))
+
+    async def fetch_data_multi_async(self, client, prefix, targets,
+                                     bucket_name=None, page_size=1000):
+        """Fetch files of several targets sharing a common prefix with a
+        single listing, as :meth:`VDS3Hook.fetch_data_multi`, one page at a
+        time.
+
+        Arguments:
+            client -- Async S3 client, opened by :meth:`client`.
+            prefix {str} -- Common prefix of the targets paths.
+            targets {list} -- (target, path, mask) tuples.
+
+        Keyword Arguments:
+            bucket_name {str} -- S3 Bucket name. If no bucket is specified it
+                will look in the default bucket specified at runtime.
+                (default: {None})
+            page_size {int} -- Number of keys requested per listing page.
+                (default: {1000})
+
+        Yields:
+            tuple -- (target, :class:`visitdata.models.datasets.S3VDDataset`)
+                pairs.
+        """
+        if not bucket_name:
+            bucket_name = self.default_bucket
+        index = PrefixIndex()
+        for target, path, mask in targets:
+            index.add(target, path, mask)
+        paginator = client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=bucket_name,
+            Prefix=prefix,
+            PaginationConfig={'PageSize': page_size})
+        async for page in pages:
+            for entry in page.get('Contents', []):
+                matching_targets = index.dispatch(entry['Key'])
+                if not matching_targets:
+                    continue
+                file = S3VDDataset.init_from_listing(bucket_name, entry)
+                for target in matching_targets:
+                    yield target, file
+
+    async def save_file_async(self, client, file, key_dest: str,
+                              bucket_dest: str = None,
+                              config: TransferConfig = None):
+        """ Copy a file server-side, like
+        :meth:`visitdata.models.transfer.TransferEngine.copy` within the
+        same account: with a single CopyObject request, or with a multipart
+        upload whose parts are copied concurrently.
+
+        Arguments:
+            client -- Async S3 client, opened by :meth:`client`.
+            file {:class:`visitdata.models.datasets.S3VDDataset`} -- The
+                file to copy.
+            key_dest {str} -- Key of the copy.
+
+        Keyword Arguments:
+            bucket_dest {str} -- Bucket of the copy. (default: Default S3
+                bucket defined during configuration)
+            config {TransferConfig} -- Transfer settings.
+                (default: read from environment)
+
+        Returns:
+            :class:`visitdata.models.transfer.TransferStats` -- Metrics
+                of the copy.
+        """
+        config = config or TransferConfig()
+        bucket_dest = bucket_dest or os.getenv('VD_S3_DEFAULT_BUCKET')
+        source = {'Bucket': file.bucket_name, 'Key': file.key}
+        size = file.size
+        if size is None:
+            size = (await async_call_with_retry(
+                config, client.head_object,
+                Bucket=file.bucket_name, Key=file.key))['ContentLength']
+        stats = TransferStats(key_dest, size)
+        start = time.monotonic()
+        if size < config.multipart_threshold:
+            await async_call_with_retry(
+                config, client.copy_object, stats=stats,
+                CopySource=source, Bucket=bucket_dest, Key=key_dest)
+            stats.part_latencies.append(time.monotonic() - start)
+        else:
+            await self.__multipart_copy(
+                client, config, stats, source, bucket_dest, key_dest)
+        stats.seconds = time.monotonic() - start
+        return stats
+
+    @staticmethod
+    async def __multipart_copy(client, config, stats, source, bucket_dest,
+                               key_dest):
+        upload_id = (await async_call_with_retry(
+            config, client.create_multipart_upload, stats=stats,
+            Bucket=bucket_dest, Key=key_dest))['UploadId']
+        ranges = part_ranges(stats.size, config)
+        stats.part_latencies = [None] * len(ranges)
+        semaphore = asyncio.Semaphore(config.max_concurrency)
+
+        async def copy_part(part_number, first, last):
+            async with semaphore:
+                part_start = time.monotonic()
+                response = await async_call_with_retry(
+                    config, client.upload_part_copy, stats=stats,
+                    CopySource=source,
+                    CopySourceRange=f"bytes={first}-{last}",
+                    Bucket=bucket_dest, Key=key_dest,
+                    UploadId=upload_id, PartNumber=part_number)
+                stats.part_latencies[part_number - 1] = \
+                    time.monotonic() - part_start
+            return {'ETag': response['CopyPartResult']['ETag'],
+                    'PartNumber': part_number}
+
+        tasks = [asyncio.ensure_future(copy_part(part_number, first, last))
+                 for part_number, (first, last) in enumerate(ranges, 1)]
+        try:
+            parts = await asyncio.gather(*tasks)
+            await async_call_with_retry(
+                config, client.complete_multipart_upload, stats=stats,
+                Bucket=bucket_dest, Key=key_dest, UploadId=upload_id,
+                MultipartUpload={'Parts': parts})
+        except (Exception, asyncio.CancelledError):
+            # The parts still in flight would otherwise be copied to the
+            # upload after it is aborted
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await async_call_with_retry(
+                config, client.abort_multipart_upload, stats=stats,
+                Bucket=bucket_dest, Key=key_dest, UploadId=upload_id)
+            raise
+
+    async def write_context_async(self, client, context: dict, key: str,
+                                  bucket_name: str = None):
+        """Write context data to s3, overwriting it if it exists."""
+        if not bucket_name:
+            bucket_name = self.default_bucket
+        await async_call_with_retry(
+            TransferConfig(), client.put_object,
+            Body=json.dumps(context).encode(), Bucket=bucket_name, Key=key)
+
+    async def remove_sources_async(self, client, files: list) -> list:
+        """Remove files with DeleteObjects requests of up to 1000 keys,
+        sent concurrently, as :meth:`VDS3Hook.remove_sources`.
+
+        Args:
+            client: Async S3 client, opened by :meth:`client`.
+            files (list): :class:`visitdata.models.datasets.S3VDDataset`
+                to remove.
+        Returns:
+            (list) (file, error) pairs of the files which could not be
+                removed.
+        """
+        files_by_bucket = {}
+        for file in files:
+            files_by_bucket.setdefault(file.bucket_name, {})[file.key] = file
+        batches = []
+        for bucket_name, files_by_key in files_by_bucket.items():
+            keys = list(files_by_key)
+            for index in range(0, len(keys), self.DELETE_BATCH_SIZE):
+                batches.append(
+                    (bucket_name, keys[index:index + self.DELETE_BATCH_SIZE]))
+
+        async def delete_batch(bucket_name, keys):
+            try:
+                response = await client.delete_objects(
+                    Bucket=bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in keys],
+                            'Quiet': True})
+            except Exception as error:  # pylint: disable=broad-except
+                return [(files_by_bucket[bucket_name][key], error)
+                        for key in keys]
+            return [(files_by_bucket[bucket_name][error['Key']],
+                     Exception(f"{error.get('Code')}: {error.get('Message')}"))
+                    for error in response.get('Errors', [])]
+
+        results = await asyncio.gather(
+            *(delete_batch(*batch) for batch in batches))
+        return [failure for failures in results for failure in failures]
@@ -1,16 +1,24 @@
 """ Classes used to retrieve and write data with S3 """
 import json
-from fnmatch import fnmatch
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 from airflow.hooks.S3_hook import S3Hook
+from visitdata.models.cache import get_cache
+from visitdata.models.hooks.matchers import PrefixIndex, compile_mask
 from visitdata.models.hooks.mixins import ExtractMixin
+from visitdata.models.hooks.registry import REGISTRY
 from visitdata.models.datasets import S3VDDataset
+from visitdata.models.transfer import MultipartUploadWriter, TransferConfig
 
 
 class VDS3Hook(S3Hook, ExtractMixin):
     """ Interact with Visit Data AWS S3, to read and write data.
     """
 
+    DELETE_BATCH_SIZE = 1000
+    """int: Maximum number of keys of a DeleteObjects request."""
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.aws_conn_id = "VD_S3"
@@ -20,6 +28,36 @@ class VDS3Hook(S3Hook, ExtractMixin):
         self.default_bucket = connection_object.extra_dejson.get(
             'default_bucket', None)
 
+    @classmethod
+    def get_connection(cls, conn_id):
+        """ Returns the connection ``conn_id``, retrieved once per process.
+        """
+        return REGISTRY.connection(
+            conn_id, lambda: super(VDS3Hook, cls).get_connection(conn_id))
+
+    def get_client_type(self, client_type, region_name=None, config=None):
+        """ Returns a boto3 client shared by the process. Clients with a
+        specific configuration are not shared.
+        """
+        if config is not None:
+            return super().get_client_type(client_type, region_name, config)
+        return REGISTRY.client(
+            (self.aws_conn_id, client_type, region_name),
+            lambda: super(VDS3Hook, self).get_client_type(
+                client_type, region_name))
+
+    def get_resource_type(self, resource_type, region_name=None, config=None):
+        """ Returns a boto3 resource shared by the current thread. Resources
+        with a specific configuration are not shared.
+        """
+        if config is not None:
+            return super().get_resource_type(
+                resource_type, region_name, config)
+        return REGISTRY.resource(
+            (self.aws_conn_id, resource_type, region_name),
+            lambda: super(VDS3Hook, self).get_resource_type(
+                resource_type, region_name))
+
     @staticmethod
     def __filter_keys(keys: list, mask: str = None) -> list:
         """Filter s3 keys based on a mask.
@@ -31,8 +69,9 @@ class VDS3Hook(S3Hook, ExtractMixin):
             (list) Filtered list of keys
         """
         if mask:
+            match = compile_mask(mask)
             return list(filter(
-                lambda x: fnmatch(x.split('/')[-1], mask),
+                lambda x: match(x.split('/')[-1]),
                 keys
             ))
         return keys
@@ -50,13 +89,17 @@ class VDS3Hook(S3Hook, ExtractMixin):
                 (default: {None})
             mask {str} -- A unix file mask used to filter out files.
                 (default: {None})
+            lazy {bool} -- Whether to return a generator listing the path
+                page by page instead of a list (see :meth:`iter_files`).
+                (default: {False})
 
         Returns:
             list -- A list of
                 :class:`visitdata.models.datasets.VDDataset`s3 objects
         """
-        s3_objects = self.fetch_files(*args, **kwargs)
-        return [S3VDDataset.init_from_s3_object(obj) for obj in s3_objects]
+        if kwargs.pop('lazy', False):
+            return self.iter_files(*args, **kwargs)
+        return list(self.iter_files(*args, **kwargs))
 
     def fetch_files(self, path, bucket_name=None, mask=None):
         """Fetch multiple files from S3
@@ -81,6 +124,144 @@ class VDS3Hook(S3Hook, ExtractMixin):
         files = [self.get_key(key, bucket_name) for key in filtered_keys]
         return files
 
+    def iter_files(self, path, bucket_name=None, mask=None, page_size=1000):
+        """Lazily fetch multiple files from S3, one listing page at a time.
+        Files are built from the listing metadata, so no additional request
+        is made per file.
+
+        Args:
+            path (str): Path to the S3 object.
+            bucket_name (string): Optional bucket name if not the default
+            mask (str): Regex pattern used to filter
+                out files.
+            page_size (int): Number of keys requested per listing page.
+        Yields:
+            :class:`visitdata.models.datasets.S3VDDataset` The matching files
+
+        """
+        if not bucket_name:
+            bucket_name = self.default_bucket
+        for entries in self.__iter_pages(bucket_name, path, page_size):
+            keys = self.__filter_keys(list(entries), mask)
+            for key in keys:
+                yield S3VDDataset.init_from_listing(
+                    bucket_name, entries[key])
+
+    def __iter_pages(self, bucket_name, prefix, page_size=1000):
+        """List keys under a prefix, one page at a time.
+
+        Args:
+            bucket_name (string): Name of the bucket.
+            prefix (str): Prefix of the keys.
+            page_size (int): Number of keys requested per listing page.
+        Yields:
+            (dict) The page entries, by key.
+        """
+        paginator = self.get_conn().get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=bucket_name,
+            Prefix=prefix,
+            PaginationConfig={'PageSize': page_size})
+        found = False
+        for page in pages:
+            entries = {entry['Key']: entry
+                       for entry in page.get('Contents', [])}
+            found = found or bool(entries)
+            yield entries
+        if not found:
+            self.log.info(
+                f"Nothing found on bucket {bucket_name} with key {prefix}")
+
+    def fetch_data_multi(self, prefix, targets, bucket_name=None,
+                         lazy=False, page_size=1000):
+        """Fetch files of several targets sharing a common prefix with a
+        single listing. Every listed key is dispatched to all the targets
+        whose path and mask match it.
+
+        Arguments:
+            prefix {str} -- Common prefix of the targets paths.
+            targets {list} -- (target, path, mask) tuples.
+
+        Keyword Arguments:
+            bucket_name {str} -- S3 Bucket name. If no bucket is specified it
+                will look in the default bucket specified at runtime.
+                (default: {None})
+            lazy {bool} -- Whether to return a generator listing the prefix
+                page by page instead of a list. (default: {False})
+            page_size {int} -- Number of keys requested per listing page.
+                (default: {1000})
+
+        Returns:
+            list -- (target, :class:`visitdata.models.datasets.S3VDDataset`)
+                pairs.
+        """
+        if not bucket_name:
+            bucket_name = self.default_bucket
+        index = PrefixIndex()
+        for target, path, mask in targets:
+            index.add(target, path, mask)
+        pairs = self.__iter_data_multi(index, prefix, bucket_name, page_size)
+        if lazy:
+            return pairs
+        return list(pairs)
+
+    def __iter_data_multi(self, index, prefix, bucket_name, page_size):
+        for entries in self.__iter_pages(bucket_name, prefix, page_size):
+            for key, entry in entries.items():
+                matching_targets = index.dispatch(key)
+                if not matching_targets:
+                    continue
+                file = S3VDDataset.init_from_listing(bucket_name, entry)
+                for target in matching_targets:
+                    yield target, file
+
+    def remove_sources(self, files: list, max_concurrency: int = None) -> list:
+        """Remove files with DeleteObjects requests of up to 1000 keys,
+        sent concurrently.
+
+        Args:
+            files (list): :class:`visitdata.models.datasets.S3VDDataset`
+                to remove.
+            max_concurrency (int): Number of requests sent concurrently.
+                Defaults to the ``VD_S3_MAX_CONCURRENCY`` environment
+                variable, or 10.
+        Returns:
+            (list) (file, error) pairs of the files which could not be
+                removed.
+        """
+        max_concurrency = int(
+            max_concurrency or os.getenv('VD_S3_MAX_CONCURRENCY') or 10)
+        files_by_bucket = {}
+        for file in files:
+            files_by_bucket.setdefault(
+                getattr(file, 'bucket_name'), {})[getattr(file, 'key')] = file
+        batches = []
+        for bucket_name, files_by_key in files_by_bucket.items():
+            keys = list(files_by_key)
+            for index in range(0, len(keys), self.DELETE_BATCH_SIZE):
+                batches.append(
+                    (bucket_name, keys[index:index + self.DELETE_BATCH_SIZE]))
+        client = self.get_conn()
+
+        def delete_batch(batch):
+            bucket_name, keys = batch
+            try:
+                response = client.delete_objects(
+                    Bucket=bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in keys],
+                            'Quiet': True})
+            except Exception as error:  # pylint: disable=broad-except
+                return [(files_by_bucket[bucket_name][key], error)
+                        for key in keys]
+            return [(files_by_bucket[bucket_name][error['Key']],
+                     Exception(f"{error.get('Code')}: {error.get('Message')}"))
+                    for error in response.get('Errors', [])]
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            return [failure
+                    for failures in executor.map(delete_batch, batches)
+                    for failure in failures]
+
     def write_context(
             self,
             context: dict,
@@ -94,3 +275,68 @@ class VDS3Hook(S3Hook, ExtractMixin):
             string_data=json.dumps(context),
             key=key,
             bucket_name=bucket_name)
+
+    def open_stream(self, key: str, bucket_name: str = None):
+        """Open an S3 object for streamed reading.
+
+        Args:
+            key (str): Key of the object.
+            bucket_name (str): Optional bucket name if not the default
+        Returns:
+            (botocore.response.StreamingBody) The content of the object.
+        """
+        if not bucket_name:
+            bucket_name = self.default_bucket
+        return self.get_conn().get_object(
+            Bucket=bucket_name, Key=key)['Body']
+
+    def open_cached(self, key: str, bucket_name: str = None,
+                    etag: str = None, size: int = None, metrics=None):
+        """Open an S3 object for reading through the disk cache of the
+        process (see :mod:`visitdata.models.cache`), or streamed as
+        :meth:`open_stream` if ``VD_S3_CACHE_DIR`` is not set.
+
+        Args:
+            key (str): Key of the object.
+            bucket_name (str): Optional bucket name if not the default
+            etag (str): Optional ETag of the object, saving a HEAD request
+            size (int): Optional size of the object, listed with its ETag
+            metrics (visitdata.models.metrics.Metrics): Optional metrics
+                the ``cache_*`` counters are added to
+        Returns:
+            A readable file object with the content of the object.
+        """
+        cache = get_cache()
+        if cache is None:
+            return self.open_stream(key, bucket_name)
+        if not bucket_name:
+            bucket_name = self.default_bucket
+        return cache.open(self.get_conn(), bucket_name, key, etag=etag,
+                          size=size, metrics=metrics)
+
+    def read_json(self, key: str, bucket_name: str = None):
+        """Read a JSON object, i.e. a context written with
+        :meth:`write_context`."""
+        return json.loads(self.open_stream(key, bucket_name).read())
+
+    def upload_writer(
+            self,
+            key: str,
+            bucket_name: str = None,
+            config: TransferConfig = None
+    ) -> MultipartUploadWriter:
+        """Open a writable file object uploading to S3 with a multipart
+        upload, without holding the whole object in memory.
+
+        Args:
+            key (str): Key of the object.
+            bucket_name (str): Optional bucket name if not the default
+            config (TransferConfig): Part size and retry settings.
+        Returns:
+            (:class:`visitdata.models.transfer.MultipartUploadWriter`) The
+                writer. The object is created when it is closed.
+        """
+        if not bucket_name:
+            bucket_name = self.default_bucket
+        return MultipartUploadWriter(
+            self.get_conn(), bucket_name, key, config=config)
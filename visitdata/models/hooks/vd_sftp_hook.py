@@ -0,0 +1,190 @@
+""" Classes used to extract files from SFTP servers """
+import os
+import posixpath
+import stat
+import threading
+from datetime import datetime, timezone
+from operator import attrgetter
+
+from airflow.contrib.hooks.ssh_hook import SSHHook
+from visitdata.models.hooks.matchers import PrefixIndex, compile_mask
+from visitdata.models.hooks.mixins import ExtractMixin
+from visitdata.models.hooks.registry import REGISTRY
+from visitdata.models.datasets import StreamedVDDataset
+
+
+class VDSFTPHook(SSHHook, ExtractMixin):
+    """ Extract files directly from a SFTP server, streaming them to the
+    datalake instead of going through the FTP S3 mirror.
+
+    Every thread opens its own SFTP session, and at most
+    ``max_concurrency`` requests (listings, downloads or removals) are sent
+    to the server at once, whatever the number of extract workers.
+
+    Arguments:
+        ssh_conn_id {str} -- Airflow connection of the server, named by the
+            ``source_access`` of the protocols.
+
+    Keyword Arguments:
+        max_concurrency {int} -- Maximum number of concurrent requests.
+            Defaults to the ``max_concurrency`` extra of the connection, the
+            ``VD_SFTP_MAX_CONCURRENCY`` environment variable, or 4.
+    """
+
+    def __init__(self, ssh_conn_id, max_concurrency=None):
+        super().__init__(ssh_conn_id=ssh_conn_id)
+        extra = self.get_connection(ssh_conn_id).extra_dejson
+        self.max_concurrency = int(
+            max_concurrency or extra.get('max_concurrency')
+            or os.getenv('VD_SFTP_MAX_CONCURRENCY') or 4)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sessions = []
+
+    @classmethod
+    def get_connection(cls, conn_id):
+        """ Returns the connection ``conn_id``, retrieved once per process.
+        """
+        return REGISTRY.connection(
+            conn_id, lambda: super(VDSFTPHook, cls).get_connection(conn_id))
+
+    def get_sftp(self):
+        """ Returns the SFTP session of the current thread, opened on
+        first use.
+
+        Returns:
+            :class:`paramiko.sftp_client.SFTPClient` -- The session.
+        """
+        sftp = getattr(self._local, 'sftp', None)
+        if sftp is None:
+            client = self.get_conn()
+            sftp = self._local.sftp = client.open_sftp()
+            with self._lock:
+                self._sessions.append((client, sftp))
+        return sftp
+
+    def close(self):
+        """ Close the SFTP sessions of every thread. """
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for client, sftp in sessions:
+            sftp.close()
+            client.close()
+        self._local = threading.local()
+
+    def __walk(self, prefix: str, paths: list):
+        """ List the files under a prefix, only descending into the
+        folders which may hold files of one of ``paths``.
+
+        Yields:
+            tuple -- The (key, :class:`paramiko.SFTPAttributes`) of every
+                file, a key being the path of a file on the server.
+        """
+        root = posixpath.dirname(prefix)
+        folders = [root]
+        while folders:
+            folder = folders.pop()
+            with self._slots:
+                entries = self.get_sftp().listdir_attr(folder or '.')
+            subfolders = []
+            for entry in sorted(entries, key=attrgetter('filename')):
+                key = posixpath.join(folder, entry.filename)
+                if stat.S_ISDIR(entry.st_mode):
+                    directory = f"{key}/"
+                    if any(directory.startswith(path)
+                           or path.startswith(directory) for path in paths):
+                        subfolders.append(key)
+                elif stat.S_ISREG(entry.st_mode) and key.startswith(prefix):
+                    yield key, entry
+            folders.extend(reversed(subfolders))
+
+    def __dataset(self, key, attributes) -> StreamedVDDataset:
+        return StreamedVDDataset(
+            self, key,
+            size=attributes.st_size,
+            last_modified=datetime.fromtimestamp(
+                attributes.st_mtime, timezone.utc))
+
+    def fetch_data(self, path, mask=None, lazy=False):
+        """Fetch the files of a folder of the server, and of its
+        subfolders, applying a mask to filter them.
+
+        Arguments:
+            path {str} -- Folder of the files, relative to the login folder
+                unless it starts with ``/``.
+
+        Keyword Arguments:
+            mask {str} -- A unix file mask used to filter out files.
+                (default: {None})
+            lazy {bool} -- Whether to return a generator listing the
+                folders one by one instead of a list. (default: {False})
+
+        Returns:
+            list -- The :class:`visitdata.models.datasets.StreamedVDDataset`
+        """
+        match = compile_mask(mask)
+        files = (self.__dataset(key, attributes)
+                 for key, attributes in self.__walk(path, [path])
+                 if match(posixpath.basename(key)))
+        if lazy:
+            return files
+        return list(files)
+
+    def fetch_data_multi(self, prefix, targets, lazy=False):
+        """Fetch files of several targets sharing a common folder with a
+        single walk of the folder. Every listed file is dispatched to all
+        the targets whose path and mask match it.
+
+        Arguments:
+            prefix {str} -- Common prefix of the targets paths.
+            targets {list} -- (target, path, mask) tuples.
+
+        Keyword Arguments:
+            lazy {bool} -- Whether to return a generator instead of a list.
+                (default: {False})
+
+        Returns:
+            list -- (target,
+                :class:`visitdata.models.datasets.StreamedVDDataset`) pairs.
+        """
+        index = PrefixIndex()
+        for target, path, mask in targets:
+            index.add(target, path, mask)
+        paths = [path for _, path, _ in targets]
+        pairs = self.__iter_data_multi(index, prefix, paths)
+        if lazy:
+            return pairs
+        return list(pairs)
+
+    def __iter_data_multi(self, index, prefix, paths):
+        for key, attributes in self.__walk(prefix, paths):
+            matching_targets = index.dispatch(key)
+            if not matching_targets:
+                continue
+            file = self.__dataset(key, attributes)
+            for target in matching_targets:
+                yield target, file
+
+    def iter_content(self, file, chunk_size: int = 1024 * 1024):
+        """ Download a file, holding one of the ``max_concurrency`` slots
+        of the server until it is fully read.
+
+        The reads of a chunk are pipelined, but the next chunk is only
+        requested once the previous one is consumed, so that at most one
+        chunk of the file is buffered whatever its size. Any data written
+        after the file was listed is read last, without pipelining. """
+        with self._slots:
+            with self.get_sftp().open(file.key, 'rb') as remote:
+                for offset in range(0, file.size or 0, chunk_size):
+                    chunk, = remote.readv(
+                        [(offset, min(chunk_size, file.size - offset))])
+                    if not chunk:
+                        return
+                    yield chunk
+                for chunk in iter(lambda: remote.read(chunk_size), b''):
+                    yield chunk
+
+    def remove_file(self, file):
+        with self._slots:
+            self.get_sftp().remove(file.key)
@@ -0,0 +1,259 @@
+""" Timers and counters measuring the phases of the ELTP steps, exported
+through pluggable sinks at the end of each run.
+
+Metrics are enabled by the ``VD_METRICS_SINKS`` environment variable, a
+comma separated list of sinks among ``log``, ``statsd`` and ``s3``. When it
+is empty, :class:`NullMetrics` is used and measuring costs a method call.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+class Metrics:
+    """ Thread-safe timers and counters of a run.
+
+    Arguments:
+        sinks {list} -- Sinks the report is exported to by :meth:`emit`.
+    """
+
+    enabled = True
+
+    def __init__(self, sinks: list = None):
+        self.sinks = sinks or []
+        self.started = datetime.now(timezone.utc)
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._counters = {}
+
+    @contextmanager
+    def timer(self, name: str):
+        """ Time a block of code, i.e. ``with metrics.timer("copy"):``. """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timing(name, time.monotonic() - start)
+
+    def timing(self, name: str, seconds: float):
+        """ Record a duration of a phase. """
+        with self._lock:
+            timer = self._timers.setdefault(
+                name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            timer["count"] += 1
+            timer["seconds"] += seconds
+            timer["max_seconds"] = max(timer["max_seconds"], seconds)
+
+    def timed_iter(self, name: str, iterable):
+        """ Iterate over ``iterable``, timing the production of each item,
+        i.e. of lazily listed files. """
+        iterator = iter(iterable)
+        while True:
+            start = time.monotonic()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.timing(name, time.monotonic() - start)
+                return
+            self.timing(name, time.monotonic() - start)
+            yield item
+
+    async def timed_aiter(self, name: str, aiterable):
+        """ Asynchronous counterpart of :meth:`timed_iter`. """
+        iterator = aiterable.__aiter__()
+        while True:
+            start = time.monotonic()
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                self.timing(name, time.monotonic() - start)
+                return
+            self.timing(name, time.monotonic() - start)
+            yield item
+
+    def increment(self, name: str, value=1):
+        """ Add ``value`` to a counter, i.e. of files or bytes. """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def report(self) -> dict:
+        """ Returns the timers and counters of the run, with the throughput
+        of the ``files`` and ``bytes`` counters over the run duration. """
+        seconds = time.monotonic() - self._start
+        with self._lock:
+            counters = dict(self._counters)
+            timers = {name: dict(timer)
+                      for name, timer in self._timers.items()}
+        report = {
+            "started": self.started.isoformat(),
+            "seconds": seconds,
+            "timers": timers,
+            "counters": counters,
+        }
+        if seconds > 0:
+            report["files_per_second"] = counters.get("files", 0) / seconds
+            report["bytes_per_second"] = counters.get("bytes", 0) / seconds
+        return report
+
+    def emit(self, operator):
+        """ Export the report of the run to every sink. A failing sink
+        does not fail the run.
+
+        Arguments:
+            operator {:class:`visitdata.models.operators.ELTPOperator`} --
+                The operator of the run.
+        """
+        report = self.report()
+        for sink in self.sinks:
+            try:
+                sink.emit(report, operator)
+            except Exception as error:  # pylint: disable=broad-except
+                operator.log.warning("Metrics sink %s failed: %s",
+                                     type(sink).__name__, error)
+
+
+class _NullTimer:
+    """ Reusable context manager doing nothing. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullMetrics:
+    """ Metrics doing nothing, used when no sink is configured. """
+
+    enabled = False
+
+    def timer(self, name: str):
+        return _NULL_TIMER
+
+    def timing(self, name: str, seconds: float):
+        pass
+
+    def timed_iter(self, name: str, iterable):
+        return iterable
+
+    def timed_aiter(self, name: str, aiterable):
+        return aiterable
+
+    def increment(self, name: str, value=1):
+        pass
+
+    def report(self) -> dict:
+        return {}
+
+    def emit(self, operator):
+        pass
+
+
+class LogSink:
+    """ Export the report as log lines of the operator. """
+
+    def emit(self, report: dict, operator):
+        operator.log.info(
+            "DataTask %s %s metrics: %.2fs, %s files, %s bytes",
+            operator.datahub_task_id, operator.process_type,
+            report["seconds"], report["counters"].get("files", 0),
+            report["counters"].get("bytes", 0))
+        for name, timer in sorted(report["timers"].items()):
+            operator.log.info("  %s: %s calls, %.3fs total, %.3fs max",
+                              name, timer["count"], timer["seconds"],
+                              timer["max_seconds"])
+        for name, value in sorted(report["counters"].items()):
+            operator.log.info("  %s: %s", name, value)
+
+
+class StatsDSink:
+    """ Export the report to a StatsD server over UDP: timers as total
+    milliseconds per phase, counters as counts.
+
+    Keyword Arguments:
+        host {str} -- Host of the server. Defaults to the
+            ``VD_STATSD_HOST`` environment variable, or localhost.
+        port {int} -- Port of the server. Defaults to the
+            ``VD_STATSD_PORT`` environment variable, or 8125.
+        prefix {str} -- Prefix of the metrics names. Defaults to the
+            ``VD_STATSD_PREFIX`` environment variable, or visitdata.
+    """
+
+    # Metrics sent per datagram, to stay under the usual MTU
+    PACKET_SIZE = 20
+
+    def __init__(self, host=None, port=None, prefix=None):
+        self.address = (host or os.getenv('VD_STATSD_HOST') or 'localhost',
+                        int(port or os.getenv('VD_STATSD_PORT') or 8125))
+        self.prefix = prefix or os.getenv('VD_STATSD_PREFIX') or 'visitdata'
+
+    def emit(self, report: dict, operator):
+        prefix = f"{self.prefix}.{operator.process_type}"
+        lines = [f"{prefix}.run:{report['seconds'] * 1000:.0f}|ms"]
+        lines.extend(f"{prefix}.{name}:{timer['seconds'] * 1000:.0f}|ms"
+                     for name, timer in report["timers"].items())
+        lines.extend(f"{prefix}.{name}:{value}|c"
+                     for name, value in report["counters"].items())
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for start in range(0, len(lines), self.PACKET_SIZE):
+                sock.sendto(
+                    "\n".join(lines[start:start + self.PACKET_SIZE]).encode(),
+                    self.address)
+
+
+class S3ReportSink:
+    """ Export the report as a JSON file in the datalake folder of the
+    datasource, next to the folders of its datasets. """
+
+    def emit(self, report: dict, operator):
+        from visitdata.models.hooks import VDS3Hook, shared_hook
+        datasource_id = getattr(operator.datasource, 'id', None)
+        if datasource_id is None:
+            return
+        key = (f"{os.getenv('VD_S3_DATALAKE_PREFIX')}"
+               f"/datasource-{datasource_id}/reports"
+               f"/{operator.process_type}"
+               f"-{report['started'].replace(':', '')}.json")
+        shared_hook(VDS3Hook).load_string(
+            string_data=json.dumps(dict(
+                report,
+                datahub_task_id=operator.datahub_task_id,
+                process_type=operator.process_type)),
+            key=key,
+            replace=True)
+
+
+SINKS = {
+    "log": LogSink,
+    "statsd": StatsDSink,
+    "s3": S3ReportSink,
+}
+
+
+def create_metrics(sinks: str = None):
+    """ Create the metrics of a run.
+
+    Keyword Arguments:
+        sinks {str} -- Comma separated names of the sinks. Defaults to the
+            ``VD_METRICS_SINKS`` environment variable.
+
+    Returns:
+        :class:`Metrics`, or :class:`NullMetrics` if there is no sink.
+    """
+    names = [name.strip() for name
+             in (sinks or os.getenv('VD_METRICS_SINKS') or '').split(',')
+             if name.strip()]
+    if not names:
+        return NullMetrics()
+    try:
+        return Metrics([SINKS[name]() for name in names])
+    except KeyError as error:
+        raise ValueError(f"Unknown metrics sink {error}.")
@@ -6,3 +6,4 @@ from .eltp_operator import *
 from .extract_operator import *
 from .transform_operator import *
 from .load_operator import *
+from .pipeline_operator import *
@@ -1,21 +1,48 @@
 """
 ELTP base class to use as an Airflow operator.
 """
+import copy
+import logging
+import os
+import time
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 from airflow.models import BaseOperator
 
-import visitdata.settings
 from visitdata.models.hooks import VDDataflowHook
+from visitdata.models.metrics import NullMetrics, create_metrics
+from visitdata.settings import get_settings
 
 
 class ELTPOperator(BaseOperator):
     """ Abstract class for all operators following the
     Extract Load Transform PostProcess pattern.
 
+    The operator runs the step for one DataTask, or fans out over many of
+    them if ``datahub_task_id`` is a list of IDs or a SQLAlchemy criterion
+    on :class:`visitdata.models.sources.DataTask`. Their datasources are
+    then fetched in a single query and run concurrently, sharing the hooks
+    and connections of the process.
+
+    Building the operator, i.e. when parsing DAGs, does no I/O: the settings
+    of the ``.env`` file are loaded by :meth:`execute` (see
+    :func:`visitdata.settings.get_settings`). The ``VD_*`` defaults of the
+    operator arguments are read when it is built, so they must be set in the
+    environment of the process rather than in the ``.env`` file.
+
     Attributes:
         _datasource_hook (:class:`visitdata.models.hooks.VDDataflowHook`):
-            Communication hook between the app and the Datasource DB.
+            Communication hook between the app and the Datasource DB,
+            created on first use so that building the operator (i.e. when
+            parsing DAGs) does not connect to the DB.
+        max_datasources (int): Maximum number of datasources run at once
+            when fanning out. Defaults to the ``VD_FANOUT_MAX_WORKERS``
+            environment variable, or 4.
+        metrics (:class:`visitdata.models.metrics.Metrics`): Timers and
+            counters of the run, exported at its end to the sinks named by
+            ``metrics_sinks``, or by the ``VD_METRICS_SINKS`` environment
+            variable.
     """
 
     _datasource_hook_class = VDDataflowHook
@@ -24,20 +51,106 @@ class ELTPOperator(BaseOperator):
 
     process_type = "N/A"
 
-    def __init__(self, datahub_task_id, *args, **kwargs):
+    def __init__(self, datahub_task_id, *args, max_datasources=None,
+                 metrics_sinks=None, **kwargs):
         self.log.info("Beginning DataTask %s.", datahub_task_id)
         super().__init__(*args, **kwargs)
-        self._datasource_hook = self._datasource_hook_class()
+        self.__datasource_hook = None
         self.datahub_task_id = datahub_task_id
+        self.max_datasources = int(
+            max_datasources or os.getenv("VD_FANOUT_MAX_WORKERS") or 4)
+        self.metrics_sinks = metrics_sinks
+        self.metrics = NullMetrics()
+
+    @property
+    def _datasource_hook(self) -> VDDataflowHook:
+        if self.__datasource_hook is None:
+            self.__datasource_hook = self._datasource_hook_class()
+        return self.__datasource_hook
+
+    @_datasource_hook.setter
+    def _datasource_hook(self, hook: VDDataflowHook):
+        self.__datasource_hook = hook
+
+    @property
+    def fan_out(self) -> bool:
+        """ Whether the operator runs many DataTasks. """
+        return not isinstance(self.datahub_task_id, (int, str))
 
     def execute(self, context):
         """Default execute method called on operator execution. """
+        get_settings()
+        if self.fan_out:
+            return self.__execute_fan_out()
+        self.metrics = create_metrics(self.metrics_sinks)
         try:
-            self.fetch_datasource()
-            self.execute_step()
+            with self.metrics.timer("fetch_datasource"):
+                self.fetch_datasource()
+            with self.metrics.timer("execute_step"):
+                self.execute_step()
             self.end_process()
         except Exception as error:
+            self.metrics.increment("errors")
             self.on_error(error)
+        finally:
+            self.metrics.emit(self)
+
+    def __execute_fan_out(self) -> list:
+        """ Run the step for every DataTask, and report the result of each
+        of them.
+
+        Returns:
+            list: Summary of the run, as a dict per DataTask.
+        """
+        datasources = self.fetch_datasources()
+        with ThreadPoolExecutor(max_workers=self.max_datasources) as executor:
+            summary = list(executor.map(
+                lambda item: self.__run_datasource(*item),
+                sorted(datasources.items(), key=lambda item: str(item[0]))))
+        statuses = [result["status"] for result in summary]
+        self.log.info("%s run summary: %s succeeded, %s failed, %s skipped.",
+                      self.process_type, statuses.count("success"),
+                      statuses.count("failed"), statuses.count("skipped"))
+        for result in summary:
+            self.log.info("DataTask %s (datasource %s): %s in %.2fs%s",
+                          result["datahub_task_id"], result["datasource_id"],
+                          result["status"], result["seconds"],
+                          f" ({result['error']})" if result["error"] else "")
+        failed = [result["datahub_task_id"] for result in summary
+                  if result["status"] == "failed"]
+        if failed:
+            self.on_error(Exception(f"DataTasks {failed} failed."))
+        return summary
+
+    def __run_datasource(self, datahub_task_id, datasource) -> dict:
+        """ Run the step for one DataTask, with a copy of the operator
+        using its own session. """
+        result = {"datahub_task_id": datahub_task_id,
+                  "datasource_id": getattr(datasource, "id", None),
+                  "status": "skipped", "error": None, "seconds": 0.0}
+        if datasource is None:
+            return result
+        start = time.monotonic()
+        operator = copy.copy(self)
+        operator.datahub_task_id = datahub_task_id
+        operator.datasource = datasource
+        operator._datasource_hook = self._datasource_hook_class()
+        operator.metrics = create_metrics(self.metrics_sinks)
+        try:
+            with operator.metrics.timer("execute_step"):
+                operator.execute_step()
+            operator.end_process()
+            result["status"] = "success"
+        except Exception as error:  # pylint: disable=broad-except
+            self.log.exception("DataTask %s failed.", datahub_task_id)
+            operator.metrics.increment("errors")
+            result["status"] = "failed"
+            result["error"] = repr(error)
+        finally:
+            operator._datasource_hook.close()
+            operator.metrics.emit(operator)
+            result["seconds"] = time.monotonic() - start
+        return result
 
     @abstractmethod
     def execute_step(self):
@@ -46,27 +159,55 @@ class ELTPOperator(BaseOperator):
         raise NotImplementedError()
 
     def fetch_datasource(self) -> dict:
-        """Fetch datasource information from DataTask.
+        """Fetch datasource information from DataTask, with its enabled
+        protocols, as a read-only snapshot detached from the DB session.
         The method can be overriden to handle the datasource object manually.
 
         Returns:
             dict: Datasource object with information about the datasource.
         """
-        self.datasource = self._datasource_hook.retrieve_datasource(
+        self.datasource = self._datasource_hook.retrieve_datasource_snapshot(
             self.datahub_task_id
         )
 
+    def fetch_datasources(self) -> dict:
+        """Fetch the datasources of all the DataTasks when fanning out, as
+        read-only snapshots, in a single query. The method can be
+        overriden to skip some of them.
+
+        Returns:
+            dict: Datasource by DataTask ID, None for the DataTasks to skip.
+        """
+        if isinstance(self.datahub_task_id, (list, tuple, set)):
+            datasources = self._datasource_hook.retrieve_datasource_snapshots(
+                datatask_ids=self.datahub_task_id)
+            # Unknown DataTasks are reported as skipped
+            return {datahub_task_id: datasources.get(datahub_task_id)
+                    for datahub_task_id in self.datahub_task_id}
+        return self._datasource_hook.retrieve_datasource_snapshots(
+            criterion=self.datahub_task_id)
+
     def on_error(self, error):
         """Handle error on operator execution. """
         # TODO error handling based on DataTask configuration.
         raise error
 
     def log_message(self, level, message):
-        """Handle log logic. """
+        """Handle log logic. Messages are logged with the operator logger,
+        and counted by level in the metrics of the run.
+
+        Arguments:
+            level {int} -- Level of the message, as a :mod:`logging` level
+                or its name.
+            message {str} -- The message.
+        """
         # TODO write logs to DB.
         # TODO send logs to Sentry or whatever.
-        # TODO handle via builtin log instead
-        raise NotImplementedError()
+        if isinstance(level, str):
+            level = logging.getLevelName(level.upper())
+        self.log.log(level, message)
+        self.metrics.increment(
+            f"log.{logging.getLevelName(level).lower()}")
 
     def end_process(self):
         """Handle operations at the end of the ELTP step.
@@ -1,14 +1,24 @@
 """
 Extract base classes in the ELTP process.
 """
+import asyncio
 import os
+import threading
 from abc import abstractmethod
+from datetime import timedelta
 
 from visitdata.models.operators import ELTPOperator
-from visitdata.models.hooks import VDS3Hook, VDRSHook
+from visitdata.models.hooks import (
+    VDS3Hook, VDRSHook, extractor_for, shared_hook)
+from visitdata.models.hooks.matchers import common_folder
 from visitdata.models.hooks.mixins import ExtractMixin
+from visitdata.models.async_driver import AsyncExtractDriver
 from visitdata.models.datasets import VDDataset
+from visitdata.models.dedup import DedupIndex
+from visitdata.models.executor import FileExecutor
+from visitdata.models.schedule import ScheduleEvaluator
 from visitdata.models.sources import DatasourceProtocol, DatasourceDataset
+from visitdata.models.watermark import Watermark, WatermarkTracker
 
 
 class ExtractOperator(ELTPOperator):
@@ -19,21 +29,112 @@ class ExtractOperator(ELTPOperator):
             Hook used to extract data from a source.
             The hook must implement the methods in
             :class:`visitdata.models.hooks.mixins.ExtractMixin`.
-            If not provided, :class:`visitdata.models.hooks.VDS3Hook`
-            will be used.
+            If not provided, the hook of each protocol is selected by its
+            ``source_type`` (see :mod:`visitdata.models.hooks.extractors`),
+            the FTP S3 mirror by default.
+        max_workers (int): Number of files processed concurrently (see
+            :class:`visitdata.models.executor.FileExecutor`). Defaults to
+            the ``VD_EXTRACT_MAX_WORKERS`` environment variable, or 1
+            (serial processing) if it is not set.
+        failed_files (list): Files which could not be extracted during the
+            last run, as dicts with ``protocol``, ``file`` and ``error`` keys.
+        dataset_batch_size (int): If set, datasets are persisted in batches
+            of this size (see
+            :class:`visitdata.models.hooks.vd_dataflow_hook.DatasetBatch`)
+            and source files are removed once their dataset is flushed.
+            Defaults to the ``VD_EXTRACT_DATASET_BATCH_SIZE`` environment
+            variable, or 0 (one commit per dataset) if it is not set.
+        lazy_listing (bool): Whether to ask the hook for a lazy listing of
+            the source, so that files are processed while the following
+            ones are still being listed.
+        incremental (bool): Whether to only extract the files modified
+            after the watermark of each protocol (its ``source_sync_last``),
+            and to move the watermark forward once they are extracted.
+            Files listed for the first time once the watermark has moved
+            past their modification time are skipped, unless they are within
+            ``watermark_overlap`` of it.
+        watermark_overlap (int): Seconds before the watermark whose files
+            are still extracted in ``incremental`` mode, for sources where
+            files may become visible late. These files are extracted again
+            by every run while they are kept in the source, so it should be
+            used with ``deduplicate``. Defaults to the
+            ``VD_EXTRACT_WATERMARK_OVERLAP`` environment variable, or 0.
+        keep_sources (bool): Whether to leave the source files in place
+            after their extraction, i.e. for sources we are not allowed to
+            delete from. Mostly useful with ``incremental``.
+        deduplicate (bool): Whether to skip files whose content has already
+            been extracted with the same protocol (see
+            :class:`visitdata.models.dedup.DedupIndex`). Duplicates are
+            recorded as links to the original dataset, and their source is
+            removed, once the original file is extracted. Requires the
+            ``datasource_dataset_fingerprint`` table, see ``migrations``.
+        dedup_content_hash (bool): Whether to identify files by a hash of
+            their content instead of their ETag and size.
+        async_io (bool): Whether to extract files from an asyncio event
+            loop instead of a pool of threads (see
+            :class:`visitdata.models.async_driver.AsyncExtractDriver`). The
+            listing, copies, contexts and removals of the sources whose hook
+            has an async variant (see
+            :mod:`visitdata.models.hooks.extractors`) are then sent
+            concurrently from a single thread, and database operations run
+            in a dedicated thread. Files of the other sources are extracted
+            by ``max_workers`` threads. Files of async sources are checked
+            and described by :meth:`check_format_async` and
+            :meth:`create_context_async`, without calling
+            :meth:`save_file_and_context`.
+        max_in_flight (int): Number of files extracted concurrently in
+            ``async_io`` mode. Defaults to the ``VD_EXTRACT_MAX_IN_FLIGHT``
+            environment variable, or 1000.
+        on_extracted (callable): Called with a detached copy of every
+            dataset once it is saved with its ``data_path_source``, i.e. to
+            hand it to the next step (see
+            :class:`visitdata.models.operators.PipelineOperator`). Called
+            while holding the lock, so it must return quickly.
     """
 
     hook: ExtractMixin = None
 
-    def __init__(self, *args, hook=None, **kwargs):
+    on_extracted = None
+
+    # Evaluator of the protocols schedules, created when the datasource is
+    # fetched so that the step agrees with the fetch on what "now" is
+    _schedule: ScheduleEvaluator = None
+
+    def __init__(self, *args, hook=None, max_workers=None,
+                 dataset_batch_size=None, lazy_listing=False,
+                 incremental=False, watermark_overlap=None,
+                 keep_sources=False, deduplicate=False,
+                 dedup_content_hash=False, async_io=False,
+                 max_in_flight=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.log.info("Doing extract.")
         self.process_type = "extract"
-        self.hook = hook or VDS3Hook
+        if hook:
+            self.hook = hook
+        self.max_workers = int(
+            max_workers or os.getenv("VD_EXTRACT_MAX_WORKERS") or 1)
+        self.failed_files = []
+        self.dataset_batch_size = int(
+            dataset_batch_size
+            or os.getenv("VD_EXTRACT_DATASET_BATCH_SIZE") or 0)
+        self._dataset_batch = None
+        self.lazy_listing = lazy_listing
+        self.incremental = incremental
+        self.watermark_overlap = int(
+            watermark_overlap
+            or os.getenv("VD_EXTRACT_WATERMARK_OVERLAP") or 0)
+        self.keep_sources = keep_sources
+        self.deduplicate = deduplicate
+        self.dedup_content_hash = dedup_content_hash
+        self._dedup_index = None
+        self.async_io = async_io
+        self.max_in_flight = int(
+            max_in_flight or os.getenv("VD_EXTRACT_MAX_IN_FLIGHT") or 1000)
 
     def __create_dataset(self,
                          protocol: DatasourceProtocol,
-                         file: VDDataset) -> DatasourceDataset:
+                         file: VDDataset,
+                         dataset: DatasourceDataset) -> DatasourceDataset:
         """Create a datasource_dataset in the DB to store
         information about the process.
 
@@ -42,6 +143,8 @@ class ExtractOperator(ELTPOperator):
                 datasource_protocol.
             file {:class:`visitdata.models.datasets.VDDataset`}
                 -- Extracted file
+            dataset {:class:`visitdata.models.sources.DatasourceDataset`}
+                -- The dataset of the file, to save.
         Returns:
             :class:`visitdata.models.sources.DatasourceDataset` --
                 The saved dataset with an id.
@@ -49,75 +152,469 @@ class ExtractOperator(ELTPOperator):
         self.log.info("Protocol %s: creating dataset for file %s",
                       protocol.id,
                       file.name)
-        return self._datasource_hook.save_dataset(
-            file.to_datasource_dataset(protocol=protocol)
-        )
+        if self._dataset_batch is not None:
+            return self._dataset_batch.add(dataset)
+        return self._datasource_hook.save_dataset(dataset)
 
     def __update_dataset(self, dataset: DatasourceDataset):
         self.log.info("Extraction process: Updating dataset %s", dataset.id)
-        self._datasource_hook.update_dataset(dataset)
+        if self._dataset_batch is not None:
+            self._dataset_batch.update(dataset)
+        else:
+            self._datasource_hook.update_dataset(dataset)
+
+    def __on_datasets_flushed(self, rows: list):
+        """ Mark the source files of flushed datasets and duplicates
+        as removable. """
+        for row in rows:
+            source = self._unflushed_sources.pop(row.id, None)
+            if source is not None:
+                self._removable_sources.append(source)
+                if isinstance(row, DatasourceDataset):
+                    self.__notify_extracted(row)
+
+    def __notify_extracted(self, dataset: DatasourceDataset):
+        """ Hand a saved dataset to ``on_extracted``.
+        Must be called while holding the lock.
+        """
+        if self.on_extracted is not None:
+            self.on_extracted(dataset.detached_copy())
+
+    def _save_fingerprint(self, fingerprint, source=None):
+        """ Save the fingerprint of a file, and mark the file source as
+        removable once it is saved if provided.
+        Must be called while holding the lock.
+        """
+        if self._dataset_batch is None:
+            self._datasource_hook.save_fingerprint(fingerprint)
+            if source is not None:
+                self._removable_sources.append(source)
+        else:
+            if source is not None:
+                self._unflushed_sources[fingerprint.id] = source
+            self._dataset_batch.add_fingerprint(fingerprint)
 
-    def __fetch_data(self, protocol: DatasourceProtocol):
-        """ Call hook to fetch data.
+    def __extractor(self, protocol: DatasourceProtocol) -> ExtractMixin:
+        """ Returns the hook extracting the files of a protocol. """
+        if self.hook is not None:
+            return shared_hook(self.hook)
+        return extractor_for(protocol)
+
+    def _fetch_data(self, hook: ExtractMixin, prefix: str,
+                    protocols: list):
+        """ Call hook to fetch data of protocols sharing a source folder,
+        with a single listing.
 
         Arguments:
-            file_path {:class:`visitdata.models.sources.DatasourceProtocol`}
-                -- The file path as defined in the datasource protocol.
+            hook {:class:`visitdata.models.hooks.mixins.ExtractMixin`} --
+                The hook of the source of the protocols.
+            prefix {str} -- The folder holding the paths of the protocols.
+            protocols {list} -- The
+                :class:`visitdata.models.sources.DatasourceProtocol`
+                to fetch data for.
+
+        Returns:
+            list -- (protocol, :class:`visitdata.models.datasets.VDDataset`)
+                pairs.
         """
-        self.log.info("Protocol %s: Fetching data at %s with mask %s",
-                      protocol.id,
-                      protocol.source_path,
-                      protocol.data_file)
-        # TODO: handle multi source
-        return self.hook().fetch_data(
-            path=protocol.source_path,
-            mask=protocol.data_file
+        kwargs = {'lazy': True} if self.lazy_listing else {}
+        return hook.fetch_data_multi(
+            prefix=prefix,
+            targets=self._targets(protocols),
+            **kwargs
         )
 
-    def __remove_source_data(self, file: VDDataset):
-        self.log.info("Cleaning source data...")
-        file.remove_source()
+    def _targets(self, protocols: list) -> list:
+        """ Returns the (protocol, path, mask) targets of a listing. """
+        for protocol in protocols:
+            self.log.info("Protocol %s: Fetching data at %s with mask %s",
+                          protocol.id,
+                          protocol.source_path,
+                          protocol.data_file)
+        return [(protocol, protocol.source_path, protocol.data_file)
+                for protocol in protocols]
+
+    def __remove_source_data(self):
+        """ Remove the source of every file which has been fully extracted,
+        in batches. Files which could not be removed are recorded in
+        ``failed_files``.
+        """
+        sources = self._pop_removable_sources()
+        if not sources:
+            return
+        failures = []
+        with self.metrics.timer("source_delete"):
+            for hook, files in self._group_by_hook(sources):
+                failures.extend(hook.remove_sources(files))
+        self._record_removal(sources, failures)
+
+    def _pop_removable_sources(self) -> list:
+        """ Returns the (protocol ID, file) sources to remove, and forget
+        them. """
+        sources, self._removable_sources = self._removable_sources, []
+        if not sources or self.keep_sources:
+            return []
+        self.log.info("Cleaning source data of %s file(s)...", len(sources))
+        return sources
+
+    def _group_by_hook(self, sources: list) -> list:
+        """ Returns the (hook, files) pairs of sources to remove. """
+        files_by_hook = {}
+        for protocol_id, file in sources:
+            hook = self._source_hooks[protocol_id]
+            files_by_hook.setdefault(id(hook), (hook, []))[1].append(file)
+        return list(files_by_hook.values())
+
+    def _record_removal(self, sources: list, failures: list):
+        """ Count removed sources, and record the ones which could not be
+        removed in ``failed_files``. """
+        protocol_ids = {id(file): protocol_id
+                        for protocol_id, file in sources}
+        self.metrics.increment("sources_deleted", len(sources) - len(failures))
+        for file, error in failures:
+            self.log.error("Source of file %s could not be removed: %s",
+                           file.name, error)
+            self.failed_files.append({
+                "protocol": protocol_ids.get(id(file)),
+                "file": file.name,
+                "error": repr(error)
+            })
 
     def __write_data(
             self, file: VDDataset, dest_folder: str):
         """ Write data to a file """
-        file.save_to_s3(
-            key_dest=f"{dest_folder}/{file.name}")
+        with self.metrics.timer("copy"):
+            stats = file.save_to_s3(
+                key_dest=f"{dest_folder}/{file.name}")
+        self._record_copy(file, stats)
+
+    def _record_copy(self, file: VDDataset, stats):
+        """ Count a copied file and log its transfer metrics. """
+        self.metrics.increment("files")
+        if stats is not None:
+            self.metrics.increment("bytes", stats.size)
+            self.log.info("Copied %s bytes of file %s in %.2fs (%.0f B/s, "
+                          "%s part(s), %s request(s))",
+                          stats.size, file.name, stats.seconds,
+                          stats.bytes_per_second, len(stats.part_latencies),
+                          stats.attempts)
 
     def __write_context(
             self,
             context: dict,
             dest_folder: str):
         """ Write context to a file """
-        VDS3Hook().write_context(
-            context=context, key=f"{dest_folder}/context.json")
+        with self.metrics.timer("context_write"):
+            shared_hook(VDS3Hook).write_context(
+                context=context, key=f"{dest_folder}/context.json")
 
-    def execute_step(self):
+    def __iter_files(self):
+        """ Fetch the files of every protocol which should be executed.
+
+        Yields:
+            tuple -- A (:class:`visitdata.models.sources.DatasourceProtocol`,
+                :class:`visitdata.models.datasets.VDDataset`) pair per file.
+        """
+        for hook, prefix, protocols in self._sources():
+            if self.lazy_listing:
+                files = self.metrics.timed_iter(
+                    "list", self._fetch_data(hook, prefix, protocols))
+            else:
+                # The whole listing is done before the files are returned
+                with self.metrics.timer("list"):
+                    files = self._fetch_data(hook, prefix, protocols)
+            for protocol, file in files:
+                if self._is_new(protocol, file):
+                    yield protocol, file
+            self._mark_listed(protocols)
+
+    def _sources(self) -> list:
+        """ Group the protocols which should be executed by source, to list
+        the folder holding all their paths once.
+
+        Returns:
+            list -- (hook, listed prefix, protocols) tuples.
+        """
+        protocols_by_source = {}
         protocol: DatasourceProtocol
         for protocol in getattr(self.datasource, 'protocols', []):
-            if not protocol.should_execute:
-                self.log.info("Skipping extract protocol %s of datasource %s "
-                              "with period %s",
+            if not self._schedule.should_execute(protocol):
+                self.log.info("Skipping extract protocol %s of datasource "
+                              "%s with period %s",
                               protocol.id,
                               self.datasource.id,
                               protocol.protocol_period)
                 continue
             self.log.info("Starting extraction protocol # %s", protocol.id)
-            files = self.__fetch_data(protocol)
-            for file in files:
-                is_valid = self.check_format(file)
-                if not is_valid:
-                    # TODO better not valid file exception handling
-                    raise Exception(f"File {file.name} invalid.")
-                dataset = self.__create_dataset(protocol, file)
-                context = self.create_context(file)
-                dest_folder = protocol.generate_datalake_path(
-                    dataset_id=dataset.id,
-                    step="extract")
-                self.save_file_and_context(file, context, dest_folder)
-                dataset.data_path_source = dest_folder
+            try:
+                hook = self.__extractor(protocol)
+            except ValueError as error:
+                self.log.error("%s", error)
+                self.failed_files.append({
+                    "protocol": protocol.id,
+                    "file": protocol.source_path,
+                    "error": repr(error)
+                })
+                continue
+            self._source_hooks[protocol.id] = hook
+            protocols_by_source.setdefault(
+                (id(hook), protocol.source_root), (hook, []))[1].append(
+                    protocol)
+        return [(hook, common_folder(protocol.source_path
+                                     for protocol in protocols), protocols)
+                for hook, protocols in protocols_by_source.values()]
+
+    def _is_new(self, protocol: DatasourceProtocol, file: VDDataset) -> bool:
+        """ Whether a listed file should be extracted, i.e. is past the
+        watermark of its protocol in incremental mode. """
+        if not self.incremental:
+            return True
+        tracker = self._watermark_tracker(protocol)
+        watermark = Watermark.of(file)
+        if not tracker.is_new(watermark):
+            return False
+        tracker.started(watermark)
+        return True
+
+    def _mark_listed(self, protocols: list):
+        """ Record that the source of protocols has been fully listed. """
+        for protocol in protocols:
+            if self.incremental:
+                self._watermark_tracker(protocol).listed = True
+
+    def _watermark_tracker(self, protocol) -> WatermarkTracker:
+        """ Returns the watermark tracker of a protocol for the run. """
+        if protocol.id not in self._watermarks:
+            try:
+                current = Watermark.parse(protocol.source_sync_last)
+            except ValueError:
+                self.log.warning("Protocol %s: ignoring invalid watermark %s",
+                                 protocol.id, protocol.source_sync_last)
+                current = None
+            self._watermarks[protocol.id] = (
+                WatermarkTracker(
+                    current, timedelta(seconds=self.watermark_overlap)),
+                protocol.source_sync_last)
+        return self._watermarks[protocol.id][0]
+
+    def __advance_watermarks(self):
+        """ Move the watermarks of the protocols as far as the extracted
+        files allow. In batched mode, they are moved by the next flush, in
+        the same transaction as the datasets.
+        Must be called while holding the lock.
+        """
+        for protocol_id, (tracker, previous) in self._watermarks.items():
+            watermark = tracker.advanced()
+            if watermark is None:
+                continue
+            self.log.info("Protocol %s: moving watermark to %s",
+                          protocol_id, watermark.serialize())
+            if self._dataset_batch is not None:
+                self._dataset_batch.advance_watermark(
+                    protocol_id, previous, watermark.serialize())
+            elif not self._datasource_hook.advance_watermark(
+                    protocol_id, previous, watermark.serialize()):
+                self.log.warning("Protocol %s: watermark has been moved by "
+                                 "another run, leaving it unchanged.",
+                                 protocol_id)
+        self._watermarks = {}
+
+    def __process_file(self, protocol: DatasourceProtocol, file: VDDataset):
+        """ Run the whole extraction of a single file: the copy to the
+        datalake, then the context, then the dataset update. The file source
+        is then marked for removal at the end of the step.
+
+        Arguments:
+            protocol {:class:`visitdata.models.sources.DatasourceProtocol`}
+                -- Protocol the file has been fetched with.
+            file {:class:`visitdata.models.datasets.VDDataset`}
+                -- Extracted file
+        """
+        with self.metrics.timer("validate"):
+            is_valid = self.check_format(file)
+        if not is_valid:
+            # TODO better not valid file exception handling
+            raise Exception(f"File {file.name} invalid.")
+        dataset = file.to_datasource_dataset(protocol=protocol)
+        if self._dedup_index is None:
+            self.__extract_dataset(protocol, file, dataset)
+            return
+        fingerprint = self._dedup_index.fingerprint(protocol.id, file)
+        # Saved rows are expired by commits of other threads: read it first
+        dataset_id = dataset.id
+        while True:
+            with self._db_lock:
+                extraction = self._dedup_index.claim(fingerprint, dataset_id)
+            if extraction is None:
+                break
+            # Wait for the original file if it is still being extracted
+            if extraction.result():
+                with self._db_lock:
+                    self._record_duplicate(protocol, file, fingerprint)
+                return
+            # The original file could not be extracted: claim it again
+        try:
+            self.__extract_dataset(protocol, file, dataset)
+            with self._db_lock:
+                self._save_fingerprint(fingerprint)
+        except Exception:
+            self._dedup_index.release(dataset_id)
+            raise
+        self._dedup_index.confirm(dataset_id)
+
+    def _record_duplicate(self, protocol: DatasourceProtocol,
+                          file: VDDataset, fingerprint):
+        """ Record a file as a duplicate of an extracted file, and mark its
+        source for removal. Must be called while holding the lock.
+        """
+        self.log.info("Protocol %s: file %s is a duplicate of "
+                      "dataset %s, skipping it.",
+                      protocol.id, file.name,
+                      fingerprint.datasource_dataset_id)
+        self._save_fingerprint(fingerprint, source=(protocol.id, file))
+        self.metrics.increment("duplicates")
+
+    def __extract_dataset(self, protocol: DatasourceProtocol,
+                          file: VDDataset, dataset: DatasourceDataset):
+        """ Save the dataset of a file, copy the file and its context to the
+        datalake, then update the dataset.
+        """
+        with self._db_lock:
+            dataset, dataset_id = self._insert_dataset(
+                protocol, file, dataset)
+        dest_folder = protocol.generate_datalake_path(
+            dataset_id=dataset_id,
+            step="extract")
+        context = self.create_context(file)
+        self.save_file_and_context(file, context, dest_folder)
+        with self._db_lock:
+            self._finish_dataset(protocol, file, dataset, dest_folder)
+
+    def _insert_dataset(self, protocol: DatasourceProtocol,
+                        file: VDDataset, dataset: DatasourceDataset):
+        """ Save the dataset of a file before its copy.
+        Must be called while holding the lock.
+
+        Returns:
+            tuple -- The saved dataset and its ID, read while holding the
+                lock as commits of other threads expire the dataset.
+        """
+        with self.metrics.timer("dataset_insert"):
+            dataset = self.__create_dataset(protocol, file, dataset)
+            return dataset, dataset.id
+
+    def _finish_dataset(self, protocol: DatasourceProtocol,
+                        file: VDDataset, dataset: DatasourceDataset,
+                        dest_folder: str):
+        """ Update the dataset of a copied file, and mark its source for
+        removal. Must be called while holding the lock.
+        """
+        with self.metrics.timer("dataset_update"):
+            dataset.data_path_source = dest_folder
+            source = (protocol.id, file)
+            if self._dataset_batch is None:
                 self.__update_dataset(dataset)
-                self.__remove_source_data(file)
+                self._removable_sources.append(source)
+                self.__notify_extracted(dataset)
+            else:
+                # Sources can only be removed once their dataset is flushed
+                self._unflushed_sources[dataset.id] = source
+                self.__update_dataset(dataset)
+
+    def _extract_file(self, protocol: DatasourceProtocol, file: VDDataset):
+        """ Process a file and record its result for the watermark. """
+        if not self.incremental:
+            self.__process_file(protocol, file)
+            return
+        tracker = self._watermark_tracker(protocol)
+        try:
+            self.__process_file(protocol, file)
+        except Exception:
+            tracker.finished(Watermark.of(file), success=False)
+            raise
+        tracker.finished(Watermark.of(file), success=True)
+
+    def _record_failure(self, protocol_id, file_name: str, error):
+        """ Record a file whose extraction failed in ``failed_files``. """
+        self.log.error("Protocol %s: extraction of file %s failed: %s",
+                       protocol_id, file_name, error)
+        self.metrics.increment("files_failed")
+        self.failed_files.append({
+            "protocol": protocol_id,
+            "file": file_name,
+            "error": repr(error)
+        })
+
+    def _commit_pending(self):
+        """ Move the watermarks and flush the pending datasets at the end
+        of the step. Must be called while holding the lock.
+        """
+        self.__advance_watermarks()
+        if self._dataset_batch is not None:
+            with self.metrics.timer("commit"):
+                self._dataset_batch.flush()
+        self._dataset_batch = None
+
+    def fetch_datasource(self):
+        """ Fetch the datasource, unless none of its protocols has to be
+        executed now. Only the protocols schedules are read to decide it.
+        """
+        self._schedule = ScheduleEvaluator()
+        schedules = self._datasource_hook.retrieve_protocol_schedules(
+            [self.datahub_task_id])
+        if schedules and not self._schedule.due_datasources(schedules):
+            self.log.info("Nothing to extract for DataTask %s at %s.",
+                          self.datahub_task_id, self._schedule.now)
+            self.datasource = None
+            return
+        super().fetch_datasource()
+
+    def fetch_datasources(self) -> dict:
+        """ Fetch the datasources, skipping the ones with no protocol to
+        execute now. """
+        self._schedule = ScheduleEvaluator()
+        datasources = super().fetch_datasources()
+        due = self._schedule.due_datasources(
+            (datasource.id, protocol.protocol_period)
+            for datasource in datasources.values() if datasource is not None
+            for protocol in datasource.protocols)
+        return {datahub_task_id: datasource
+                if datasource is not None and datasource.id in due else None
+                for datahub_task_id, datasource in datasources.items()}
+
+    def execute_step(self):
+        if self._schedule is None:
+            self._schedule = ScheduleEvaluator()
+        self._db_lock = threading.Lock()
+        self.failed_files = []
+        self._unflushed_sources = {}
+        self._removable_sources = []
+        self._source_hooks = {}
+        self._watermarks = {}
+        if self.deduplicate:
+            self._dedup_index = DedupIndex(
+                self._datasource_hook, content_hash=self.dedup_content_hash)
+        if self.dataset_batch_size:
+            self._dataset_batch = self._datasource_hook.dataset_batch(
+                chunk_size=self.dataset_batch_size,
+                on_flush=self.__on_datasets_flushed)
+        if self.async_io:
+            asyncio.run(AsyncExtractDriver(self).run())
+        else:
+            executor = FileExecutor(self._extract_file, self._record_failure,
+                                    max_workers=self.max_workers)
+            try:
+                executor.run(self.__iter_files())
+            finally:
+                try:
+                    with self._db_lock:
+                        self._commit_pending()
+                finally:
+                    self.__remove_source_data()
+        if self.failed_files:
+            raise Exception(
+                f"{len(self.failed_files)} file(s) could not be extracted: "
+                + ", ".join(failure["file"] for failure in self.failed_files))
         return True
 
     def save_file_and_context(self, file, context, dest_folder):
@@ -147,3 +644,15 @@ class ExtractOperator(ELTPOperator):
     def create_context(self, file: VDDataset) -> dict:
         """ Create metadata context files """
         raise NotImplementedError()
+
+    async def check_format_async(self, file: VDDataset) -> bool:
+        """ Check format of extracted files in ``async_io`` mode. Calls
+        :meth:`check_format` in the event loop: override it if the check
+        blocks, i.e. reads the file. """
+        return self.check_format(file)
+
+    async def create_context_async(self, file: VDDataset) -> dict:
+        """ Create metadata context files in ``async_io`` mode. Calls
+        :meth:`create_context` in the event loop: override it if it blocks.
+        """
+        return self.create_context(file)
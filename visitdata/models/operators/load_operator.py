@@ -1,46 +1,158 @@
 """ Load base classes in the ELTP process. """
+import os
+from datetime import datetime, timezone
+from uuid import uuid4
 
 from visitdata.models.operators import ELTPOperator
-from visitdata.models.hooks import VDS3Hook
+from visitdata.models.operators.transform_operator import TransformOperator
+from visitdata.models.hooks import VDRSHook, shared_hook, step_statement
 from visitdata.models.hooks.mixins import VDDBMixin
 
 
 class LoadOperator(ELTPOperator):
-    """Base class for all load related steps."""
+    """Base class for all load related steps.
+
+    Transformed files are loaded by batches of datasets, each batch with a
+    single bulk load which also marks its datasets as loaded. Rows
+    previously loaded for the datasets, or for the datasets they replace,
+    are swapped with the new ones in the same transaction, so that a failed
+    or retried load never leaves partial or duplicated data.
+
+    Attributes:
+        table (str): Table to load data into, optionally prefixed by its
+            schema.
+        columns (list): Columns of the table in the order of the
+            transformed CSV files. By default, the columns of the table.
+        input_format (str): Format of the transformed files, ``csv`` or
+            ``parquet``.
+        dataset_id_column (str): Column of the table holding the ID of the
+            dataset of the rows, used to unload previously loaded data.
+        load_batch_size (int): Maximum number of datasets loaded at once.
+            Defaults to the ``VD_LOAD_BATCH_SIZE`` environment variable, or
+            1000.
+    """
 
     hook: VDDBMixin = None
     """Basehook: Hook used to load and unload data from a database. The hook
     must implement the methods in
-    :class:`.visitdata.models.hooks.mixins.VDDBMixin`.
+    :class:`.visitdata.models.hooks.mixins.VDDBMixin`. Defaults to the
+    :class:`visitdata.models.hooks.VDRSHook` shared by the process, created
+    on first use.
     """
 
-    def __init__(self, hook, *args, **kwargs):
+    table: str = None
+
+    columns: list = None
+
+    input_format = TransformOperator.output_format
+
+    dataset_id_column = TransformOperator.dataset_id_column
+
+    def __init__(self, hook=None, *args, load_batch_size=None, **kwargs):
         super().__init__(*args, **kwargs)
-        self.hook = hook
+        self.process_type = "load"
+        if hook:
+            self.hook = hook
+        self.load_batch_size = int(
+            load_batch_size or os.getenv("VD_LOAD_BATCH_SIZE") or 1000)
+
+    def execute_step(self):
+        protocols = {protocol.id: protocol for protocol
+                     in getattr(self.datasource, 'protocols', [])}
+        if not protocols:
+            return True
+        datasets = self._datasource_hook.retrieve_pending_datasets(
+            list(protocols), step="load")
+        for start in range(0, len(datasets), self.load_batch_size):
+            self.load_datasets(self.__retrieve_transformed_data(
+                protocols, datasets[start:start + self.load_batch_size]))
+        return True
+
+    def load_datasets(self, data, local_paths=None):
+        """ Load the transformed files of datasets, replacing the rows
+        previously loaded for them.
 
-    def __execute_step(self):
-        data = self.__retrieve_transformed_data()
-        self.__unload_previous_data(data)
-        self.load(data)
+        Arguments:
+            data {list} -- (dataset, key of the transformed file) pairs.
 
-    def __retrieve_transformed_data(self):
+        Keyword Arguments:
+            local_paths {dict} -- Local copies of the files by key, read
+                instead of the datalake when the hook loads files itself
+                (see :meth:`visitdata.models.hooks.VDRSHook.load`).
+                (default: {None})
+        """
+        if self.hook is None:
+            self.hook = shared_hook(VDRSHook)
+        kwargs = {'local_paths': local_paths} if local_paths else {}
+        self.load(data, self.__unload_previous_data(data), **kwargs)
+
+    def __retrieve_transformed_data(self, protocols, datasets):
         """ Retrieve files from the transform step.
         Returns:
-            file: The transformed data.
+            list: (dataset, key of the transformed file) pairs.
         """
-        # TODO implementation with S3 Hook
-        VDS3Hook().fetch_file()
-        return None, None
+        return [
+            (dataset, TransformOperator.transformed_data_key(
+                protocols[dataset.datasource_protocol_id], dataset,
+                self.input_format))
+            for dataset in datasets]
 
-    def __unload_previous_data(self, data):
-        """ Clean data in the database
+    def __unload_previous_data(self, data) -> list:
+        """ Find data in the database to clean
         if it was previous loaded.
+
+        Returns:
+            list: IDs of the datasets whose rows are replaced by the load:
+                the loaded datasets and the datasets they were reloaded
+                from.
         """
-        raise NotImplementedError()
+        dataset_ids = [dataset.id for dataset, _ in data]
+        dataset_ids.extend(str(dataset.process_previous) for dataset, _ in data
+                           if dataset.process_previous is not None)
+        return dataset_ids
+
+    def __manifest_key(self) -> str:
+        return (f"{os.getenv('VD_S3_DATALAKE_PREFIX')}"
+                f"/datasource-{self.datasource.id}"
+                f"/manifests/{uuid4()}.manifest")
 
-    def load(self, data):
-        """ Insert data into the Database."""
-        raise NotImplementedError()
+    def load(self, data, replace_ids=None, local_paths=None):
+        """ Insert data into the Database.
+
+        The datasets are marked as loaded in the same transaction when the
+        hook uses the database of the datasets, and right after otherwise.
+
+        Arguments:
+            data {list} -- (dataset, key of the transformed file) pairs.
+
+        Keyword Arguments:
+            replace_ids {list} -- IDs of the datasets whose rows are
+                replaced by the loaded ones. (default: {None})
+            local_paths {dict} -- Local copies of the files by key.
+                (default: {None})
+        """
+        kwargs = {'local_paths': local_paths} if local_paths else {}
+        dataset_ids = [dataset.id for dataset, _ in data]
+        loaded = step_statement(
+            dataset_ids, "load", datetime.now(timezone.utc))
+        same_database = (getattr(self.hook, 'postgres_conn_id', None)
+                         == self._datasource_hook.postgres_conn_id)
+        with self.metrics.timer("copy"):
+            self.hook.load(
+                self.table, [key for _, key in data],
+                columns=self.columns,
+                file_format=self.input_format,
+                manifest_key=self.__manifest_key(),
+                statements=[loaded] if same_database else [],
+                replace_ids=replace_ids,
+                replace_column=self.dataset_id_column,
+                **kwargs)
+        if not same_database:
+            with self.metrics.timer("dataset_update"):
+                self._datasource_hook.execute_statement(loaded)
+        self.metrics.increment("files", len(data))
+        self.log.info("DataTask %s: %s datasets loaded into %s.",
+                      self.datahub_task_id, len(dataset_ids), self.table)
 
     def verify(self):
         """ Verify data has been loaded correctly.
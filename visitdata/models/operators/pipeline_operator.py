@@ -0,0 +1,246 @@
+""" Fused extract, transform and load steps in the ELTP process. """
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from datetime import datetime, timezone
+
+from visitdata.models.operators import ELTPOperator
+from visitdata.models.hooks import VDS3Hook, shared_hook, step_statement
+from visitdata.models.metrics import create_metrics
+from visitdata.models.sources import DatasourceDataset
+
+# Steps fused by the pipeline, in order
+STEPS = ("extract", "transform", "load")
+
+
+class PipelineOperator(ELTPOperator):
+    """ Run the extract, transform and load steps of a DataTask in a single
+    task, handing every dataset from one step to the next instead of
+    listing and reading it again from the datalake.
+
+    Each dataset is transformed by a pool of workers as soon as it is
+    extracted, into a local spool file. The spool file is then uploaded to
+    the transform folder of the dataset in the background, so that the
+    datalake still holds the output of every step, while the next datasets
+    are extracted and transformed. Persisted datasets are loaded in batches
+    of ``load_batch_size``, from their spool files when the load hook reads
+    files itself (``VD_RS_LOAD_MODE=local``), with ``COPY`` from the
+    datalake otherwise.
+
+    The timestamps of the datasets are recorded as by the separate steps:
+    ``process_e_timestamp`` when they are extracted,
+    ``process_t_timestamp`` once their transformed file is persisted, and
+    ``process_l_timestamp`` in the load transaction. A dataset whose
+    transform or load fails is left pending for the separate steps.
+
+    The steps are instances of ``extract_class``, ``transform_class`` and
+    ``load_class``, created at each run with their keyword arguments and a
+    ``task_id`` named after the pipeline, i.e. ``<task_id>.extract``: step
+    classes with a default ``task_id`` must let it be overridden. They are
+    not tasks of the DAG, and emit their own metrics.
+
+    Attributes:
+        max_workers (int): Number of datasets transformed, and of spool
+            files uploaded, concurrently. Defaults to the
+            ``VD_PIPELINE_MAX_WORKERS`` environment variable, or 4.
+        spool_dir (str): Folder of the spool files. Defaults to the
+            ``VD_PIPELINE_SPOOL_DIR`` environment variable, or the temporary
+            folder of the system.
+        failed_datasets (list): Datasets which could not be transformed or
+            loaded during the last run, as dicts with ``dataset``, ``step``
+            and ``error`` keys.
+    """
+
+    # Evaluator of the protocols schedules used to fetch the datasource,
+    # handed to the extract step
+    _schedule = None
+
+    def __init__(self, *args, extract_class, transform_class, load_class,
+                 extract_kwargs=None, transform_kwargs=None,
+                 load_kwargs=None, max_workers=None, spool_dir=None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.process_type = "pipeline"
+        self.steps = {
+            "extract": (extract_class, extract_kwargs or {}),
+            "transform": (transform_class, transform_kwargs or {}),
+            "load": (load_class, load_kwargs or {}),
+        }
+        self.max_workers = int(
+            max_workers or os.getenv("VD_PIPELINE_MAX_WORKERS") or 4)
+        self.spool_dir = spool_dir or os.getenv("VD_PIPELINE_SPOOL_DIR")
+        self.failed_datasets = []
+
+    def __step(self, name: str):
+        """ Create the operator running a step.
+
+        Arguments:
+            name {str} -- ``extract``, ``transform`` or ``load``.
+        """
+        operator_class, kwargs = self.steps[name]
+        operator = operator_class(
+            task_id=f"{self.task_id}.{name}",
+            datahub_task_id=self.datahub_task_id,
+            metrics_sinks=self.metrics_sinks,
+            **kwargs)
+        operator.datasource = self.datasource
+        return operator
+
+    def fetch_datasource(self):
+        """ Fetch the datasource as the extract step does, i.e. skipping it
+        if none of its protocols has to be extracted now. """
+        extract = self.__step("extract")
+        extract._datasource_hook = self._datasource_hook
+        extract.fetch_datasource()
+        self.datasource = extract.datasource
+        self._schedule = extract._schedule
+
+    def fetch_datasources(self) -> dict:
+        """ Fetch the datasources as the extract step does when fanning
+        out. """
+        extract = self.__step("extract")
+        extract._datasource_hook = self._datasource_hook
+        datasources = extract.fetch_datasources()
+        self._schedule = extract._schedule
+        return datasources
+
+    def __record_failure(self, step: str, datasets: list, error):
+        """ Record datasets whose step failed in ``failed_datasets``. """
+        self.log.error("%s of dataset(s) %s failed: %s", step.capitalize(),
+                       ", ".join(dataset.id for dataset in datasets), error)
+        self.metrics.increment(f"{step}_failed", len(datasets))
+        with self._lock:
+            self.failed_datasets.extend(
+                {"dataset": dataset.id, "step": step, "error": repr(error)}
+                for dataset in datasets)
+
+    def __submit(self, executor, step: str, datasets: list, function, *args):
+        """ Run a step of datasets in an executor, recording its failure.
+        """
+        def done(future):
+            error = future.exception()
+            if error is not None:
+                self.__record_failure(step, datasets, error)
+        executor.submit(function, *args).add_done_callback(done)
+
+    def __on_extracted(self, dataset: DatasourceDataset):
+        """ Hand an extracted dataset to the transform workers. """
+        self.metrics.increment("datasets")
+        self.__submit(self._transformers, "transform", [dataset],
+                      self.__transform, dataset)
+
+    def __transform(self, dataset: DatasourceDataset):
+        """ Transform a dataset into a spool file, then upload it in the
+        background. """
+        transform = self._steps["transform"]
+        protocol = self._protocols[str(dataset.datasource_protocol_id)]
+        path = os.path.join(
+            self._spool, f"{dataset.id}.{transform.output_format}")
+        try:
+            with self.metrics.timer("transform"), open(path, 'wb') as spool:
+                transform.transform_to_file(protocol, dataset, spool)
+        except Exception:
+            # The spool file is not created if it cannot be opened
+            with suppress(FileNotFoundError):
+                os.remove(path)
+            raise
+        key = transform.transformed_data_key(
+            protocol, dataset, transform.output_format)
+        self.__submit(self._uploaders, "transform", [dataset],
+                      self.__persist, dataset, key, path)
+
+    def __persist(self, dataset: DatasourceDataset, key: str, path: str):
+        """ Upload the spool file of a dataset to its transform folder, then
+        queue the dataset for the load. """
+        try:
+            with self.metrics.timer("persist"):
+                with open(path, 'rb') as spool:
+                    with shared_hook(VDS3Hook).upload_writer(key) as writer:
+                        shutil.copyfileobj(spool, writer, 1024 * 1024)
+        except Exception:
+            os.remove(path)
+            raise
+        self.metrics.increment("files")
+        self.metrics.increment("bytes", writer.stats.size)
+        dataset.process_t_timestamp = datetime.now(timezone.utc)
+        with self._lock:
+            self._pending.append((dataset, key, path))
+            if len(self._pending) < self._steps["load"].load_batch_size:
+                return
+            batch, self._pending = self._pending, []
+        self.__submit(self._loader, "load", [item[0] for item in batch],
+                      self.__load, batch)
+
+    def __load(self, batch: list):
+        """ Record the transform of persisted datasets, then load them from
+        their spool files. """
+        load = self._steps["load"]
+        try:
+            with self.metrics.timer("dataset_update"):
+                load._datasource_hook.execute_statements([
+                    step_statement([dataset.id], "transform",
+                                   dataset.process_t_timestamp)
+                    for dataset, _, _ in batch])
+            with self.metrics.timer("load"):
+                load.load_datasets(
+                    [(dataset, key) for dataset, key, _ in batch],
+                    local_paths={key: path for _, key, path in batch})
+        finally:
+            for _, _, path in batch:
+                os.remove(path)
+
+    def execute_step(self):
+        self._steps = {name: self.__step(name) for name in STEPS}
+        # Protocol IDs are strings, but datasets reference them as integers
+        self._protocols = {str(protocol.id): protocol for protocol
+                           in getattr(self.datasource, 'protocols', [])}
+        self._lock = threading.Lock()
+        self._pending = []
+        self.failed_datasets = []
+        for operator in self._steps.values():
+            operator._datasource_hook = self._datasource_hook_class()
+            operator.metrics = create_metrics(self.metrics_sinks)
+        extract = self._steps["extract"]
+        extract.on_extracted = self.__on_extracted
+        extract._schedule = self._schedule
+        try:
+            with tempfile.TemporaryDirectory(
+                    prefix="visitdata-pipeline-", dir=self.spool_dir) as spool:
+                self._spool = spool
+                self._transformers = ThreadPoolExecutor(
+                    max_workers=self.max_workers)
+                self._uploaders = ThreadPoolExecutor(
+                    max_workers=self.max_workers)
+                self._loader = ThreadPoolExecutor(max_workers=1)
+                try:
+                    with extract.metrics.timer("execute_step"):
+                        extract.execute_step()
+                finally:
+                    self.__drain()
+        finally:
+            for operator in self._steps.values():
+                operator._datasource_hook.close()
+                operator.metrics.emit(operator)
+        if self.failed_datasets:
+            raise Exception(
+                f"{len(self.failed_datasets)} dataset(s) could not be "
+                "transformed or loaded: " + ", ".join(
+                    failure["dataset"] for failure in self.failed_datasets))
+        for operator in self._steps.values():
+            operator.end_process()
+        return True
+
+    def __drain(self):
+        """ Wait for the extracted datasets to be transformed, persisted and
+        loaded. Each executor only receives work from the previous one, so
+        they are shut down in order. """
+        self._transformers.shutdown()
+        self._uploaders.shutdown()
+        batch, self._pending = self._pending, []
+        if batch:
+            self.__submit(self._loader, "load", [item[0] for item in batch],
+                          self.__load, batch)
+        self._loader.shutdown()
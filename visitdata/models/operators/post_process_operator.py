@@ -1,43 +1,199 @@
 """ Post-process base classes in the ELTP process. """
+import os
+import re
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, text
 
 from visitdata.models.operators import ELTPOperator
-from visitdata.models.hooks import VDRSHook
+from visitdata.models.hooks import VDRSHook, shared_hook, step_statement
 from visitdata.models.hooks.mixins import VDDBMixin
 
+# String literals of a SQL statement, with quotes escaped by doubling them
+# or with a backslash
+SQL_LITERAL = re.compile(r"('(?:[^'\\]|\\.|'')*')")
+
+# Dataset IDs which can be rendered inline in a string literal
+INLINE_ID = re.compile(r"[\w-]+")
+
 
 class PostProcessOperator(ELTPOperator):
     """ Base class for all post process related steps.
+
+    Post-processing is declared as SQL statements executed inside the
+    database over the loaded datasets, i.e. ``INSERT ... SELECT`` or
+    ``UNLOAD``, so that data never leaves the database. The statements of a
+    batch of datasets run in a single transaction, which also marks the
+    datasets as post-processed. Subclasses declaring no statements must use
+    the Python fallback, else the step raises :class:`NotImplementedError`
+    instead of marking the datasets as post-processed.
+
+    Attributes:
+        statements (list): SQL statements, in which ``:dataset_ids`` is
+            bound to the IDs of the post-processed datasets (see
+            :meth:`bind_dataset_ids`).
+        python_fallback (bool): Whether to post-process data in Python
+            instead: the rows returned by :attr:`source_query` are passed to
+            :meth:`post_process` by batches, and the result is inserted
+            into :attr:`table`. Much slower, as every row goes through the
+            network twice.
+        source_query (str): SQL query retrieving the data to post-process
+            with the Python fallback.
+        table (str): Table the Python fallback inserts data into. The rows
+            of the datasets already in it are replaced.
+        dataset_id_column (str): Column of :attr:`table` holding the ID of
+            the dataset of the rows.
+        post_process_batch_size (int): Maximum number of datasets
+            post-processed at once. Defaults to the
+            ``VD_POST_PROCESS_BATCH_SIZE`` environment variable, or 1000.
     """
-    hook: VDDBMixin = VDRSHook()
+    hook: VDDBMixin = None
     """Basehook: Hook used to retrieve and load data from a database. The hook
     must implement the methods in
-    :class:`.visitdata.models.hooks.mixins.VDDBMixin`.
+    :class:`.visitdata.models.hooks.mixins.VDDBMixin`. Defaults to the
+    :class:`visitdata.models.hooks.VDRSHook` shared by the process, created
+    on first use.
     """
 
-    def __init__(self, *args, hook=None, **kwargs):
+    statements: list = []
+
+    python_fallback = False
+
+    source_query: str = None
+
+    table: str = None
+
+    dataset_id_column = "datasource_dataset_id"
+
+    def __init__(self, *args, hook=None, post_process_batch_size=None,
+                 **kwargs):
         super().__init__(*args, **kwargs)
+        self.process_type = "post_process"
         if hook:
             self.hook = hook
+        self.post_process_batch_size = int(
+            post_process_batch_size
+            or os.getenv("VD_POST_PROCESS_BATCH_SIZE") or 1000)
 
-    def __execute_step(self):
-        data = self.__retrieve_transformed_data()
-        self.__unload_previous_data(data)
-        self.load(data)
-        self.post_process(data)
-        self.__load_post_processed_data(data)
+    def execute_step(self):
+        if self.hook is None:
+            self.hook = shared_hook(VDRSHook)
+        protocols = [protocol.id for protocol
+                     in getattr(self.datasource, 'protocols', [])]
+        if not protocols:
+            return True
+        datasets = self._datasource_hook.retrieve_pending_datasets(
+            protocols, step="post_process")
+        dataset_ids = [dataset.id for dataset in datasets]
+        size = self.post_process_batch_size
+        for start in range(0, len(dataset_ids), size):
+            batch_ids = dataset_ids[start:start + size]
+            processed = step_statement(
+                batch_ids, "post_process", datetime.now(timezone.utc))
+            same_database = (getattr(self.hook, 'postgres_conn_id', None)
+                             == self._datasource_hook.postgres_conn_id)
+            statements = [processed] if same_database else []
+            with self.metrics.timer("post_process"):
+                if self.python_fallback:
+                    data = self.__retrieve_loaded_data(batch_ids)
+                    self.__load_post_processed_data(
+                        batch_ids, map(self.post_process, data), statements)
+                else:
+                    self.hook.execute_transaction(
+                        self.__post_process_statements(batch_ids)
+                        + statements)
+            if not same_database:
+                with self.metrics.timer("dataset_update"):
+                    self._datasource_hook.execute_statement(processed)
+            self.metrics.increment("datasets", len(batch_ids))
+            self.log.info("DataTask %s: %s datasets post-processed.",
+                          self.datahub_task_id, len(batch_ids))
+        return True
 
-    def __retrieve_loaded_data(self):
+    @staticmethod
+    def bind_dataset_ids(sql: str, dataset_ids: list):
+        """ Returns a SQL statement with ``:dataset_ids`` bound to a list of
+        dataset IDs, if it uses it.
+
+        Parameters cannot be bound inside a string literal, i.e. the quoted
+        query of an ``UNLOAD``: there the IDs are rendered inline instead,
+        as a list of literals with doubled quotes::
+
+            UNLOAD ('SELECT * FROM visit
+                     WHERE datasource_dataset_id IN (:dataset_ids)')
+            TO 's3://...'
+        """
+        dataset_ids = list(dataset_ids)
+        parts = SQL_LITERAL.split(sql)
+        # Literals are the odd parts
+        for index in range(1, len(parts), 2):
+            if re.search(r":dataset_ids\b", parts[index]):
+                parts[index] = re.sub(
+                    r":dataset_ids\b",
+                    PostProcessOperator.__inline_ids(dataset_ids),
+                    parts[index])
+        statement = text("".join(parts))
+        if any(re.search(r":dataset_ids\b", part) for part in parts[::2]):
+            statement = statement.bindparams(bindparam(
+                "dataset_ids", value=dataset_ids, expanding=True))
+        return statement
+
+    @staticmethod
+    def __inline_ids(dataset_ids: list) -> str:
+        """ Render dataset IDs as a list of SQL literals nested in a string
+        literal. """
+        for dataset_id in dataset_ids:
+            if not INLINE_ID.fullmatch(str(dataset_id)):
+                raise ValueError(
+                    f"Dataset ID {dataset_id!r} cannot be rendered inline.")
+        return ", ".join(f"''{dataset_id}''" for dataset_id in dataset_ids)
+
+    def post_process_statements(self, dataset_ids: list) -> list:
+        """ Statements post-processing some datasets. By default, the
+        :attr:`statements` with their parameters bound.
+
+        Arguments:
+            dataset_ids {list} -- IDs of the datasets.
+
+        Returns:
+            list: SQLAlchemy statements.
+        """
+        return [self.bind_dataset_ids(sql, dataset_ids)
+                for sql in self.statements]
+
+    def __post_process_statements(self, dataset_ids: list) -> list:
+        """ Statements post-processing some datasets, which must not be
+        marked as post-processed if nothing post-processes them. """
+        statements = self.post_process_statements(dataset_ids)
+        if not statements:
+            raise NotImplementedError(
+                f"{type(self).__name__} declares no post-processing "
+                "statements and does not use the Python fallback.")
+        return statements
+
+    def __retrieve_loaded_data(self, dataset_ids):
         """ Retrieve data from the load step.
         Returns:
-            file: The transformed data.
+            iterator: The loaded data, by batches of records.
         """
-        data = self.hook.retrieve()
-        return data
+        return self.hook.retrieve(
+            self.bind_dataset_ids(self.source_query, dataset_ids))
 
-    def __load_post_processed_data(self, data):
+    def __load_post_processed_data(self, dataset_ids, data, statements):
         """ Load post-processed data """
-        self.hook.load()
+        self.hook.insert(
+            self.table, data,
+            replace_ids=dataset_ids,
+            replace_column=self.dataset_id_column,
+            statements=statements)
 
     def post_process(self, data):
-        """ Post process data """
+        """ Post process data with the Python fallback.
+
+        Arguments:
+            data {list} -- A batch of records, as dicts by column name.
+
+        Returns:
+            list: The post-processed records.
+        """
         raise NotImplementedError()
@@ -1,49 +1,262 @@
 """ Transform base classes in the ELTP process. """
+import os
+from datetime import datetime, timezone
 
 from visitdata.models.operators import ELTPOperator
-from visitdata.models.hooks import VDS3Hook
+from visitdata.models.hooks import VDS3Hook, shared_hook
+from visitdata.models.columnar import BatchSchema, broadcast_context, \
+    to_record_batches
+from visitdata.models.formats import batch_writer, iter_arrow_batches, \
+    iter_csv_batches
+from visitdata.models.sources import DatasourceProtocol, DatasourceDataset
 
 
 class TransformOperator(ELTPOperator):
     """ Base class for all transform related steps.
+
+    Files saved by the extract step are streamed from the datalake and
+    transformed by batches of records, so that memory stays flat whatever
+    the size of the files.
+
+    Attributes:
+        batch_size (int): Maximum number of records per batch. Defaults to
+            the ``VD_TRANSFORM_BATCH_SIZE`` environment variable, or 10000.
+        output_format (str): Format of the transformed files, ``csv`` or
+            ``parquet`` (requires ``pyarrow``).
+        csv_options (dict): Options used to read extracted CSV files, i.e.
+            ``{"delimiter": ";"}``.
+        encoding (str): Encoding of the extracted files.
+        columnar (bool): Whether data is transformed by columnar batches
+            with :meth:`transform_batch` instead of :meth:`transform`
+            (requires ``pyarrow``). The scalar values of the context are
+            then appended to each batch as constant columns.
+        schema (:class:`visitdata.models.columnar.BatchSchema`): Expected
+            schema of the transformed columnar batches, checked by the
+            default :meth:`check_format`.
+        dataset_id_column (str): Column added to the transformed data with
+            the ID of its dataset, used to load and unload it. Not added if
+            None.
+        failed_datasets (list): Datasets which could not be transformed
+            during the last run, as dicts with ``dataset`` and ``error``
+            keys. A failing dataset does not stop the others, and is left
+            pending for the next run.
     """
 
-    def __init__(self, *args, **kwargs):
+    output_format = "csv"
+
+    csv_options = {}
+
+    encoding = "utf-8"
+
+    columnar = False
+
+    schema: BatchSchema = None
+
+    dataset_id_column = "datasource_dataset_id"
+
+    def __init__(self, *args, batch_size=None, output_format=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.process_type = "transform"
+        self.batch_size = int(
+            batch_size or os.getenv("VD_TRANSFORM_BATCH_SIZE") or 10000)
+        if output_format:
+            self.output_format = output_format
+        self.failed_datasets = []
 
-    def __retrieve_extracted_data(self):
+    def __retrieve_extracted_data(self, dataset: DatasourceDataset):
         """ Retrieve files from the extract step.
         Returns:
-            files: The data and the context files.
+            files: The data, as an iterator of batches of records, and the
+                context.
         """
-        # TODO implementation with S3 Hook
-        VDS3Hook().fetch_file()
-        return None, None
+        hook = shared_hook(VDS3Hook)
+        _, file_name = os.path.split(dataset.data_path_archive)
+        context = hook.read_json(f"{dataset.data_path_source}/context.json")
+        stream = hook.open_cached(f"{dataset.data_path_source}/{file_name}",
+                                  metrics=self.metrics)
+        reader = iter_arrow_batches if self.columnar else iter_csv_batches
+        data = reader(
+            stream, batch_size=self.batch_size, encoding=self.encoding,
+            **self.csv_options)
+        return data, context
 
-    def __save_transformed_data(self, data):
-        """ Save transformed data to a CSV file.
+    def __save_transformed_data(self, protocol: DatasourceProtocol,
+                                dataset: DatasourceDataset, batches) -> str:
+        """ Save transformed data to the transform folder of the dataset,
+        with a multipart upload.
+
+        Returns:
+            str: The key of the transformed file.
         """
-        # TODO save transformed data.
-        raise NotImplementedError()
+        key = self.transformed_data_key(
+            protocol, dataset, self.output_format)
+        fileobj = shared_hook(VDS3Hook).upload_writer(key)
+        try:
+            self.__write_batches(batches, fileobj)
+        except Exception:
+            fileobj.abort()
+            raise
+        self.log.info("Dataset %s: transformed data saved to %s "
+                      "(%s bytes in %.2fs)",
+                      dataset.id, key, fileobj.stats.size,
+                      fileobj.stats.seconds)
+        self.metrics.increment("files")
+        self.metrics.increment("bytes", fileobj.stats.size)
+        return key
+
+    def __write_batches(self, batches, fileobj):
+        """ Write batches of transformed data to a binary file object in
+        :attr:`output_format`, closing it at the end. """
+        writer = batch_writer(self.output_format, fileobj)
+        for batch in batches:
+            with self.metrics.timer("write"):
+                writer.write_batch(batch)
+        with self.metrics.timer("write"):
+            writer.close()
+
+    def transform_to_file(self, protocol: DatasourceProtocol,
+                          dataset: DatasourceDataset, fileobj):
+        """ Transform the extracted data of a dataset into a file object
+        instead of its transform folder, i.e. a local spool file handed to
+        the load step. The dataset is not updated.
+
+        Arguments:
+            protocol {:class:`visitdata.models.sources.DatasourceProtocol`}
+                -- Protocol of the dataset.
+            dataset {:class:`visitdata.models.sources.DatasourceDataset`}
+                -- The extracted dataset.
+            fileobj {file} -- Binary file object, closed once written.
+        """
+        self.log.info("Protocol %s: transforming dataset %s",
+                      protocol.id, dataset.id)
+        data, context = self.__retrieve_extracted_data(dataset)
+        self.__write_batches(
+            self.__transform_batches(dataset, data, context), fileobj)
 
-    def __execute_step(self):
-        super().execute_step()
-        data, context = self.__retrieve_extracted_data()
-        transformed_data = self.transform(data, context)
-        self.check_format(transformed_data)
-        self.__save_transformed_data(data)
+    @staticmethod
+    def transformed_data_key(protocol: DatasourceProtocol,
+                             dataset: DatasourceDataset,
+                             output_format: str) -> str:
+        """ Returns the key of the transformed file of a dataset. """
+        _, file_name = os.path.split(dataset.data_path_archive)
+        stem, _ = os.path.splitext(file_name)
+        return protocol.generate_datalake_path(
+            dataset_id=dataset.id,
+            step="transform",
+            suffix=f"{stem}.{output_format}")
+
+    def __transform_batches(self, dataset, data, context):
+        dataset_column = {}
+        if self.dataset_id_column:
+            dataset_column = {self.dataset_id_column: dataset.id}
+        for batch in self.metrics.timed_iter("read", data):
+            with self.metrics.timer("transform"):
+                if self.columnar:
+                    transformed_batches = to_record_batches(
+                        self.transform_batch(
+                            broadcast_context(batch, context), context))
+                else:
+                    transformed_batches = [self.transform(batch, context)]
+            self.metrics.increment("rows", len(batch))
+            for transformed_batch in transformed_batches:
+                with self.metrics.timer("validate"):
+                    is_valid = self.check_format(transformed_batch)
+                if not is_valid:
+                    # TODO better not valid data exception handling
+                    raise Exception("Transformed data invalid.")
+                if not dataset_column:
+                    yield transformed_batch
+                elif self.columnar:
+                    yield broadcast_context(transformed_batch, dataset_column)
+                else:
+                    yield [dict(record, **dataset_column)
+                           for record in transformed_batch]
+
+    def __transform_dataset(self, protocol: DatasourceProtocol,
+                            dataset: DatasourceDataset):
+        self.log.info("Protocol %s: transforming dataset %s",
+                      protocol.id, dataset.id)
+        data, context = self.__retrieve_extracted_data(dataset)
+        self.__save_transformed_data(
+            protocol, dataset,
+            self.__transform_batches(dataset, data, context))
+        dataset.process_t_timestamp = datetime.now(timezone.utc)
+        with self.metrics.timer("dataset_update"):
+            self._datasource_hook.update_dataset(dataset)
+
+    def __record_failure(self, dataset_id: str, error):
+        """ Record a dataset whose transformation failed in
+        ``failed_datasets``. """
+        self.log.error("Dataset %s: transformation failed: %s",
+                       dataset_id, error)
+        self.metrics.increment("datasets_failed")
+        self.failed_datasets.append({
+            "dataset": dataset_id,
+            "error": repr(error)
+        })
+
+    def execute_step(self):
+        protocols = {protocol.id: protocol for protocol
+                     in getattr(self.datasource, 'protocols', [])}
+        if not protocols:
+            return True
+        self.failed_datasets = []
+        datasets = self._datasource_hook.retrieve_pending_datasets(
+            list(protocols), step="transform")
+        for dataset in datasets:
+            # Read it first: a failed update expires the dataset
+            dataset_id = dataset.id
+            try:
+                self.__transform_dataset(
+                    protocols[str(dataset.datasource_protocol_id)], dataset)
+            except Exception as error:  # pylint: disable=broad-except
+                self.__record_failure(dataset_id, error)
+        if self.failed_datasets:
+            raise Exception(
+                f"{len(self.failed_datasets)} dataset(s) could not be "
+                "transformed: " + ", ".join(
+                    failure["dataset"] for failure in self.failed_datasets))
+        return True
 
     def transform(self, data, context=None):
         """ Transformation logic of data with optional context.
+
+        Arguments:
+            data {list} -- A batch of records, as dicts by column name.
+            context {dict} -- The context saved by the extract step.
+
+        Returns:
+            list: The transformed records.
+        """
+        raise NotImplementedError()
+
+    def transform_batch(self, batch, context=None):
+        """ Vectorized transformation logic of data, used instead of
+        :meth:`transform` when :attr:`columnar` is set.
+
+        Arguments:
+            batch {:class:`pyarrow.RecordBatch`} -- A batch of rows, with
+                the context as constant columns.
+            context {dict} -- The context saved by the extract step.
+
+        Returns:
+            :class:`pyarrow.RecordBatch` or :class:`pyarrow.Table` -- The
+                transformed rows.
         """
         raise NotImplementedError()
 
     def check_format(self, data):
-        """ Check format of transformed data.
+        """ Check format of transformed data. By default, columnar batches
+        are validated against :attr:`schema`.
         Returns:
             bool: whether or not the format is right.
         """
-        raise NotImplementedError()
+        if not self.columnar or self.schema is None:
+            raise NotImplementedError()
+        errors = self.schema.validate(data)
+        for error in errors:
+            self.log.error("Invalid transformed data: %s", error)
+        return not errors
 
     def create_context(self, files):
         """ Create metadata context files. """
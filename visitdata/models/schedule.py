@@ -0,0 +1,142 @@
+""" Evaluation of the protocols cron schedules (``protocol_period``). """
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from cronex import CronExpression
+
+
+@lru_cache(maxsize=None)
+def parse_period(protocol_period: str) -> CronExpression:
+    """ Parse a cron expression once per process.
+
+    Arguments:
+        protocol_period {str} -- The cron expression.
+
+    Returns:
+        :class:`cronex.CronExpression` -- The parsed expression.
+    """
+    return CronExpression(protocol_period)
+
+
+class ScheduleEvaluator:
+    """ Evaluate protocols schedules against a single frozen timestamp, so
+    that all the protocols of a run agree on what "now" is. Each distinct
+    ``protocol_period`` is only evaluated once.
+
+    Keyword Arguments:
+        now {datetime} -- The evaluation timestamp.
+            (default: {datetime.now()})
+    """
+
+    def __init__(self, now: datetime = None):
+        self.now = (now or datetime.now()).replace(second=0, microsecond=0)
+        self._trigger_time = self.now.timetuple()[0:5]
+        self._due = {}
+
+    def is_due(self, protocol_period: str) -> bool:
+        """ Whether a schedule triggers at the evaluation timestamp.
+        Returns true if ``protocol_period`` is not set.
+
+        Arguments:
+            protocol_period {str} -- The cron expression.
+        """
+        if not protocol_period:
+            return True
+        if protocol_period not in self._due:
+            self._due[protocol_period] = parse_period(
+                protocol_period).check_trigger(self._trigger_time)
+        return self._due[protocol_period]
+
+    def should_execute(self, protocol) -> bool:
+        """ Whether a protocol should be executed at the evaluation
+        timestamp.
+
+        Arguments:
+            protocol {:class:`visitdata.models.sources.DatasourceProtocol`}
+                -- The protocol to evaluate.
+        """
+        return self.is_due(protocol.protocol_period)
+
+    def next_fire_times(self, protocol_period: str, count: int = 1,
+                        horizon: timedelta = timedelta(days=366)) -> list:
+        """ Compute the next times a schedule triggers, starting from the
+        evaluation timestamp (included).
+
+        Arguments:
+            protocol_period {str} -- The cron expression. If it is not set,
+                the schedule triggers every minute.
+
+        Keyword Arguments:
+            count {int} -- Number of fire times to compute. (default: {1})
+            horizon {timedelta} -- How far to look for fire times.
+                (default: {366 days})
+
+        Returns:
+            list -- Up to ``count`` datetimes, in chronological order.
+        """
+        if not protocol_period:
+            return [self.now + timedelta(minutes=index)
+                    for index in range(count)]
+        expression = parse_period(protocol_period)
+        minutes = self.__candidates(expression, 0, 60)
+        hours = self.__candidates(expression, 1, 24)
+        months = self.__candidates(expression, 3, 13)
+        fire_times = []
+        end = self.now + horizon
+        day = self.now.replace(hour=0, minute=0)
+        while day <= end and len(fire_times) < count:
+            if day.month in months:
+                for hour in hours:
+                    for minute in minutes:
+                        fire_time = day.replace(hour=hour, minute=minute)
+                        if fire_time < self.now or fire_time > end:
+                            continue
+                        if expression.check_trigger(
+                                fire_time.timetuple()[0:5]):
+                            fire_times.append(fire_time)
+                            if len(fire_times) == count:
+                                return fire_times
+            day += timedelta(days=1)
+        return fire_times
+
+    @staticmethod
+    def __candidates(expression: CronExpression, field: int, span: int):
+        """ Values a field may take. Fields using periodic atoms (``%``)
+        cannot be expanded statically, every value is a candidate then.
+        """
+        if '%' in expression.string_tab[field] \
+                or not expression.numerical_tab[field]:
+            return range(span)
+        return sorted(expression.numerical_tab[field])
+
+    def due_datasources(self, schedules, until: datetime = None) -> set:
+        """ Find the datasources with at least one protocol to execute,
+        from their schedules only.
+
+        Arguments:
+            schedules {iterable} -- (datasource_id, protocol_period) pairs.
+
+        Keyword Arguments:
+            until {datetime} -- If set, datasources with a protocol firing
+                before this time are also returned. (default: {None})
+
+        Returns:
+            set -- IDs of the datasources with something to execute.
+        """
+        due = set()
+        pending = {}
+        for datasource_id, protocol_period in schedules:
+            if datasource_id in due:
+                continue
+            if self.is_due(protocol_period):
+                due.add(datasource_id)
+            elif until is not None:
+                pending.setdefault(protocol_period, set()).add(datasource_id)
+        for protocol_period, datasource_ids in pending.items():
+            if datasource_ids <= due:
+                continue
+            fire_times = self.next_fire_times(
+                protocol_period, horizon=until - self.now)
+            if fire_times:
+                due.update(datasource_ids)
+        return due
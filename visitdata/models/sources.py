@@ -3,13 +3,20 @@
 import os
 from datetime import datetime
 from uuid import uuid4
-from cronex import CronExpression
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import (
+    BigInteger, Boolean, Column, Integer, String, ForeignKey, DateTime,
+    inspect)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
+from visitdata.models.schedule import parse_period
+
 Base = declarative_base()
 
+# Source types of the protocols whose files are mirrored to our FTP S3
+# folder, instead of being extracted from their source
+MIRRORED_SOURCE_TYPES = (None, "", "s3", "ftp")
+
 
 class Organisation(Base):
     __tablename__ = 'organisation'
@@ -61,21 +68,41 @@ class DatasourceProtocol(Base):
         with current time. Used to determine if the extraction
         process should be executed.
         Returns true if protocol_period value is not set.
+        Use :class:`visitdata.models.schedule.ScheduleEvaluator` to
+        evaluate several protocols against the same time.
 
         Returns:
             bool -- True if the extract process should be executed.
         """
         if not self.protocol_period:
             return True
-        cexpr = CronExpression(self.protocol_period)
+        cexpr = parse_period(self.protocol_period)
         return cexpr.check_trigger(datetime.now().timetuple()[0:5])
 
+    @property
+    def is_mirrored(self) -> bool:
+        """ Whether the files of the protocol are extracted from the FTP S3
+        mirror, rather than from their source (see
+        :mod:`visitdata.models.hooks.extractors`).
+        """
+        return (self.source_type or "").lower() in MIRRORED_SOURCE_TYPES
+
+    @property
+    def source_root(self):
+        """ Source folder shared by the protocols of the same source: the
+        folder of the organisation in the FTP S3 mirror, or the root of the
+        connection of other sources.
+        """
+        if not self.is_mirrored:
+            return ""
+        return (f"{os.getenv('VD_S3_FTP_PREFIX')}"
+                f"/client-{self.organisation_id}/")
+
     @property
     def source_path(self):
-        # TODO implement other sources
-        path = (f"{os.getenv('VD_S3_FTP_PREFIX')}"
-                f"/client-{self.organisation_id}"
-                f"/{self.data_path}")
+        """ Folder of the protocol files in their source, or listing
+        endpoint of HTTP sources. """
+        path = f"{self.source_root}{self.data_path or ''}"
         return path
 
     def generate_datalake_path(self, dataset_id: int, step: str, suffix=None):
@@ -124,6 +151,41 @@ class DatasourceDataset(Base):
     organisation = relationship(
         "Organisation", back_populates="datasets")
 
+    def detached_copy(self) -> "DatasourceDataset":
+        """ Returns a copy of the dataset with the same columns, attached to
+        no session, so that it can be handed to another thread. """
+        return DatasourceDataset(**{
+            column.key: getattr(self, column.key)
+            for column in inspect(DatasourceDataset).column_attrs})
+
+
+class DatasetFingerprint(Base):
+    """ Representation of datasource_dataset_fingerprint table.
+
+    Identifies the content of extracted files, to detect files extracted
+    again under another name. Duplicates are recorded as links to the
+    dataset of the original file. The table is created by
+    ``migrations/0001_datasource_dataset_fingerprint.sql``.
+    """
+    __tablename__ = 'datasource_dataset_fingerprint'
+
+    id = Column(String,
+                primary_key=True,
+                default=lambda x: str(uuid4()),
+                auto_increment=False)
+    datasource_protocol_id = Column(
+        String, ForeignKey("datasource_protocol.id"))
+    datasource_dataset_id = Column(
+        String, ForeignKey("datasource_dataset.id"))
+    etag = Column(String)
+    size = Column(BigInteger)
+    content_hash = Column(String)
+    source_key = Column(String)
+    duplicate = Column(Boolean)
+    created_timestamp = Column(DateTime)
+
+    dataset = relationship("DatasourceDataset")
+
 
 class DataTask(Base):
     """ Representation of datahub_task table. """
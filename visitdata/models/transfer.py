@@ -0,0 +1,406 @@
+""" Transfer engine used to copy objects to the datalake S3, with multipart
+copies, retries of failed parts and throughput metrics.
+"""
+import asyncio
+import io
+import os
+import random
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+MAX_PARTS = 10000
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Errors which will not be fixed by retrying the request
+FATAL_ERROR_CODES = ('AccessDenied', 'NoSuchBucket', 'NoSuchKey',
+                     'NoSuchUpload', 'InvalidRequest')
+
+
+class TransferConfig:
+    """ Settings of the transfer engine. Arguments which are not provided
+    are read from environment variables.
+
+    Keyword Arguments:
+        multipart_threshold {int} -- Size in bytes from which objects are
+            copied part by part. (default: ``VD_S3_MULTIPART_THRESHOLD``
+            or 64MB)
+        multipart_chunksize {int} -- Size in bytes of each part.
+            (default: ``VD_S3_MULTIPART_CHUNKSIZE`` or 64MB)
+        max_concurrency {int} -- Number of parts copied concurrently.
+            (default: ``VD_S3_MAX_CONCURRENCY`` or 10)
+        max_attempts {int} -- Number of attempts for each request.
+            (default: ``VD_S3_MAX_ATTEMPTS`` or 5)
+        backoff {float} -- Base delay in seconds between two attempts,
+            doubled after each attempt. (default: ``VD_S3_RETRY_BACKOFF``
+            or 0.5)
+    """
+
+    def __init__(self, multipart_threshold=None, multipart_chunksize=None,
+                 max_concurrency=None, max_attempts=None, backoff=None):
+        self.multipart_threshold = int(
+            multipart_threshold
+            or os.getenv('VD_S3_MULTIPART_THRESHOLD') or 64 * 1024 * 1024)
+        self.multipart_chunksize = max(MIN_PART_SIZE, int(
+            multipart_chunksize
+            or os.getenv('VD_S3_MULTIPART_CHUNKSIZE') or 64 * 1024 * 1024))
+        self.max_concurrency = int(
+            max_concurrency or os.getenv('VD_S3_MAX_CONCURRENCY') or 10)
+        self.max_attempts = int(
+            max_attempts or os.getenv('VD_S3_MAX_ATTEMPTS') or 5)
+        self.backoff = float(
+            backoff or os.getenv('VD_S3_RETRY_BACKOFF') or 0.5)
+
+
+def call_with_retry(config: TransferConfig, method, *args, stats=None,
+                    **kwargs):
+    """ Call ``method`` until it succeeds or ``config.max_attempts`` is
+    reached, waiting longer between each attempt.
+
+    Arguments:
+        config {TransferConfig} -- Retry settings.
+        method {callable} -- The request to send.
+
+    Keyword Arguments:
+        stats {TransferStats} -- Metrics to count the attempts in.
+            (default: {None})
+    """
+    for attempt in range(1, config.max_attempts + 1):
+        if stats is not None:
+            stats.attempts += 1
+        try:
+            return method(*args, **kwargs)
+        except (BotoCoreError, ClientError) as error:
+            if attempt == config.max_attempts or not is_retryable(error):
+                raise
+            delay = config.backoff * 2 ** (attempt - 1)
+            time.sleep(delay + random.uniform(0, delay))
+    return None
+
+
+async def async_call_with_retry(config: TransferConfig, method, *args,
+                                stats=None, **kwargs):
+    """ Coroutine counterpart of :func:`call_with_retry`, awaiting
+    ``method`` until it succeeds, without blocking the event loop between
+    attempts.
+    """
+    for attempt in range(1, config.max_attempts + 1):
+        if stats is not None:
+            stats.attempts += 1
+        try:
+            return await method(*args, **kwargs)
+        except (BotoCoreError, ClientError) as error:
+            if attempt == config.max_attempts or not is_retryable(error):
+                raise
+            delay = config.backoff * 2 ** (attempt - 1)
+            await asyncio.sleep(delay + random.uniform(0, delay))
+    return None
+
+
+def part_ranges(size: int, config: TransferConfig) -> list:
+    """ Split an object into the byte ranges of its multipart copy, of
+    ``config.multipart_chunksize`` bytes, or more if the object would
+    otherwise have too many parts.
+
+    Returns:
+        list -- (first, last) inclusive byte offsets of each part.
+    """
+    chunksize = max(config.multipart_chunksize, -(-size // MAX_PARTS))
+    return [(start, min(start + chunksize, size) - 1)
+            for start in range(0, size, chunksize)]
+
+
+def is_retryable(error) -> bool:
+    """ Whether a failed request may succeed if it is sent again. """
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code')
+        return code not in FATAL_ERROR_CODES
+    return True
+
+
+class TransferStats:
+    """ Metrics of the transfer of one object.
+
+    Attributes:
+        key (str): Destination key of the object.
+        size (int): Number of bytes transferred.
+        seconds (float): Duration of the whole transfer.
+        part_latencies (list): Duration in seconds of each part, in order.
+        attempts (int): Number of requests sent, retries included.
+    """
+
+    def __init__(self, key: str, size: int = 0):
+        self.key = key
+        self.size = size
+        self.seconds = 0.0
+        self.part_latencies = []
+        self.attempts = 0
+
+    @property
+    def bytes_per_second(self) -> float:
+        """ Average throughput of the transfer. """
+        if not self.seconds:
+            return 0.0
+        return self.size / self.seconds
+
+    def to_dict(self) -> dict:
+        """ Returns the metrics as a JSON serialisable dict. """
+        return {
+            'key': self.key,
+            'size': self.size,
+            'seconds': self.seconds,
+            'bytes_per_second': self.bytes_per_second,
+            'part_latencies': self.part_latencies,
+            'attempts': self.attempts
+        }
+
+
+class TransferEngine:
+    """ Copy objects between S3 buckets.
+
+    Copies within the same account are always done server-side: small
+    objects with a single CopyObject request, large objects with a multipart
+    upload whose parts are copied with UploadPartCopy. Copies from another
+    account stream each part through the worker with GetObject and
+    UploadPart, as the destination credentials cannot read the source:
+    small objects with a :class:`MultipartUploadWriter`, large objects with
+    ranged reads.
+
+    Each failed request or part is retried with an exponential backoff,
+    without copying the parts which already succeeded again.
+
+    Arguments:
+        client {botocore.client.S3} -- Client of the destination account.
+
+    Keyword Arguments:
+        config {TransferConfig} -- Transfer settings. (default: {None})
+    """
+
+    def __init__(self, client, config: TransferConfig = None):
+        self.client = client
+        self.config = config or TransferConfig()
+
+    def copy(self, bucket_source: str, key_source: str,
+             bucket_dest: str, key_dest: str, size: int = None,
+             source_client=None) -> TransferStats:
+        """ Copy an object.
+
+        Arguments:
+            bucket_source {str} -- Bucket of the object to copy.
+            key_source {str} -- Key of the object to copy.
+            bucket_dest {str} -- Bucket to copy the object to.
+            key_dest {str} -- Key of the copied object.
+
+        Keyword Arguments:
+            size {int} -- Size of the object, requested if not provided.
+                (default: {None})
+            source_client {botocore.client.S3} -- Client of the source
+                account if it is not the destination account. The object
+                is then streamed through the worker. (default: {None})
+
+        Returns:
+            TransferStats -- Metrics of the transfer.
+        """
+        read_client = source_client or self.client
+        if size is None:
+            size = self.__retry(
+                None, read_client.head_object,
+                Bucket=bucket_source, Key=key_source)['ContentLength']
+        stats = TransferStats(key_dest, size)
+        start = time.monotonic()
+        if size < self.config.multipart_threshold:
+            if source_client is None:
+                part_start = time.monotonic()
+                self.__retry(stats, self.client.copy_object,
+                             CopySource={'Bucket': bucket_source,
+                                         'Key': key_source},
+                             Bucket=bucket_dest, Key=key_dest)
+                stats.part_latencies.append(time.monotonic() - part_start)
+            else:
+                self.__stream_object(stats, source_client, bucket_source,
+                                     key_source, bucket_dest, key_dest)
+        else:
+            self.__multipart_copy(stats, bucket_source, key_source,
+                                  bucket_dest, key_dest, source_client)
+        stats.seconds = time.monotonic() - start
+        return stats
+
+    def __stream_object(self, stats, source_client, bucket_source,
+                        key_source, bucket_dest, key_dest):
+        """ Stream an object of another account through a
+        :class:`MultipartUploadWriter`, whose requests are retried, and add
+        its requests and part latencies to ``stats``. """
+        body = self.__retry(stats, source_client.get_object,
+                            Bucket=bucket_source, Key=key_source)['Body']
+        writer = MultipartUploadWriter(
+            self.client, bucket_dest, key_dest, config=self.config)
+        try:
+            with writer:
+                shutil.copyfileobj(body, writer, 1024 * 1024)
+        finally:
+            body.close()
+            stats.attempts += writer.stats.attempts
+            stats.part_latencies.extend(writer.stats.part_latencies)
+
+    def __multipart_copy(self, stats, bucket_source, key_source,
+                         bucket_dest, key_dest, source_client):
+        upload_id = self.__retry(
+            stats, self.client.create_multipart_upload,
+            Bucket=bucket_dest, Key=key_dest)['UploadId']
+        ranges = part_ranges(stats.size, self.config)
+        stats.part_latencies = [None] * len(ranges)
+
+        def copy_part(part_number):
+            first, last = ranges[part_number - 1]
+            part_start = time.monotonic()
+            if source_client is None:
+                response = self.__retry(
+                    stats, self.client.upload_part_copy,
+                    CopySource={'Bucket': bucket_source, 'Key': key_source},
+                    CopySourceRange=f"bytes={first}-{last}",
+                    Bucket=bucket_dest, Key=key_dest,
+                    UploadId=upload_id, PartNumber=part_number)
+                etag = response['CopyPartResult']['ETag']
+            else:
+                etag = self.__retry(
+                    stats, self.__stream_part, source_client,
+                    bucket_source, key_source, first, last,
+                    bucket_dest, key_dest, upload_id, part_number)
+            stats.part_latencies[part_number - 1] = \
+                time.monotonic() - part_start
+            return {'ETag': etag, 'PartNumber': part_number}
+
+        try:
+            with ThreadPoolExecutor(
+                    max_workers=self.config.max_concurrency) as executor:
+                parts = list(executor.map(
+                    copy_part, range(1, len(ranges) + 1)))
+            self.__retry(stats, self.client.complete_multipart_upload,
+                         Bucket=bucket_dest, Key=key_dest, UploadId=upload_id,
+                         MultipartUpload={'Parts': parts})
+        except Exception:
+            self.client.abort_multipart_upload(
+                Bucket=bucket_dest, Key=key_dest, UploadId=upload_id)
+            raise
+
+    def __stream_part(self, source_client, bucket_source, key_source,
+                      first, last, bucket_dest, key_dest, upload_id,
+                      part_number) -> str:
+        body = source_client.get_object(
+            Bucket=bucket_source, Key=key_source,
+            Range=f"bytes={first}-{last}")['Body'].read()
+        return self.client.upload_part(
+            Body=body, Bucket=bucket_dest, Key=key_dest,
+            UploadId=upload_id, PartNumber=part_number)['ETag']
+
+    def __retry(self, stats, method, *args, **kwargs):
+        return call_with_retry(
+            self.config, method, *args, stats=stats, **kwargs)
+
+
+class MultipartUploadWriter(io.RawIOBase):
+    """ Writable file object uploading what is written to S3 part by
+    part, so that the whole object is never held in memory. Objects smaller
+    than a part are uploaded with a single PutObject request.
+
+    The object is only created when the writer is closed without error.
+
+    Arguments:
+        client {botocore.client.S3} -- S3 client.
+        bucket_name {str} -- Bucket of the object.
+        key {str} -- Key of the object.
+
+    Keyword Arguments:
+        config {TransferConfig} -- Part size (``multipart_chunksize``) and
+            retry settings. (default: {None})
+    """
+
+    def __init__(self, client, bucket_name: str, key: str,
+                 config: TransferConfig = None):
+        super().__init__()
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.config = config or TransferConfig()
+        self.stats = TransferStats(key)
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+        self._start = time.monotonic()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.stats.size
+
+    def write(self, data):
+        self._buffer.extend(data)
+        self.stats.size += len(data)
+        while len(self._buffer) >= self.config.multipart_chunksize:
+            part = bytes(self._buffer[:self.config.multipart_chunksize])
+            del self._buffer[:self.config.multipart_chunksize]
+            self.__upload_part(part)
+        return len(data)
+
+    def __upload_part(self, body: bytes):
+        if self._upload_id is None:
+            self._upload_id = call_with_retry(
+                self.config, self.client.create_multipart_upload,
+                stats=self.stats, Bucket=self.bucket_name, Key=self.key
+            )['UploadId']
+        part_number = len(self._parts) + 1
+        part_start = time.monotonic()
+        etag = call_with_retry(
+            self.config, self.client.upload_part, stats=self.stats,
+            Body=body, Bucket=self.bucket_name, Key=self.key,
+            UploadId=self._upload_id, PartNumber=part_number)['ETag']
+        self.stats.part_latencies.append(time.monotonic() - part_start)
+        self._parts.append({'ETag': etag, 'PartNumber': part_number})
+
+    def close(self):
+        """ Upload the remaining data and create the object. """
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                part_start = time.monotonic()
+                call_with_retry(
+                    self.config, self.client.put_object, stats=self.stats,
+                    Body=bytes(self._buffer), Bucket=self.bucket_name,
+                    Key=self.key)
+                self.stats.part_latencies.append(
+                    time.monotonic() - part_start)
+            else:
+                if self._buffer:
+                    self.__upload_part(bytes(self._buffer))
+                call_with_retry(
+                    self.config, self.client.complete_multipart_upload,
+                    stats=self.stats, Bucket=self.bucket_name, Key=self.key,
+                    UploadId=self._upload_id,
+                    MultipartUpload={'Parts': self._parts})
+        except Exception:
+            self.abort()
+            raise
+        self._buffer = bytearray()
+        self.stats.seconds = time.monotonic() - self._start
+        super().close()
+
+    def abort(self):
+        """ Discard what has been written, without creating the object. """
+        if self.closed:
+            return
+        if self._upload_id is not None:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=self.key,
+                UploadId=self._upload_id)
+        self._buffer = bytearray()
+        super().close()
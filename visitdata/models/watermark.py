@@ -0,0 +1,134 @@
+""" Extraction watermarks, stored in ``DatasourceProtocol.source_sync_last``,
+used to only extract the files added since the last run.
+"""
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+class Watermark(namedtuple('Watermark', ['last_modified', 'key'])):
+    """ Position of a file in the extraction order: files are ordered by
+    last modification time, then by key.
+
+    Attributes:
+        last_modified (datetime): Last modification time of the file, in UTC.
+        key (str): Key of the file.
+    """
+    __slots__ = ()
+
+    SEPARATOR = '|'
+
+    @classmethod
+    def parse(cls, value: str):
+        """ Parse a watermark serialized with :meth:`serialize`.
+
+        Arguments:
+            value {str} -- The serialized watermark.
+
+        Returns:
+            Watermark -- The watermark, or None if ``value`` is empty.
+        """
+        if not value:
+            return None
+        last_modified, key = value.split(cls.SEPARATOR, 1)
+        return cls(
+            datetime.strptime(last_modified, DATE_FORMAT).replace(
+                tzinfo=timezone.utc),
+            key)
+
+    @classmethod
+    def of(cls, file):
+        """ Returns the watermark of a file, or None if its last
+        modification time is unknown.
+
+        Arguments:
+            file {:class:`visitdata.models.datasets.VDDataset`} -- The file.
+        """
+        last_modified = getattr(file, 'last_modified', None)
+        if last_modified is None:
+            return None
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        return cls(last_modified.astimezone(timezone.utc),
+                   getattr(file, 'key', file.name))
+
+    def serialize(self) -> str:
+        """ Returns the watermark as a string. """
+        return (f"{self.last_modified.strftime(DATE_FORMAT)}"
+                f"{self.SEPARATOR}{self.key}")
+
+
+class WatermarkTracker:
+    """ Track the files extracted for a protocol during a run, to find how
+    far its watermark can be moved.
+
+    The watermark can only move up to the last succeeded file which is
+    before every failed or unfinished one, and only once the whole source
+    has been listed, as listings are not ordered by modification time.
+
+    Files only visible after a file modified later has moved the watermark,
+    i.e. uploads preserving their modification time, are before it: they
+    are only extracted if they were modified less than ``overlap`` before
+    the watermark. The files of this window which are still listed are
+    extracted again on every run, unless they are deduplicated.
+
+    Arguments:
+        current {Watermark} -- The watermark before the run, if any.
+
+    Keyword Arguments:
+        overlap {timedelta} -- Window before the watermark whose files are
+            still extracted. (default: {no overlap})
+    """
+
+    def __init__(self, current: Watermark = None,
+                 overlap: timedelta = timedelta(0)):
+        self.current = current
+        self.overlap = overlap
+        self.listed = False
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._failed = set()
+        self._succeeded = set()
+
+    def is_new(self, watermark: Watermark) -> bool:
+        """ Whether a file is after the current watermark, or in the
+        overlap window before it. Files without watermark are always
+        considered new.
+        """
+        if watermark is None or self.current is None:
+            return True
+        return (watermark > self.current
+                or watermark.last_modified
+                > self.current.last_modified - self.overlap)
+
+    def started(self, watermark: Watermark):
+        """ Record a file about to be extracted. """
+        if watermark is not None:
+            with self._lock:
+                self._pending.add(watermark)
+
+    def finished(self, watermark: Watermark, success: bool):
+        """ Record the result of the extraction of a file. """
+        if watermark is None:
+            return
+        with self._lock:
+            self._pending.discard(watermark)
+            (self._succeeded if success else self._failed).add(watermark)
+
+    def advanced(self) -> Watermark:
+        """ Returns the new watermark, or None if it cannot move. """
+        with self._lock:
+            if not self.listed:
+                return None
+            blocking = self._pending | self._failed
+            limit = min(blocking) if blocking else None
+            candidates = [watermark for watermark in self._succeeded
+                          if limit is None or watermark < limit]
+        if not candidates:
+            return None
+        new = max(candidates)
+        if self.current is not None and new <= self.current:
+            return None
+        return new
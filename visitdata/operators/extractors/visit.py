@@ -5,7 +5,8 @@ from visitdata.models.operators import ExtractOperator
 class VisitExtractOperator(ExtractOperator):
 
     def __init__(self, *args, **kwargs):
-        super().__init__(task_id="visit_extract", *args, **kwargs)
+        kwargs.setdefault("task_id", "visit_extract")
+        super().__init__(*args, **kwargs)
 
     def check_format(self, file):
         return True
@@ -1,50 +1,88 @@
 """VisitData Airflow settings module.
+
+Importing this module has no side effect. Settings are resolved once per
+process by :func:`get_settings`, and the Airflow connections are registered
+by a one-time bootstrap command, run on deployment::
+
+    python -m visitdata.settings
 """
-import os
+import functools
 import json
-from dotenv import load_dotenv
-from airflow import settings
-from airflow.models import Connection
-
-# Load environment variables from .env file
-load_dotenv()
-
-session = settings.Session()
-
-# Setting up Visit Data S3 and Redshift Connections
-CONNECTIONS = [
-    Connection(
-        conn_id="VD_S3",
-        conn_type="s3",
-        login=os.getenv('VD_S3_ACCESS_KEY'),
-        password=os.getenv('VD_S3_SECRET_KEY'),
-        extra=json.dumps({"default_bucket": os.getenv('VD_S3_DEFAULT_BUCKET')})
-    ),
-
-    Connection(
-        conn_id="VD_RS",
-        conn_type="redshift+psycopg2",
-        host=os.getenv('VD_RS_HOST'),
-        login=os.getenv('VD_RS_USERNAME'),
-        password=os.getenv('VD_RS_PASSWORD'),
-        schema=os.getenv('VD_RS_DATABASE'),
-        port=os.getenv('VD_RS_PORT')
-    )
-]
-
-for conn in CONNECTIONS:
-    # Removing old connections as Airflow would
-    # save multiple connections with same ID
-    session.query(Connection).filter(
-        Connection.conn_id == conn.conn_id).delete()
-    # Add / Re-add the connection
-    session.add(conn)
-    session.commit()
-
-session.close()
-
-# Set S3 prefixes for FTP & DataLake
-os.environ["VD_S3_FTP_PREFIX"] = os.getenv(
-    "VD_S3_FTP_PREFIX", "FileServer/Ftp")
-os.environ["VD_S3_DATALAKE_PREFIX"] = os.getenv(
-    "VD_S3_DATALAKE_PREFIX", "Datalake/Datahub")
+import os
+
+# Default S3 prefixes for FTP & DataLake
+DEFAULTS = {
+    "VD_S3_FTP_PREFIX": "FileServer/Ftp",
+    "VD_S3_DATALAKE_PREFIX": "Datalake/Datahub",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_settings() -> dict:
+    """ Load environment variables from the .env file and set the defaults,
+    once per process.
+
+    Returns:
+        dict -- The VisitData settings, by environment variable name.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+    for key, value in DEFAULTS.items():
+        os.environ[key] = os.getenv(key, value)
+    return {key: value for key, value in os.environ.items()
+            if key.startswith("VD_")}
+
+
+def get_connections() -> list:
+    """ Build the Visit Data S3 and Redshift Connections from the settings.
+
+    Returns:
+        list -- The :class:`airflow.models.Connection`.
+    """
+    from airflow.models import Connection
+    settings = get_settings()
+    return [
+        Connection(
+            conn_id="VD_S3",
+            conn_type="s3",
+            login=settings.get('VD_S3_ACCESS_KEY'),
+            password=settings.get('VD_S3_SECRET_KEY'),
+            extra=json.dumps(
+                {"default_bucket": settings.get('VD_S3_DEFAULT_BUCKET')})
+        ),
+
+        Connection(
+            conn_id="VD_RS",
+            conn_type="redshift+psycopg2",
+            host=settings.get('VD_RS_HOST'),
+            login=settings.get('VD_RS_USERNAME'),
+            password=settings.get('VD_RS_PASSWORD'),
+            schema=settings.get('VD_RS_DATABASE'),
+            port=settings.get('VD_RS_PORT')
+        )
+    ]
+
+
+def bootstrap():
+    """ Register the Visit Data connections in the Airflow metadata
+    database, replacing the existing ones, in a single transaction.
+    """
+    from airflow import settings
+    from airflow.models import Connection
+    connections = get_connections()
+    session = settings.Session()
+    try:
+        # Removing old connections as Airflow would
+        # save multiple connections with same ID
+        session.query(Connection).filter(Connection.conn_id.in_(
+            [conn.conn_id for conn in connections])).delete(
+                synchronize_session=False)
+        # Add / Re-add the connections
+        session.add_all(connections)
+        session.commit()
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    bootstrap()